@@ -1,7 +1,7 @@
 from datetime import datetime
 import logging
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, UniqueConstraint, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 
@@ -11,7 +11,8 @@ Base = declarative_base()
 log = logging.getLogger(__name__)
 
 
-event_types = ('start', 'command', 'response', 'exception', 'completion')
+event_types = ('start', 'command', 'response', 'exception', 'completion',
+               'step', 'result', 'lock', 'unlock', 'branch', 'preempt', 'trace')
 
 
 class MissionData(Base):
@@ -20,7 +21,9 @@ class MissionData(Base):
     name = Column(String, unique=True, nullable=False)
     script_id = Column(Integer, ForeignKey('scripts.id'))
     active = Column(Boolean, default=False)
+    # some runs of the mission have been archived
     archived = Column(Boolean, default=False)
+    run_count = Column(Integer, default=0)
 
     script = relationship('Script', foreign_keys=[script_id])
 
@@ -41,8 +44,9 @@ class Script(Base):
 class Run(Base):
     __tablename__ = 'runs'
     id = Column(Integer, primary_key=True)
-    mission_id = Column(Integer, ForeignKey('missions.id'))
+    mission_id = Column(Integer, ForeignKey('missions.id'), index=True)
     script_id = Column(Integer, ForeignKey('scripts.id'))
+    start_time = Column(DateTime, default=datetime.now, index=True)
 
     mission = relationship('MissionData', backref=backref('runs', order_by=id.desc()))
     script = relationship('Script', backref=backref('runs', order_by=id.desc()))
@@ -51,8 +55,8 @@ class Run(Base):
 class Event(Base):
     __tablename__ = 'events'
     id = Column(Integer, primary_key=True)
-    run_id = Column(Integer, ForeignKey('runs.id'))
-    timestamp = Column(DateTime, default=datetime.now)
+    run_id = Column(Integer, ForeignKey('runs.id'), index=True)
+    timestamp = Column(DateTime, default=datetime.now, index=True)
     event_type_id = Column(Integer, ForeignKey('event_types.id'))
     event = Column(String)
 
@@ -60,15 +64,60 @@ class Event(Base):
     type = relationship('EventType')
 
 
+class ArchivedRun(Base):
+    """
+    Runs moved to the run archive, by the file and offset of the gzip member holding them
+    """
+    __tablename__ = 'archived_runs'
+    run_id = Column(Integer, primary_key=True)
+    mission_id = Column(Integer, ForeignKey('missions.id'), index=True)
+    start_time = Column(DateTime, index=True)
+    file = Column(String, nullable=False)
+    offset = Column(Integer, nullable=False)
+
+
 class EventType(Base):
     __tablename__ = 'event_types'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
 
 
+def upgrade_db(engine):
+    """
+    Add the columns and indexes introduced after a table was first created
+    """
+    inspector = inspect(engine)
+    added = set()
+    for table in Base.metadata.tables.values():
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                log.info('Adding column %s.%s', table.name, column.name)
+                engine.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                               (table.name, column.name, column.type.compile(engine.dialect)))
+                added.add((table.name, column.name))
+
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                log.info('Creating index %s', index.name)
+                index.create(engine)
+
+    if ('missions', 'run_count') in added:
+        engine.execute('UPDATE missions SET run_count = '
+                       '(SELECT count(*) FROM runs WHERE runs.mission_id = missions.id)')
+
+    # runs created before start_time was added start with their first event,
+    # also repairs databases upgraded before the backfill was added
+    engine.execute('UPDATE runs SET start_time = '
+                   '(SELECT min(timestamp) FROM events WHERE events.run_id = runs.id) '
+                   'WHERE start_time IS NULL')
+
+
 def create_db(app):
     log.info('Creating database')
     Base.metadata.create_all(app.engine)
+    upgrade_db(app.engine)
     session = app.Session()
 
     for event in event_types:
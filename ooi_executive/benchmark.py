@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+Load test the executive against a local fake instrument agent.
+
+Synthetic missions are built from the example mission shapes, scheduled every
+--period seconds with app.scheduler for --duration seconds and run to
+completion. The results are printed and written as JSON to --output so runs
+of different versions can be compared.
+
+    python -m ooi_executive.benchmark --missions 100 --duration 60 --output before.json
+"""
+from __future__ import print_function
+
+from datetime import datetime
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import yaml
+from apscheduler.events import EVENT_JOB_SUBMITTED
+from sqlalchemy import func
+
+from ooi_executive import app, components, tracing
+from ooi_executive.backing_store import Run, Event, EventType
+from ooi_executive.fake_agent import FakeAgentServer
+from ooi_executive.metrics import distribution
+from ooi_executive.mission import Mission
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'example_missions')
+DEFAULT_SHAPES = ('mission4.yml', 'parallel_acquire_status.yml', 'periodic_acquire_status_fanout.yml', 'mission2.yml')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the executive against a fake instrument agent')
+    parser.add_argument('--missions', type=int, default=20, help='number of synthetic missions')
+    parser.add_argument('--shapes', nargs='+', default=[os.path.join(EXAMPLE_DIR, shape) for shape in DEFAULT_SHAPES],
+                        help='mission scripts the synthetic missions are copied from, in turn')
+    parser.add_argument('--drivers', type=int, default=20,
+                        help='number of fake drivers shared by the missions, fewer drivers means more contention')
+    parser.add_argument('--period', type=int, default=1, help='seconds between the scheduled runs of each mission')
+    parser.add_argument('--duration', type=float, default=10, help='seconds the missions stay scheduled')
+    parser.add_argument('--drain', type=float, default=60, help='seconds to wait for runs in progress at the end')
+    parser.add_argument('--sleep-scale', type=float, default=0.0, help='multiplier applied to sleep steps')
+    parser.add_argument('--latency', type=float, default=0.01, help='fake agent response time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra fake agent response time')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of commands failing with a driver error')
+    parser.add_argument('--contention', type=float, default=0.0,
+                        help='fraction of lock requests refused as locked by another owner')
+    parser.add_argument('--seed', type=int, help='random seed of the fake agent')
+    parser.add_argument('--database', help='database URI, defaults to a temporary sqlite database')
+    parser.add_argument('--output', default='benchmark.json', help='file the JSON results are written to')
+    parser.add_argument('--log-level', default='ERROR')
+    return parser.parse_args(argv)
+
+
+def _map_values(value, func, key=None):
+    """
+    Copy a parsed script, replacing every value by func(key, value)
+    """
+    value = func(key, value)
+    if isinstance(value, dict):
+        return {k: _map_values(v, func, k) for k, v in value.iteritems()}
+    if isinstance(value, list):
+        return [_map_values(v, func, key) for v in value]
+    return value
+
+
+def synthetic_missions(shapes, count, drivers, period, sleep_scale):
+    """
+    Copy the mission shapes into count uniquely named missions
+    :param drivers: the driver names of each copy are replaced by names from a pool of this many fake drivers
+    :return: list of mission scripts
+    """
+    templates = []
+    for path in shapes:
+        with open(path) as f:
+            templates.append((os.path.splitext(os.path.basename(path))[0], yaml.safe_load(f)))
+
+    scripts = []
+    for i in range(count):
+        shape, template = templates[i % len(templates)]
+        pool = max(drivers, len(template['drivers']))
+        names = {driver: 'BENCH-%03d' % ((i + j) % pool) for j, driver in enumerate(template['drivers'])}
+
+        def replace(key, value):
+            if isinstance(value, basestring):
+                return names.get(value, value)
+            if key == 'sleep':
+                return value * sleep_scale
+            return value
+
+        mission = _map_values(template, replace)
+        mission['name'] = 'bench_%04d_%s' % (i, shape)
+        mission['schedule'] = {'second': '*/%d' % period}
+        mission.pop('priority', None)
+        scripts.append(yaml.safe_dump(mission, default_flow_style=False))
+    return scripts
+
+
+def setup(database_uri):
+    """
+    Start the executive components, without reading OMS alerts or serving the REST API
+    """
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    # the JMS triggers of missions are registered with a reader connected to an in-memory broker
+    app.config['OMS_SERVER'] = 'memory://'
+    components.start(jms=False, http=False)
+
+
+def rss():
+    """
+    Resident memory of this process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # peak rather than current on platforms without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _busy(missions):
+    # a run holds its instrument scheduler request from submission until its drivers are released,
+    # while it waits for its drivers, locks them, executes and sleeps
+    return any(mission.name in app.instrument_scheduler.requests or
+               app.scheduler.get_job(mission._resume_job_id()) is not None
+               for mission in missions) or any(app.job_router.running_jobs().values())
+
+
+def run(args):
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)-5s %(name)-30s %(message)s')
+
+    agent = FakeAgentServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            contention=args.contention, seed=args.seed)
+    agent.start()
+    app.config['IA_HOST'] = '127.0.0.1'
+    app.config['IA_PORT'] = agent.port
+
+    database_uri = args.database
+    path = None
+    if database_uri is None:
+        fd, path = tempfile.mkstemp(suffix='.db', prefix='benchmark')
+        os.close(fd)
+        database_uri = 'sqlite:///' + path
+
+    setup(database_uri)
+    stopped = False
+
+    lag = []
+
+    def record_lag(event):
+        for run_time in event.scheduled_run_times:
+            lag.append((datetime.now(run_time.tzinfo) - run_time).total_seconds())
+    app.scheduler.add_listener(record_lag, EVENT_JOB_SUBMITTED)
+
+    try:
+        scripts = synthetic_missions(args.shapes, args.missions, args.drivers, args.period, args.sleep_scale)
+        memory_before = rss()
+        load_start = time.time()
+        missions = [Mission(script=script) for script in scripts]
+        load_time = time.time() - load_start
+        memory_after = rss()
+        app.missions = {mission.id: mission for mission in missions}
+
+        start = time.time()
+        for mission in missions:
+            mission.activate()
+        time.sleep(args.duration)
+        for mission in missions:
+            mission.deactivate()
+
+        deadline = time.time() + args.drain
+        while _busy(missions) and time.time() < deadline:
+            time.sleep(0.1)
+        elapsed = time.time() - start
+        drained = not _busy(missions)
+        # waits for the runs writing their last events after releasing their drivers
+        components.stop()
+        stopped = True
+
+        results = collect(missions, elapsed, lag)
+        results['memory'] = {
+            'rss_bytes': memory_after,
+            'per_mission_bytes': (memory_after - memory_before) / float(len(missions)) if missions else 0,
+        }
+        results['load_seconds'] = load_time
+        results['agent'] = agent.stats()
+        results['drained'] = drained
+    finally:
+        if not stopped:
+            components.stop()
+        agent.stop()
+        if path is not None:
+            os.remove(path)
+
+    results['started'] = datetime.fromtimestamp(start).isoformat()
+    results['python'] = sys.version.split()[0]
+    results['config'] = {k: v for k, v in vars(args).iteritems() if k not in ('output', 'log_level')}
+    return results
+
+
+def collect(missions, elapsed, lag):
+    """
+    Gather the results of a benchmark from the database
+    :param elapsed: seconds from activating the missions until every run completed
+    :param lag: scheduler lag in seconds of each scheduled job
+    """
+    mission_ids = [mission.id for mission in missions]
+    session = app.Session()
+    try:
+        run_ids = [run_id for run_id, in session.query(Run.id).filter(Run.mission_id.in_(mission_ids))]
+        counts = dict(session.query(EventType.name, func.count(Event.id))
+                      .join(Event, Event.event_type_id == EventType.id)
+                      .filter(Event.run_id.in_(run_ids)).group_by(EventType.name))
+        steps = []
+        requests = []
+        for event, in session.query(Event.event).join(EventType, Event.event_type_id == EventType.id)\
+                .filter(EventType.name == 'trace').filter(Event.run_id.in_(run_ids)):
+            for span in tracing.decode(json.loads(event)):
+                if span['kind'] == 'step':
+                    steps.append(span['duration'])
+                elif span['kind'] == 'http':
+                    requests.append(span['duration'])
+    finally:
+        session.close()
+
+    writer = app.event_writer
+    return {
+        'elapsed_seconds': elapsed,
+        'runs': {
+            'submitted': len(lag),
+            'started': len(run_ids),
+            'completed': counts.get('completion', 0),
+            'failed': counts.get('exception', 0),
+            'per_second': counts.get('completion', 0) / elapsed,
+        },
+        'step_seconds': distribution(steps),
+        'request_seconds': distribution(requests),
+        'scheduler_lag_seconds': distribution(lag),
+        'db': {
+            'events': writer.events_written,
+            'events_per_second': writer.events_written / elapsed,
+            'commits': writer.flush_count,
+            'commits_per_second': writer.flush_count / elapsed,
+            'mean_commit_seconds': writer.total_flush_time / writer.flush_count if writer.flush_count else 0,
+            'max_commit_seconds': writer.max_flush_time,
+            'events_by_type': counts,
+        },
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    runs = results['runs']
+    print('%d missions, %.1f s: %d runs completed (%.2f/s), %d failed, %d skipped' %
+          (args.missions, results['elapsed_seconds'], runs['completed'], runs['per_second'], runs['failed'],
+           runs['submitted'] - runs['started']))
+    for name in ('step_seconds', 'request_seconds', 'scheduler_lag_seconds'):
+        stats = results[name]
+        if stats['count']:
+            print('%-22s p50 %.4f  p90 %.4f  p99 %.4f  max %.4f' %
+                  (name, stats['p50'], stats['p90'], stats['p99'], stats['max']))
+    print('db: %(events_per_second).1f events/s, %(commits_per_second).2f commits/s' % results['db'])
+    print('memory: %.0f bytes per mission' % results['memory']['per_mission_bytes'])
+    print('results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+import logging
+import re
+
+from ooi_executive.policies import ErrorPolicy
+from ooi_executive.shared import Tags, CompileException
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+
+class Condition(object):
+    def __init__(self, condition):
+        self.variable = condition.get('variable')
+        self.value = condition.get('value')
+        self.comparator = condition.get('comparator', 'equal')
+        self.equal = self.comparator == 'equal'
+
+    def evaluate(self, variables):
+        return (variables.get(self.variable) == self.value) == self.equal
+
+    def __repr__(self):
+        return '%s %s %r' % (self.variable, self.comparator, self.value)
+
+
+class Step(object):
+    """
+    A compiled mission step
+    :param source: the step as written in the mission script, recorded in step events
+    :param index: position of the step in its block
+    :param error_policy: resolved ErrorPolicy for the step
+    """
+    def __init__(self, source, index, error_policy):
+        self.source = source
+        self.index = index
+        self.error_policy = error_policy
+
+    @property
+    def sources(self):
+        """
+        Script steps executed by this step, each reported in step and result events
+        """
+        return [self.source]
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.source)
+
+
+class CommandStep(Step):
+    """
+    A driver command bound to the executor which will run it
+    :param command: executor command name
+    :param target: driver the command is sent to
+    :param call: callable executing the command with pre-built arguments
+    :param store: variable receiving the value of the response, if any
+    :param args: executor command arguments following the target
+    """
+    def __init__(self, source, index, error_policy, command, target, timeout, call, store=None, args=()):
+        super(CommandStep, self).__init__(source, index, error_policy)
+        self.command = command
+        self.target = target
+        self.timeout = timeout
+        self.call = call
+        self.store = store
+        self.args = args
+
+
+class SetStep(CommandStep):
+    """
+    Adjacent set steps on one driver sent as a single set_resource request
+    :param parts: the merged set steps, in script order
+    """
+    def __init__(self, parts, executor):
+        first = parts[0]
+        kwargs = {}
+        for part in parts:
+            kwargs.update(part.args[0])
+        args = (kwargs,)
+        super(SetStep, self).__init__(first.source, first.index, first.error_policy, 'set_resource', first.target,
+                                      first.timeout, executor.prepare('set_resource', first.target, args, first.timeout),
+                                      args=args)
+        self.parts = parts
+
+    @property
+    def sources(self):
+        return [part.source for part in self.parts]
+
+
+class SleepStep(Step):
+    def __init__(self, source, index, error_policy, duration):
+        super(SleepStep, self).__init__(source, index, error_policy)
+        self.duration = duration
+
+
+class BlockStep(Step):
+    """
+    Execute another block, linked directly once all blocks are compiled
+    """
+    def __init__(self, source, index, error_policy, block_name, loop, condition):
+        super(BlockStep, self).__init__(source, index, error_policy)
+        self.block_name = block_name
+        self.block = None
+        self.loop = loop
+        self.condition = condition
+
+
+class Branch(object):
+    """
+    One block of a parallel step
+    :param driver: driver the branch was generated for by a fan-out mission, reported in branch events
+    """
+    def __init__(self, block_name, error_policy, driver=None):
+        self.block_name = block_name
+        self.block = None
+        self.error_policy = error_policy
+        self.driver = driver
+
+
+class ParallelStep(Step):
+    """
+    Execute several blocks concurrently
+    :param branches: list of Branch
+    :param max_concurrency: maximum number of branches executing at once
+    :param join: 'all' to wait for every branch, 'fail_fast' to start no new branches after a failure
+    """
+    def __init__(self, source, index, error_policy, branches, max_concurrency, join):
+        super(ParallelStep, self).__init__(source, index, error_policy)
+        self.branches = branches
+        self.max_concurrency = max_concurrency
+        self.join = join
+
+
+class Block(object):
+    """
+    :param error_policy: declared policy of the block as a whole, None if the block passes errors on
+    """
+    def __init__(self, label, steps, error_policy=None):
+        self.label = label
+        self.steps = steps
+        self.error_policy = error_policy
+
+    def __len__(self):
+        return len(self.steps)
+
+
+class Program(object):
+    """
+    A validated mission script compiled for execution
+    """
+    def __init__(self, blocks, entry, error_policy, drivers, verbose=False, debug=False, priority=0):
+        self.blocks = blocks
+        self.entry = entry
+        self.error_policy = error_policy
+        self.drivers = drivers
+        self.priority = priority
+        self.verbose = verbose
+        self.debug = debug
+
+    def steps(self):
+        """
+        Iterate over (block, step) for every step of the program, including inline blocks
+        """
+        return _walk(self.blocks.values())
+
+
+def _walk(blocks):
+    for block in blocks:
+        for step in block.steps:
+            yield block, step
+            if isinstance(step, BlockStep) and 'sequence' in step.source:
+                for nested in _walk([step.block]):
+                    yield nested
+
+
+def block_targets(block, visited=None):
+    """
+    All drivers targeted by the steps of a block and the blocks it executes
+    """
+    visited = visited if visited is not None else set()
+    if block is None or id(block) in visited:
+        return set()
+    visited.add(id(block))
+
+    targets = set()
+    for step in block.steps:
+        if isinstance(step, CommandStep):
+            targets.add(step.target)
+        elif isinstance(step, BlockStep):
+            targets |= block_targets(step.block, visited)
+        elif isinstance(step, ParallelStep):
+            for branch in step.branches:
+                targets |= block_targets(branch.block, visited)
+    return targets
+
+
+DRIVER_PLACEHOLDER = '{driver}'
+
+
+def driver_label(label, driver):
+    return '%s:%s' % (label, driver)
+
+
+def _substitute(value, driver):
+    if isinstance(value, basestring):
+        return value.replace(DRIVER_PLACEHOLDER, driver)
+    if isinstance(value, list):
+        return [_substitute(item, driver) for item in value]
+    if isinstance(value, dict):
+        return {key: _substitute(item, driver) for key, item in value.iteritems()}
+    return value
+
+
+def _expand_step(step, driver):
+    step = _substitute(step, driver)
+    if 'block_name' in step:
+        step['block_name'] = driver_label(step['block_name'], driver)
+    if 'sequence' in step:
+        if 'label' in step:
+            step['label'] = driver_label(step['label'], driver)
+        step['sequence'] = [_expand_step(each, driver) for each in step['sequence']]
+    if 'parallel' in step:
+        step['parallel'] = [driver_label(branch, driver) if isinstance(branch, basestring)
+                            else _expand_step(branch, driver) for branch in step['parallel']]
+    return step
+
+
+def expand_template(blocks, driver):
+    """
+    Instantiate the blocks of a fan-out mission for one driver.
+    Every occurrence of {driver} is replaced by the driver and block labels are made unique to the driver.
+    The template is not modified.
+    """
+    expanded = []
+    for block in blocks:
+        instance = {'label': driver_label(block.get('label'), driver),
+                    'sequence': [_expand_step(step, driver) for step in block.get('sequence') or []]}
+        if 'error_policy' in block:
+            instance['error_policy'] = block['error_policy']
+        expanded.append(instance)
+    return expanded
+
+
+def _error_policy(source, default):
+    policy = source.get('error_policy')
+    if policy is None:
+        return default
+    return ErrorPolicy(policy)
+
+
+def _policy_key(policy):
+    return policy.action, policy.count, policy.backoff
+
+
+def _mergeable(previous, step):
+    return (isinstance(previous, CommandStep) and isinstance(step, CommandStep) and
+            previous.command == step.command == 'set_resource' and
+            previous.target == step.target and
+            previous.timeout == step.timeout and
+            _policy_key(previous.error_policy) == _policy_key(step.error_policy))
+
+
+def coalesce_sets(steps, executor):
+    """
+    Merge runs of set steps on the same driver, with the same timeout and error policy, into SetSteps
+    """
+    coalesced = []
+    for step in steps:
+        if coalesced and _mergeable(coalesced[-1], step):
+            previous = coalesced.pop()
+            parts = previous.parts if isinstance(previous, SetStep) else [previous]
+            step = SetStep(parts + [step], executor)
+        coalesced.append(step)
+    return coalesced
+
+
+def compile_sequence(label, sequence, executor, default_policy, max_age=None):
+    steps = [compile_step(step, index, label, executor, default_policy, max_age)
+             for index, step in enumerate(sequence or [])]
+    return Block(label, coalesce_sets(steps, executor))
+
+
+def compile_step(step, index, label, executor, default_policy, max_age=None):
+    error_policy = _error_policy(step, default_policy)
+    condition = step.get('condition')
+    condition = Condition(condition) if condition else None
+
+    # blocks only handle the errors of their steps with a policy of their own,
+    # inheriting the mission policy would repeat its retries at every level of nesting
+    if 'block_name' in step:
+        return BlockStep(step, index, _error_policy(step, None), step['block_name'], step.get('loop', 1), condition)
+
+    if 'sequence' in step:
+        # inline block
+        block_name = step.get('label') or '%s[%d]' % (label, index)
+        block_step = BlockStep(step, index, _error_policy(step, None), block_name, step.get('loop', 1), condition)
+        block_step.block = compile_sequence(block_name, step['sequence'], executor, default_policy, max_age)
+        return block_step
+
+    if 'sleep' in step:
+        return SleepStep(step, index, error_policy, step['sleep'])
+
+    if 'parallel' in step:
+        branches = []
+        for branch in step['parallel']:
+            if isinstance(branch, basestring):
+                branches.append(Branch(branch, ErrorPolicy({})))
+            else:
+                branches.append(Branch(branch['block_name'], ErrorPolicy(branch.get('error_policy', {}))))
+        return ParallelStep(step, index, error_policy, branches,
+                            step.get('max_concurrency', len(branches)), step.get('join', 'all'))
+
+    parsed = executor.parse(step)
+    if parsed is None:
+        raise CompileException('Unknown step type: %r' % step)
+
+    command, target, args, timeout = parsed
+    store = None
+    if command == 'get_state':
+        store = 'driver_state'
+    elif command == 'get_resource':
+        store = step.get('parameter')
+
+    call = executor.prepare(command, target, args, timeout, max_age=step.get('max_age', max_age))
+    return CommandStep(step, index, error_policy, command, target, timeout, call, store, args)
+
+
+def compile_schedule(schedule):
+    if schedule and schedule.get('pattern'):
+        try:
+            re.compile(schedule.get('event'))
+        except re.error as e:
+            raise CompileException('Invalid event pattern %r: %s' % (schedule.get('event'), e))
+
+
+def compile_mission(mission, executor):
+    """
+    Compile a validated mission dictionary
+    :param mission: mission script, already validated against the mission schema
+    :param executor: executor the command steps are bound to
+    :return: Program
+    """
+    error_policy = ErrorPolicy(mission.get('error_policy', {}))
+    compile_schedule(mission.get(Tags.SCHEDULE))
+    drivers = mission.get(Tags.INSTRUMENT, [])
+    fanout = mission.get(Tags.FANOUT)
+
+    templates = mission.get('blocks', [])
+    if fanout is not None:
+        templates = [block for driver in drivers for block in expand_template(templates, driver)]
+
+    blocks = {}
+    for block in templates:
+        label = block.get('label')
+        if label in blocks:
+            raise CompileException('Duplicate block: %r' % label)
+        blocks[label] = compile_sequence(label, block.get('sequence'), executor, error_policy,
+                                         mission.get('max_age'))
+        blocks[label].error_policy = _error_policy(block, None)
+
+    if fanout is not None:
+        # the run executes the mission block of every driver as one parallel step
+        # errors are handled per driver, by default with the mission error policy
+        branch_policy = _error_policy(fanout, error_policy)
+        branches = [Branch(driver_label(Tags.MISSION, driver), branch_policy, driver) for driver in drivers]
+        step = ParallelStep(fanout, 0, ErrorPolicy({}), branches,
+                            fanout.get('max_concurrency', len(branches)), fanout.get('join', 'all'))
+        blocks[Tags.MISSION] = Block(Tags.MISSION, [step])
+
+    for block, step in _walk(blocks.values()):
+        if isinstance(step, BlockStep) and step.block is None:
+            step.block = blocks.get(step.block_name)
+            if step.block is None:
+                raise CompileException('Unknown block: %r in block %r' % (step.block_name, block.label))
+            if step.error_policy is None:
+                step.error_policy = step.block.error_policy
+        elif isinstance(step, ParallelStep):
+            for branch in step.branches:
+                branch.block = blocks.get(branch.block_name)
+                if branch.block is None:
+                    raise CompileException('Unknown block: %r in block %r' % (branch.block_name, block.label))
+
+    for block, step in _walk(blocks.values()):
+        if isinstance(step, ParallelStep):
+            for branch in step.branches:
+                unlocked = block_targets(branch.block) - set(drivers)
+                if unlocked:
+                    raise CompileException('Parallel branch %r uses drivers not locked by the mission: %s' %
+                                           (branch.block_name, ', '.join(sorted(unlocked))))
+
+    return Program(blocks, blocks.get(Tags.MISSION), error_policy, drivers,
+                   verbose=mission.get('verbose', False), debug=mission.get('debug', False),
+                   priority=mission.get('priority', 0))
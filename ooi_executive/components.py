@@ -0,0 +1,112 @@
+from concurrent import futures
+from apscheduler.events import EVENT_JOB_ADDED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_SUBMITTED
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive import app
+from ooi_executive.backing_store import create_db
+from ooi_executive.event_stream import event_stream
+from ooi_executive.event_writer import EventWriter
+from ooi_executive.http_pool import session_pool
+from ooi_executive.instrument_lock import LockManager
+from ooi_executive.instrument_scheduler import InstrumentScheduler
+from ooi_executive.jms_reader import JmsReader
+from ooi_executive.job_router import JobRouter, PoolExecutor
+from ooi_executive.mission_import import ValidationPool
+from ooi_executive.retention import Retention, RetentionPolicy, RunArchive
+from ooi_executive.schedule_analyzer import ScheduleAnalyzer
+from ooi_executive.simulation import LatencyModel
+
+__author__ = 'petercable'
+
+
+def start(jms=True, http=True):
+    """
+    Start the components missions run on, connected to app.config['SQLALCHEMY_DATABASE_URI']
+    :param jms: start reading OMS alerts, otherwise the JMS triggers of missions are registered but never fire
+    :param http: start the components only used by the REST API, the import pool and the schedule analyzer
+    """
+    if http:
+        # forks the import workers, before any thread is started
+        app.validation_pool = ValidationPool(app.config['IMPORT_POOL_SIZE'])
+        app.validation_pool.start()
+
+    session_pool.configure(app.config)
+    event_stream.configure(app.config)
+
+    app.jms_reader = JmsReader()
+    if jms:
+        app.jms_reader.start()
+
+    app.scheduler_pools = {'default': futures.ThreadPoolExecutor(20),
+                           'urgent': futures.ThreadPoolExecutor(app.config['URGENT_POOL_SIZE'])}
+    app.scheduler = BackgroundScheduler()
+    app.scheduler.configure(executors={name: PoolExecutor(pool) for name, pool in app.scheduler_pools.iteritems()},
+                            job_defaults={'max_instances': 1})
+    app.scheduler.start()
+
+    app.engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.Session = sessionmaker(bind=app.engine)
+    create_db(app)
+
+    app.event_writer = EventWriter(app.Session,
+                                   batch_size=app.config['EVENT_BATCH_SIZE'],
+                                   flush_interval=app.config['EVENT_FLUSH_INTERVAL'])
+    app.event_writer.start()
+
+    app.branch_executor = futures.ThreadPoolExecutor(app.config['PARALLEL_POOL_SIZE'])
+
+    app.lock_manager = LockManager(pool_size=app.config['LOCK_POOL_SIZE'],
+                                   ttl=app.config['LOCK_TTL'],
+                                   renew_interval=app.config['LOCK_RENEW_INTERVAL'])
+    app.lock_manager.start()
+
+    app.instrument_scheduler = InstrumentScheduler(pool_size=app.config['RUN_POOL_SIZE'],
+                                                   urgent_pool_size=app.config['URGENT_POOL_SIZE'],
+                                                   urgent_priority=app.config['URGENT_PRIORITY'])
+    app.instrument_scheduler.start()
+
+    if http:
+        app.schedule_analyzer = ScheduleAnalyzer(app.Session, app.config, model_factory=LatencyModel,
+                                                 history=app.config['SCHEDULE_HISTORY_DAYS'],
+                                                 refresh=app.config['SCHEDULE_HISTORY_REFRESH'])
+
+    app.job_router = JobRouter(app.Session, app.scheduler)
+    app.scheduler.add_listener(app.job_router.dispatch,
+                               EVENT_JOB_ADDED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_SUBMITTED)
+
+    app.run_archive = RunArchive(app.config['RETENTION_ARCHIVE_DIR'])
+    app.retention = Retention(app.Session, app.run_archive,
+                              default=RetentionPolicy(app.config['RETENTION_RUNS'], app.config['RETENTION_DAYS']),
+                              batch_size=app.config['RETENTION_BATCH_SIZE'])
+    app.scheduler.add_job(apply_retention, 'interval', seconds=app.config['RETENTION_INTERVAL'],
+                          id='executive:retention', coalesce=True)
+
+
+def stop():
+    """
+    Stop the components started by start, waiting for the work in progress
+    """
+    # the scheduler and the instrument scheduler shut their pools down after the jobs and runs in progress
+    app.scheduler.shutdown()
+    app.jms_reader.should_stop = True
+    app.instrument_scheduler.stop()
+    app.instrument_scheduler.pool.shutdown()
+    app.instrument_scheduler.urgent_pool.shutdown()
+    app.lock_manager.stop()
+    app.event_writer.stop()
+    app.branch_executor.shutdown()
+    validation_pool = getattr(app, 'validation_pool', None)
+    if validation_pool is not None:
+        validation_pool.stop()
+    app.engine.dispose()
+
+
+def apply_retention():
+    policies = {}
+    for mission in app.missions.values():
+        retention = mission.mission.get('retention')
+        if retention is not None:
+            policies[mission.id] = RetentionPolicy(retention.get('runs'), retention.get('days'))
+    app.retention.run(policies)
@@ -5,5 +5,103 @@ IA_PORT = 12572
 LOG_LEVEL = 'DEBUG'
 OMS_SERVER = 'amqp://localhost//'
 
+# sleep steps at least this long (seconds) release their worker thread
+# and resume the run from a scheduled job
+RESUMABLE_SLEEP = True
+RESUMABLE_SLEEP_THRESHOLD = 5
+
+# connection pooling for the instrument agent REST API
+# HTTP_POOL_MAXSIZE connections are kept open per instrument agent host
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 20
+HTTP_POOL_BLOCK = False
+HTTP_KEEP_ALIVE = True
+
+# run events are written in batches by a background thread
+# a batch is written when EVENT_BATCH_SIZE events are pending
+# or EVENT_FLUSH_INTERVAL seconds after the first pending event
+EVENT_BATCH_SIZE = 200
+EVENT_FLUSH_INTERVAL = 1.0
+
+# default and maximum page sizes of the run and event history endpoints
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+
+# worker threads shared by the branches of parallel steps
+PARALLEL_POOL_SIZE = 20
+
+# instrument locks are requested concurrently by LOCK_POOL_SIZE threads
+# locks are leased for LOCK_TTL seconds and renewed every LOCK_RENEW_INTERVAL
+# seconds while held, a LOCK_TTL of 0 requests locks without expiry
+LOCK_POOL_SIZE = 20
+LOCK_TTL = 300
+LOCK_RENEW_INTERVAL = 60
+
+# runs are queued per driver and started by RUN_POOL_SIZE worker threads
+# once no other run holds their drivers
+RUN_POOL_SIZE = 20
+
+# missions with at least URGENT_PRIORITY preempt lower priority runs holding
+# their drivers, and run on URGENT_POOL_SIZE threads reserved for them
+URGENT_PRIORITY = 10
+URGENT_POOL_SIZE = 4
+
+# new missions and mission versions are checked for driver contention with the
+# active missions over SCHEDULE_ANALYSIS_HOURS, and rejected if SCHEDULE_CONFLICTS_REJECTED
+# run durations are estimated from the command latencies of SCHEDULE_HISTORY_DAYS
+# of runs, refitted every SCHEDULE_HISTORY_REFRESH seconds, commands without
+# history take SCHEDULE_COMMAND_SECONDS
+# free driver windows shorter than SCHEDULE_MIN_WINDOW seconds are not reported
+# analyses requested through the API cover at most SCHEDULE_ANALYSIS_MAX_HOURS
+SCHEDULE_ANALYSIS_HOURS = 24
+SCHEDULE_ANALYSIS_MAX_HOURS = 168
+SCHEDULE_CONFLICTS_REJECTED = False
+SCHEDULE_HISTORY_DAYS = 7
+SCHEDULE_HISTORY_REFRESH = 3600
+SCHEDULE_COMMAND_SECONDS = 1.0
+SCHEDULE_MIN_WINDOW = 60
+
+# log records are written to the console and LOG_FILE by a background thread
+# up to LOG_QUEUE_SIZE records wait to be written, more are dropped
+# LOG_ROTATION is None, 'size' (at LOG_MAX_BYTES) or 'time' (LOG_ROTATE_WHEN),
+# keeping LOG_BACKUP_COUNT files, LOG_FORMAT 'json' writes the file as JSON lines
+# each logger may log LOG_RATE_LIMIT records per second at each level, in bursts
+# of up to LOG_RATE_BURST, a LOG_RATE_LIMIT of 0 disables rate limiting
+LOG_FILE = 'executive.log'
+LOG_FORMAT = 'text'
+LOG_QUEUE_SIZE = 10000
+LOG_ROTATION = 'size'
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_ROTATE_WHEN = 'midnight'
+LOG_BACKUP_COUNT = 10
+LOG_RATE_LIMIT = 50
+LOG_RATE_BURST = 200
+
+# the events of the last STREAM_RUNS runs of each mission are kept in memory,
+# up to STREAM_BUFFER_SIZE per run, for the event stream endpoints
+# event streams send a keepalive comment every STREAM_KEEPALIVE seconds and
+# ask disconnected clients to reconnect after STREAM_RETRY seconds, long polls
+# wait at most STREAM_POLL_TIMEOUT seconds for an event
+STREAM_BUFFER_SIZE = 500
+STREAM_RUNS = 3
+STREAM_KEEPALIVE = 15
+STREAM_RETRY = 3
+STREAM_POLL_TIMEOUT = 30
+
+# batches of mission scripts are validated by IMPORT_POOL_SIZE worker processes,
+# or by the request thread if 0, and hold at most IMPORT_MAX_SCRIPTS scripts
+IMPORT_POOL_SIZE = 4
+IMPORT_MAX_SCRIPTS = 1000
+
+# every RETENTION_INTERVAL seconds the runs neither among the last RETENTION_RUNS
+# runs of their mission nor started in the last RETENTION_DAYS days are moved to
+# gzip files under RETENTION_ARCHIVE_DIR, RETENTION_BATCH_SIZE runs at a time
+# a mission script's retention overrides these, None keeps runs forever
+RETENTION_RUNS = None
+RETENTION_DAYS = None
+RETENTION_INTERVAL = 3600
+RETENTION_BATCH_SIZE = 100
+RETENTION_ARCHIVE_DIR = 'archive'
+
 
 SQLALCHEMY_DATABASE_URI = 'sqlite:///executive.db'
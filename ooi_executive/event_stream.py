@@ -0,0 +1,173 @@
+from collections import deque, OrderedDict
+from threading import Condition, Lock
+import json
+import logging
+import time
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+
+def event_id(run_id, seq):
+    return '%d.%d' % (run_id, seq)
+
+
+def parse_event_id(value):
+    """
+    :return: (run id, sequence number) or None if value is not an event id
+    """
+    try:
+        run_id, seq = value.split('.')
+        return int(run_id), int(seq)
+    except (AttributeError, ValueError):
+        return None
+
+
+class RunEvents(object):
+    """
+    Ring buffer of the most recent events of a run, numbered from 0
+    """
+    def __init__(self, run_id, size):
+        self.run_id = run_id
+        self.events = deque(maxlen=size)
+        self.next_seq = 0
+        self.complete = False
+
+    def first_seq(self):
+        return self.next_seq - len(self.events)
+
+    def after(self, seq):
+        """
+        :param seq: last sequence number received, -1 for none
+        :return: events after seq, number of events after seq no longer buffered
+        """
+        first = self.first_seq()
+        skip = max(0, seq + 1 - first)
+        missed = max(0, first - seq - 1)
+        return [self.events[i] for i in xrange(skip, len(self.events))], missed
+
+
+class MissionEvents(object):
+    def __init__(self):
+        self.condition = Condition(Lock())
+        self.runs = OrderedDict()
+
+
+class Batch(object):
+    """
+    Events read from an EventStream
+    :param events: list of (event id, event type, JSON payload)
+    :param last_id: id of the last event read, to resume from
+    :param missed: events no longer buffered, the run history has them
+    :param complete: True once the run read has completed
+    """
+    def __init__(self, events, last_id, missed, complete):
+        self.events = events
+        self.last_id = last_id
+        self.missed = missed
+        self.complete = complete
+
+
+class EventStream(object):
+    """
+    In-memory fan-out of run events to streaming clients.
+
+    The events of the last runs runs of each mission are kept in ring buffers
+    of buffer_size events, already serialized, so any number of clients read
+    them without querying the database. Event ids are '<run id>.<sequence>'
+    and a client resumes after the last id it has seen. Clients block on a
+    condition per mission until an event is published.
+    """
+    def __init__(self, buffer_size=500, runs=3):
+        self.buffer_size = buffer_size
+        self.runs = runs
+        self.lock = Lock()
+        self.missions = {}
+
+    def configure(self, config):
+        self.buffer_size = config.get('STREAM_BUFFER_SIZE', self.buffer_size)
+        self.runs = config.get('STREAM_RUNS', self.runs)
+
+    def _mission(self, mission_id):
+        mission = self.missions.get(mission_id)
+        if mission is None:
+            with self.lock:
+                mission = self.missions.get(mission_id)
+                if mission is None:
+                    mission = self.missions[mission_id] = MissionEvents()
+        return mission
+
+    def publish(self, mission_id, run_id, timestamp, event_type, event, encoded=False):
+        """
+        :param event: event as written to the database
+        :param encoded: event is JSON, otherwise it is sent as a string
+        """
+        mission = self._mission(mission_id)
+        with mission.condition:
+            run = mission.runs.get(run_id)
+            if run is None:
+                run = mission.runs[run_id] = RunEvents(run_id, self.buffer_size)
+                while len(mission.runs) > self.runs:
+                    mission.runs.popitem(last=False)
+            eid = event_id(run_id, run.next_seq)
+            payload = '{"id": "%s", "run_id": %d, "type": %s, "timestamp": "%s", "event": %s}' % (
+                eid, run_id, json.dumps(event_type), timestamp, event if encoded else json.dumps(event))
+            run.events.append((eid, event_type, payload))
+            run.next_seq += 1
+            if event_type == 'completion':
+                run.complete = True
+            mission.condition.notify_all()
+
+    def remove(self, mission_id):
+        with self.lock:
+            self.missions.pop(mission_id, None)
+
+    def has_run(self, mission_id, run_id):
+        mission = self.missions.get(mission_id)
+        return mission is not None and run_id in mission.runs
+
+    def _read(self, mission, run_id, after):
+        if run_id is not None:
+            run = mission.runs.get(run_id)
+            if run is None:
+                return Batch([], None, 0, True)
+            seq = after[1] if after is not None and after[0] == run_id else -1
+            events, missed = run.after(seq)
+            return Batch(events, events[-1][0] if events else None, missed, run.complete)
+
+        runs = mission.runs.values()
+        if after is None:
+            # start with the most recent run
+            runs = runs[-1:]
+        events = []
+        missed = 0
+        for run in runs:
+            if after is not None and run.run_id < after[0]:
+                continue
+            run_events, run_missed = run.after(after[1] if after is not None and run.run_id == after[0] else -1)
+            events.extend(run_events)
+            missed += run_missed
+        return Batch(events, events[-1][0] if events else None, missed, False)
+
+    def read(self, mission_id, run_id=None, after=None, timeout=0):
+        """
+        Events of a mission, or of one of its runs, after an event id
+        :param run_id: only read this run, the batch is complete once the run has completed
+        :param after: (run id, sequence) of the last event received, None for the buffered events of the
+        run, or of the most recent run of the mission
+        :param timeout: seconds to wait for an event if none is buffered
+        :return: Batch
+        """
+        mission = self._mission(mission_id)
+        deadline = time.time() + timeout
+        with mission.condition:
+            while True:
+                batch = self._read(mission, run_id, after)
+                remaining = deadline - time.time()
+                if batch.events or batch.complete or remaining <= 0:
+                    return batch
+                mission.condition.wait(remaining)
+
+
+event_stream = EventStream()
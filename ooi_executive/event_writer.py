@@ -0,0 +1,185 @@
+from datetime import datetime
+from Queue import Queue, Empty
+from threading import Thread, Event as ThreadEvent, Lock
+import logging
+import time
+
+from ooi_executive.backing_store import Event
+from ooi_executive.metrics import registry
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+EVENT_COMMIT_SECONDS = registry.histogram('ooi_event_commit_seconds', 'Time to write and commit a batch of events')
+EVENTS_WRITTEN = registry.counter('ooi_events_written_total', 'Run events written to the database')
+
+
+class _FlushRequest(object):
+    def __init__(self):
+        self.done = ThreadEvent()
+        # events queued before the request which could not be written
+        self.dropped = 0
+
+
+class EventWriter(object):
+    """
+    Write-behind journal for run events.
+
+    Events from all running missions are queued and bulk inserted by a single
+    background thread. A batch is written when batch_size events are pending
+    or flush_interval seconds after the first pending event, whichever comes first.
+    If a batch cannot be inserted its events are inserted one at a time, so only
+    the events the database rejects are dropped.
+    """
+    def __init__(self, session_factory, batch_size=200, flush_interval=1.0):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = Queue()
+        self.thread = None
+        self.running = False
+
+        self.stats_lock = Lock()
+        self.flush_count = 0
+        self.events_written = 0
+        self.events_dropped = 0
+        self.last_flush_time = 0
+        self.max_flush_time = 0
+        self.total_flush_time = 0
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._run, name='event-writer')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        if self.running:
+            request = _FlushRequest()
+            self.running = False
+            self.queue.put(request)
+            self.thread.join()
+
+    def add(self, run_id, event_type_id, event, sync=False):
+        """
+        Queue an event for writing
+        :param sync: block until this event (and all events queued before it) are committed
+        :return: if sync, False if this event or an event queued before it was not written
+        """
+        self.queue.put({'run_id': run_id,
+                        'event_type_id': event_type_id,
+                        'event': event,
+                        'timestamp': datetime.now()})
+        if sync:
+            written = self.flush()
+            if not written:
+                log.error('Event %r of run %r, or an event queued before it, was not written', event_type_id, run_id)
+            return written
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Block until all events queued so far have been written
+        :return: False if an event queued so far could not be written, or was not written before timeout
+        """
+        if not self.running:
+            return False
+        request = _FlushRequest()
+        self.queue.put(request)
+        return request.done.wait(timeout) and not request.dropped
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'flushes': self.flush_count,
+                'events_written': self.events_written,
+                'events_dropped': self.events_dropped,
+                'last_flush_time': self.last_flush_time,
+                'max_flush_time': self.max_flush_time,
+                'mean_flush_time': self.total_flush_time / self.flush_count if self.flush_count else 0,
+            }
+
+    def _run(self):
+        dropped = 0
+        while self.running or not self.queue.empty():
+            rows = []
+            waiters = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except Empty:
+                continue
+
+            deadline = time.time() + self.flush_interval
+            while True:
+                if isinstance(item, _FlushRequest):
+                    waiters.append(item)
+                    break
+                rows.append(item)
+                if len(rows) >= self.batch_size:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except Empty:
+                    break
+
+            dropped += self._write(rows)
+            for waiter in waiters:
+                waiter.dropped = dropped
+                dropped = 0
+                waiter.done.set()
+
+    def _write(self, rows):
+        """
+        Insert rows as one batch, or one row at a time if the batch fails
+        :return: number of rows dropped
+        """
+        if not rows:
+            return 0
+        start = time.time()
+        session = self.session_factory()
+        try:
+            written = self._insert(session, rows)
+        finally:
+            session.close()
+
+        dropped = len(rows) - written
+        if dropped:
+            with self.stats_lock:
+                self.events_dropped += dropped
+        if not written:
+            return dropped
+
+        elapsed = time.time() - start
+        EVENT_COMMIT_SECONDS.observe(elapsed)
+        EVENTS_WRITTEN.inc(value=written)
+        with self.stats_lock:
+            self.flush_count += 1
+            self.events_written += written
+            self.last_flush_time = elapsed
+            self.total_flush_time += elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+        log.debug('Wrote %d events in %.4f secs', written, elapsed)
+        return dropped
+
+    @staticmethod
+    def _insert(session, rows):
+        """
+        :return: number of rows written
+        """
+        try:
+            session.bulk_insert_mappings(Event, rows)
+            session.commit()
+            return len(rows)
+        except Exception as e:
+            session.rollback()
+            if len(rows) == 1:
+                log.exception('Unable to write event %r: %r', rows[0], e)
+                return 0
+            log.error('Unable to write %d events, writing them one at a time (%r)', len(rows), e)
+
+        return sum(EventWriter._insert(session, [row]) for row in rows)
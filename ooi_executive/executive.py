@@ -1,25 +1,36 @@
 from __future__ import print_function
 
 import httplib
+import json
 import logging
 import time
+from collections import Counter
 from uuid import uuid4
-import yaml
 
-from apscheduler.executors.pool import ThreadPoolExecutor
-from apscheduler.schedulers.background import BackgroundScheduler
 from flask import request, jsonify, Response
-from jsonschema import validate, ValidationError
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from yaml.scanner import ScannerError
-
-from ooi_executive import log_manager
-from ooi_executive.jms_reader import JmsReader
-from ooi_executive.mission import Mission
+from jsonschema import ValidationError
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import BadRequest, NotFound, RequestEntityTooLarge
+from yaml import YAMLError
+
+from ooi_executive import components, log_manager
+from ooi_executive.backing_store import MissionData
+from ooi_executive.http_pool import session_pool
+from ooi_executive.event_stream import event_stream, parse_event_id
+from ooi_executive.metrics import registry, pool_sizes
+from ooi_executive.mission import Mission, session_scope
+from ooi_executive.mission_import import read_batch, store_batch
+from ooi_executive.mission_snapshot import mission_snapshot
 from ooi_executive import app
 import mission_schema
-from ooi_executive.shared import MissionNotFoundException
+from ooi_executive.compiler import compile_mission
+from ooi_executive.executors import Executor
+from ooi_executive.read_cache import read_cache
+from ooi_executive.request_args import analysis_args, history_args, number_arg
+from ooi_executive.retention import archived_missions
+from ooi_executive.schedule_analyzer import ScheduledMission, mission_conflicts
+from ooi_executive.script_cache import script_cache, script_hash
+from ooi_executive.shared import MissionNotFoundException, CompileException, ScheduleConflictException
 
 __author__ = 'petercable'
 
@@ -27,24 +38,57 @@ __author__ = 'petercable'
 log_manager.setup()
 log = logging.getLogger(__name__)
 
+SCHEMA_JSON = json.dumps(mission_schema.Mission.get_schema(ordered=True), indent=2)
+SCHEMA_ETAG = script_hash(SCHEMA_JSON)
 
-def setup():
+REQUEST_SECONDS = registry.histogram('ooi_request_seconds', 'API request latency', ('method', 'route', 'status'))
 
-    app.jms_reader = JmsReader()
-    app.jms_reader.start()
 
-    app.scheduler = BackgroundScheduler()
-    app.scheduler.configure(executors={'default': ThreadPoolExecutor(20)}, job_defaults={'max_instances': 1})
-    app.scheduler.start()
+def setup():
+    components.start()
 
-    app.engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
-    app.Session = sessionmaker(bind=app.engine)
+    register_gauges()
 
-    from backing_store import create_db
-    create_db(app)
     app.missions = Mission.load_all()
 
 
+def register_gauges():
+    """
+    Metrics read from the executive components when /metrics is requested
+    """
+    def pools():
+        named = {'branches': app.branch_executor,
+                 'locks': app.lock_manager.pool,
+                 'runs': app.instrument_scheduler.pool,
+                 'urgent_runs': app.instrument_scheduler.urgent_pool}
+        for name, pool in app.scheduler_pools.iteritems():
+            named['scheduler_' + name] = pool
+        return named
+
+    def running_jobs():
+        counts = app.job_router.running_jobs()
+        return {(name,): counts[name] for name in app.scheduler_pools}
+
+    def queues():
+        return {(driver,): stats['depth'] for driver, stats in app.instrument_scheduler.stats().iteritems()}
+
+    def http():
+        return {(agent, kind): value for agent, stats in session_pool.stats().iteritems()
+                for kind, value in stats.iteritems()}
+
+    registry.gauge('ooi_pool_size', 'Worker threads and queued work items of the thread pools',
+                   pool_sizes(pools), ('pool', 'kind'))
+    registry.gauge('ooi_scheduler_running_jobs', 'Scheduler jobs executing', running_jobs, ('executor',))
+    registry.gauge('ooi_scheduler_jobs', 'Jobs in the scheduler', lambda: len(app.scheduler.get_jobs()))
+    registry.gauge('ooi_instrument_queue_depth', 'Runs waiting for each driver', queues, ('driver',))
+    registry.gauge('ooi_event_queue_depth', 'Run events waiting to be written',
+                   lambda: app.event_writer.queue.qsize())
+    registry.gauge('ooi_lock_leases', 'Driver locks held', lambda: len(app.lock_manager.leases))
+    registry.gauge('ooi_read_cache', 'Read cache requests',
+                   lambda: {(kind,): value for kind, value in read_cache.stats().iteritems()}, ('kind',))
+    registry.gauge('ooi_http', 'Instrument agent connection use', http, ('agent', 'kind'))
+
+
 @app.errorhandler(MissionNotFoundException)
 def handle_not_found_exception(error):
     response = {'message': 'not found', 'exception': error}
@@ -54,6 +98,19 @@ def handle_not_found_exception(error):
     return jsonify(response), status_code
 
 
+@app.errorhandler(CompileException)
+def handle_compile_exception(error):
+    log.error('Unable to compile mission: %s', error)
+    return jsonify({'message': 'invalid mission', 'exception': str(error)}), httplib.BAD_REQUEST
+
+
+@app.errorhandler(ScheduleConflictException)
+def handle_schedule_conflict(error):
+    response = {'message': 'schedule conflict', 'exception': str(error)}
+    response.update(error.conflicts)
+    return jsonify(response), httplib.CONFLICT
+
+
 @app.before_request
 def log_request():
     request.start = time.time()
@@ -66,6 +123,8 @@ def log_request_time(response):
     if hasattr(request, 'start') and hasattr(request, 'id'):
         elapsed = time.time() - request.start
         log.debug('REQUEST (%s) finished in %.4f secs', request.id, elapsed)
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, request.method, route, response.status_code)
     return response
 
 
@@ -74,34 +133,138 @@ def check_mission_exists(mission_id):
         raise MissionNotFoundException('Cannot find mission: %r', mission_id)
 
 
+def snapshot_response(etag, body):
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 @app.route('/missions', methods=['GET'])
 def missions():
     state = request.args.get('state')
-    if state == 'active':
-        return jsonify({mid: app.missions[mid].small() for mid in app.missions if app.missions[mid].active})
-    elif state == 'inactive':
-        return jsonify({mid: app.missions[mid].small() for mid in app.missions if not app.missions[mid].active})
-    # elif state == 'archived':
-    # TODO: query database for archived missions
-    #     return jsonify({mid: app.missions[mid].small() for mid in app.missions if not app.missions[mid].script})
+    if state == 'archived':
+        with session_scope() as session:
+            return jsonify(archived_missions(session))
+    if state not in ('active', 'inactive'):
+        state = None
+    return snapshot_response(*mission_snapshot.summaries(state))
+
+
+def scheduled_missions(active_only=True):
+    return [ScheduledMission(mission.name, mission.mission, mission.program)
+            for mission in app.missions.values() if mission.active or not active_only]
 
-    return jsonify({mid: app.missions[mid].small() for mid in app.missions})
+
+def compile_script(script):
+    mission = script_cache.load(script)
+    program = compile_mission(mission, Executor(mission['name'], Mission.DEFAULT_TIMEOUT))
+    return ScheduledMission(mission['name'], mission, program)
+
+
+def check_schedule(script):
+    """
+    Check a new or updated mission script for driver contention with the active missions
+    :raises ScheduleConflictException: on contention, if SCHEDULE_CONFLICTS_REJECTED
+    :return: conflicts found, see schedule_analyzer.mission_conflicts
+    """
+    candidate = compile_script(script)
+    conflicts = app.schedule_analyzer.check(candidate, scheduled_missions())
+    if conflicts and app.config['SCHEDULE_CONFLICTS_REJECTED']:
+        raise ScheduleConflictException(candidate.name, conflicts)
+    return conflicts
 
 
 @app.route('/missions', methods=['POST'])
 def add_mission():
+    conflicts = check_schedule(request.data)
     mission = Mission(script=request.data)
     if mission is None:
         return Response(status=httplib.BAD_REQUEST)
 
     app.missions[mission.id] = mission
-    return jsonify(mission.full())
+    response = mission.full()
+    if conflicts:
+        response['schedule_conflicts'] = conflicts
+    return jsonify(response)
+
+
+def read_request_batch():
+    try:
+        scripts, archive = read_batch(request.data)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    if not scripts:
+        raise BadRequest('No mission scripts found')
+    if len(scripts) > app.config['IMPORT_MAX_SCRIPTS']:
+        raise RequestEntityTooLarge('At most %d mission scripts may be imported at once' %
+                                    app.config['IMPORT_MAX_SCRIPTS'])
+    return scripts, archive
+
+
+def batch_report(scripts):
+    return {'missions': [script.report() for script in scripts],
+            'counts': Counter(script.status for script in scripts)}
+
+
+def check_batch_schedule(scripts):
+    """
+    Check the valid scripts of a batch for driver contention with the active missions and each other
+    The scripts in contention are rejected if SCHEDULE_CONFLICTS_REJECTED
+    """
+    candidates = [ScheduledMission(script.name, script.mission,
+                                   compile_mission(script.mission, Executor(script.name, Mission.DEFAULT_TIMEOUT)))
+                  for script in scripts if script.status is None]
+    if not candidates:
+        return
+    conflicts = app.schedule_analyzer.check_batch(candidates, scheduled_missions())
+    for script in scripts:
+        if script.status is None and script.name in conflicts:
+            script.conflicts = conflicts[script.name]
+            if app.config['SCHEDULE_CONFLICTS_REJECTED']:
+                script.fail('rejected', 'Mission contends with active missions')
+
+
+def load_imported(scripts):
+    """
+    Load, schedule and publish the missions stored from a batch
+    """
+    created = []
+    for script in scripts:
+        if script.status == 'updated' and script.mission_id in app.missions:
+            app.missions[script.mission_id].set_version(script.script_id)
+        elif script.status in ('created', 'updated'):
+            created.append(script.mission_id)
+
+    if created:
+        with session_scope() as session:
+            query = session.query(MissionData).options(joinedload(MissionData.script))
+            for dbobj in query.filter(MissionData.id.in_(created)):
+                mission = Mission(dbobj=dbobj)
+                app.missions[mission.id] = mission
+
+
+@app.route('/missions/import', methods=['POST'])
+def import_missions():
+    scripts, _ = read_request_batch()
+    app.validation_pool.validate(scripts)
+    for script in scripts:
+        if script.mission is not None:
+            script_cache.add(script.text, script.mission)
+
+    check_batch_schedule(scripts)
+    with session_scope() as session:
+        store_batch(session, scripts, activate=request.args.get('activate') == 'true')
+    load_imported(scripts)
+    return jsonify(batch_report(scripts))
 
 
 @app.route('/missions/<int:mission_id>', methods=['GET'])
 def get_mission(mission_id):
     check_mission_exists(mission_id)
-    return jsonify(app.missions[mission_id].full())
+    cached = app.missions[mission_id].snapshot()
+    if cached is None:
+        return jsonify(app.missions[mission_id].full())
+    return snapshot_response(*cached)
 
 
 @app.route('/missions/<int:mission_id>', methods=['DELETE'])
@@ -143,8 +306,16 @@ def get_version(mission_id, version_id):
 @app.route('/missions/<int:mission_id>/versions/<int:version_id>', methods=['PUT'])
 def set_version(mission_id, version_id):
     check_mission_exists(mission_id)
+    script = app.missions[mission_id].get_version(version_id)
+    if script is None:
+        return Response(status=httplib.BAD_REQUEST)
+
+    conflicts = check_schedule(script)
     if app.missions[mission_id].set_version(version_id):
-        return jsonify(app.missions[mission_id].full())
+        response = app.missions[mission_id].full()
+        if conflicts:
+            response['schedule_conflicts'] = conflicts
+        return jsonify(response)
     else:
         return Response(status=httplib.BAD_REQUEST)
 
@@ -152,20 +323,141 @@ def set_version(mission_id, version_id):
 @app.route('/missions/<int:mission_id>/runs')
 def get_runs(mission_id):
     check_mission_exists(mission_id)
-    runs = app.missions[mission_id].runs()
-    return jsonify({'runs': runs})
+    kwargs = history_args()
+    kwargs['descending'] = request.args.get('order') == 'desc'
+    kwargs['archived'] = request.args.get('archived') == 'true'
+    runs, next_id = app.missions[mission_id].runs(**kwargs)
+    return jsonify({'runs': runs, 'next': next_id})
 
 
 @app.route('/missions/<int:mission_id>/runs/<int:run_id>')
 def get_mission_run(mission_id, run_id):
     check_mission_exists(mission_id)
-    run = app.missions[mission_id].get_run(run_id)
-    return jsonify({'run': run})
+    kwargs = history_args()
+    event_types = request.args.getlist('type')
+    kwargs['event_types'] = [t for types in event_types for t in types.split(',')]
+    run, next_id = app.missions[mission_id].get_run(run_id, **kwargs)
+    return jsonify({'run': run, 'next': next_id})
+
+
+@app.route('/missions/<int:mission_id>/runs/<int:run_id>/timeline')
+def get_run_timeline(mission_id, run_id):
+    check_mission_exists(mission_id)
+    timeline = app.missions[mission_id].timeline(run_id)
+    if timeline is None:
+        raise MissionNotFoundException('Cannot find run: %r' % run_id)
+    return jsonify(timeline)
+
+
+@app.route('/missions/analysis')
+def get_schedule_analysis():
+    missions = scheduled_missions(active_only=request.args.get('state') != 'all')
+    return jsonify(app.schedule_analyzer.analyze(missions, **analysis_args()))
+
+
+@app.route('/missions/analysis', methods=['POST'])
+def analyze_mission():
+    try:
+        candidate = compile_script(request.data)
+    except (ValidationError, YAMLError) as e:
+        raise BadRequest('Invalid mission: %s' % e)
+    missions = [mission for mission in scheduled_missions() if mission.name != candidate.name]
+    results = app.schedule_analyzer.analyze([candidate] + missions, **analysis_args())
+    results['mission'] = mission_conflicts(results, candidate.name)
+    return jsonify(results)
+
+
+def stream_position():
+    """
+    Event id to resume after, from the Last-Event-ID header of a reconnecting event source or the after argument
+    """
+    value = request.headers.get('Last-Event-ID') or request.args.get('after')
+    if value is None:
+        return None
+    position = parse_event_id(value)
+    if position is None:
+        raise BadRequest('Invalid event id: %r' % value)
+    return position
+
+
+def check_run_buffered(mission_id, run_id):
+    if run_id is not None and not event_stream.has_run(mission_id, run_id):
+        raise NotFound('No live events for run %d, read them from /missions/%d/runs/%d' %
+                       (run_id, mission_id, run_id))
+
+
+def stream_events(mission_id, run_id=None):
+    check_mission_exists(mission_id)
+    check_run_buffered(mission_id, run_id)
+    position = stream_position()
+    keepalive = app.config['STREAM_KEEPALIVE']
+
+    def generate(position):
+        yield 'retry: %d\n\n' % (app.config['STREAM_RETRY'] * 1000)
+        while True:
+            batch = event_stream.read(mission_id, run_id, position, timeout=keepalive)
+            if batch.missed:
+                yield 'event: missed\ndata: %d\n\n' % batch.missed
+            for event_id, event_type, payload in batch.events:
+                yield 'id: %s\nevent: %s\ndata: %s\n\n' % (event_id, event_type, payload)
+            if batch.last_id is not None:
+                position = parse_event_id(batch.last_id)
+            if batch.complete:
+                return
+            if not batch.events:
+                yield ': keepalive\n\n'
+
+    return Response(generate(position), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def poll_events(mission_id, run_id=None):
+    check_mission_exists(mission_id)
+    check_run_buffered(mission_id, run_id)
+    timeout = min(number_arg('timeout', float, app.config['STREAM_POLL_TIMEOUT']), app.config['STREAM_POLL_TIMEOUT'])
+    batch = event_stream.read(mission_id, run_id, stream_position(), timeout=max(0, timeout))
+    # the buffered events are already serialized
+    body = '{"events": [%s], "last_id": %s, "missed": %d, "complete": %s}' % (
+        ', '.join(payload for _, _, payload in batch.events), json.dumps(batch.last_id), batch.missed,
+        json.dumps(batch.complete))
+    return Response(body, mimetype='application/json')
+
+
+@app.route('/missions/<int:mission_id>/events')
+def get_mission_events(mission_id):
+    return poll_events(mission_id)
+
+
+@app.route('/missions/<int:mission_id>/events/stream')
+def stream_mission_events(mission_id):
+    return stream_events(mission_id)
+
+
+@app.route('/missions/<int:mission_id>/runs/<int:run_id>/events')
+def get_run_events(mission_id, run_id):
+    return poll_events(mission_id, run_id)
+
+
+@app.route('/missions/<int:mission_id>/runs/<int:run_id>/events/stream')
+def stream_run_events(mission_id, run_id):
+    return stream_events(mission_id, run_id)
 
 
 @app.route('/missions/schema')
 def get_schema():
-    return jsonify(mission_schema.Mission.get_schema(ordered=True))
+    response = Response(SCHEMA_JSON, mimetype='application/json')
+    response.set_etag(SCHEMA_ETAG)
+    return response.make_conditional(request)
+
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/instruments/queues')
+def get_instrument_queues():
+    return jsonify(app.instrument_scheduler.stats())
 
 
 @app.route('/missions/validate', methods=['POST'])
@@ -174,10 +466,19 @@ def validate_mission():
     if mission is None:
         return Response(status=httplib.BAD_REQUEST)
 
+    scripts, archive = read_request_batch()
+    if archive or len(scripts) > 1:
+        app.validation_pool.validate(scripts)
+        for script in scripts:
+            if script.status is None:
+                script.status = 'valid'
+        valid = all(script.status == 'valid' for script in scripts)
+        return jsonify(batch_report(scripts)), httplib.OK if valid else httplib.BAD_REQUEST
+
     try:
-        mission_data = yaml.load(mission)
-        validate(mission_data, mission_schema.Mission.get_schema())
-    except (ValidationError, ScannerError) as e:
+        mission_data = script_cache.load(mission)
+        compile_mission(mission_data, Executor(mission_data['name'], Mission.DEFAULT_TIMEOUT))
+    except (ValidationError, YAMLError, CompileException) as e:
         log.error(e)
         return Response(status=httplib.BAD_REQUEST)
     return Response()
@@ -1,12 +1,20 @@
+import functools
 import json
-import requests
 import logging
+import time
+from http_pool import session_pool
+from metrics import registry
+import tracing
+from read_cache import read_cache as shared_read_cache
 from shared import InstrumentException, TimeoutException, CommandArgumentException, LockException
 
 __author__ = 'petercable'
 
 log = logging.getLogger(__name__)
 
+COMMAND_SECONDS = registry.histogram('ooi_command_seconds', 'Instrument agent request latency',
+                                     ('command', 'driver'))
+
 
 class RestResponse(object):
     def __init__(self, response, timeout_ok=False):
@@ -39,6 +47,27 @@ class RestResponse(object):
         return {k: self.__dict__[k] for k in self.__dict__ if not k.startswith('_')}
 
 
+# step keyword, executor method and the step fields passed to the method after the target
+STEP_COMMANDS = (
+    ('execute', 'execute_resource', lambda step: (step.get('command'), step.get('kwargs', {}))),
+    ('reset', 'reset', lambda step: ()),
+    ('ping', 'ping', lambda step: ()),
+    ('discover', 'discover', lambda step: ()),
+    ('get_state', 'get_state', lambda step: ()),
+    ('get', 'get_resource', lambda step: (step.get('parameter'),)),
+    ('set', 'set_resource', lambda step: (dict(step['parameters']) if 'parameters' in step
+                                          else {step.get('parameter'): step.get('value')},)),
+    ('disconnect', 'disconnect', lambda step: ()),
+    ('connect', 'connect', lambda step: ()),
+    ('set_init_params', 'set_init_params', lambda step: (step.get('config'),)),
+    ('configure', 'configure', lambda step: (step.get('config'),)),
+)
+
+# commands which do not change the driver, the responses of reads may be cached
+READ_COMMANDS = {'get_state', 'get_resource'}
+SAFE_COMMANDS = READ_COMMANDS | {'ping'}
+
+
 class Executor(object):
     """
     The base executor class contains the argument parsing and dispatch code
@@ -48,31 +77,31 @@ class Executor(object):
         self.mission_id = mission_id
         self.default_timeout = default_timeout
 
+    def parse(self, step):
+        """
+        Find the executor command for a step
+        :return: (command, target, args, timeout) or None if the step is not a driver command
+        """
+        for keyword, command, get_args in STEP_COMMANDS:
+            if keyword in step:
+                timeout = step.get('timeout', self.default_timeout)
+                return command, step[keyword], get_args(step), timeout
+        return None
+
+    def prepare(self, command, target, args, timeout, max_age=None):
+        """
+        Bind a command to its arguments
+        :param max_age: accept a cached response up to this many seconds old, for read commands
+        :return: callable which executes the command and returns its response
+        """
+        return functools.partial(getattr(self, command), target, *(args + (timeout,)))
+
     def command(self, step):
-        if 'execute' in step:
-            return self._execute_resource(step)
-        if 'reset' in step:
-            return self._reset(step)
-        if 'ping' in step:
-            return self._ping(step)
-        if 'discover' in step:
-            return self._discover(step)
-        if 'get_state' in step:
-            return self._get_state(step)
-        if 'get' in step:
-            return self._get_resource(step)
-        if 'set' in step:
-            return self._set_resource(step)
-        if 'disconnect' in step:
-            return self._disconnect(step)
-        if 'connect' in step:
-            return self._connect(step)
-        if 'set_init_params' in step:
-            return self._set_init_params(step)
-        if 'configure' in step:
-            return self._configure(step)
-
-        log.error('UNKNOWN STEP: %r', step)
+        parsed = self.parse(step)
+        if parsed is None:
+            log.error('UNKNOWN STEP: %r', step)
+            return
+        return self.prepare(*parsed)()
 
     def _extract_and_validate(self, step):
         target = step.get('target')
@@ -86,121 +115,151 @@ class Executor(object):
             return target, args, kwargs, timeout
         raise CommandArgumentException
 
-    def _execute_resource(self, step):
-        target = step.get('execute')
-        command = step.get('command')
-        kwargs = step.get('kwargs', {})
-        timeout = step.get('timeout', self.default_timeout)
-        return self.execute_resource(target, command, kwargs, timeout)
-
     def execute_resource(self, target, command, kwargs, timeout):
         raise NotImplemented
 
-    def _reset(self, step):
-        target = step.get('reset')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.reset(target, timeout)
-
     def reset(self, target, timeout):
         raise NotImplemented
 
-    def _ping(self, step):
-        target = step.get('ping')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.ping(target, timeout)
-
     def ping(self, target, timeout):
         raise NotImplemented
 
-    def _discover(self, step):
-        target = step.get('discover')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.discover(target, timeout)
-
     def discover(self, target, timeout):
         raise NotImplemented
 
-    def _get_state(self, step):
-        target = step.get('get_state')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.get_state(target, timeout)
-
     def get_state(self, target, timeout):
         raise NotImplemented
 
-    def _get_resource(self, step):
-        target = step.get('get')
-        parameter = step.get('parameter')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.get_resource(target, parameter, timeout)
-
     def get_resource(self, target, parameter, timeout):
         raise NotImplemented
 
-    def _set_resource(self, step):
-        target = step.get('set')
-        parameter = step.get('parameter')
-        value = step.get('value')
-        timeout = step.get('timeout', self.default_timeout)
-        kwargs = {parameter: value}
-        return self.set_resource(target, kwargs, timeout)
-
     def set_resource(self, target, kwargs, timeout):
         raise NotImplemented
 
-    def _disconnect(self, step):
-        target = step.get('disconnect')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.disconnect(target, timeout)
-
     def disconnect(self, target, timeout):
         raise NotImplemented
 
-    def _connect(self, step):
-        target = step.get('connect')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.connect(target, timeout)
-
     def connect(self, target, timeout):
         raise NotImplemented
 
-    def _set_init_params(self, step):
-        target = step.get('set_init_params')
-        config = step.get('config')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.set_init_params(target, config, timeout)
-
     def set_init_params(self, target, config, timeout):
         raise NotImplemented
 
-    def _configure(self, step):
-        target = step.get('configure')
-        config = step.get('config')
-        timeout = step.get('timeout', self.default_timeout)
-        return self.configure(target, config, timeout)
-
     def configure(self, target, config, timeout):
         raise NotImplemented
 
-    def lock(self, instruments):
+    def lock_instrument(self, instrument, ttl=None):
+        """
+        Lock (or renew the lock on) one instrument
+        :param ttl: lease in seconds after which the instrument agent releases the lock
+        :raises LockException: if the instrument is locked by another owner
+        """
         raise NotImplemented
 
-    def unlock(self, instruments):
+    def unlock_instrument(self, instrument):
         raise NotImplemented
 
+    def lock(self, instruments, ttl=None):
+        for instrument in instruments:
+            self.lock_instrument(instrument, ttl)
+
+    def unlock(self, instruments):
+        for instrument in instruments:
+            self.unlock_instrument(instrument)
+
 
 class RestExecutor(Executor):
-    def __init__(self, mission_id, rest_host, rest_port, base_url='instrument/api', timeout=30000):
+    def __init__(self, mission_id, rest_host, rest_port, base_url='instrument/api', timeout=30000, session=None,
+                 read_cache=None):
         super(RestExecutor, self).__init__(mission_id, timeout)
         self.base_url = 'http://%s:%d/%s' % (rest_host, rest_port, base_url)
+        self.session = session or session_pool.get(rest_host, rest_port)
+        self.read_cache = read_cache or shared_read_cache
 
     def _url(self, target, name):
         return '/'.join((self.base_url, target, name))
 
-    def execute_resource(self, target, command, kwargs, timeout):
+    def prepare(self, command, target, args, timeout, max_age=None):
+        """
+        Build the request for a command once, serializing its form arguments
+        :param max_age: read get_state and get_resource through the shared read cache
+        :return: callable which sends the request and returns the RestResponse
+        """
+        method, name, form, timeout_ok = getattr(self, '_' + command)(target, *(args + (timeout,)))
+        url = self._url(target, name)
+        send = functools.partial(self._send, method, url, form, timeout_ok, (command, target))
+        driver = self._url(target, '')
+        if command in READ_COMMANDS:
+            if max_age is not None:
+                return functools.partial(self.read_cache.get, driver, (name, form.get('resource')), send, max_age)
+            return send
+        if command in SAFE_COMMANDS:
+            return send
+        return functools.partial(self._send_and_invalidate, driver, send)
+
+    def _send(self, method, url, form, timeout_ok=False, labels=('unknown', 'unknown')):
+        start = time.time()
+        try:
+            with tracing.child('http', labels[1]):
+                return RestResponse(self.session.request(method, url, data=form), timeout_ok=timeout_ok)
+        finally:
+            COMMAND_SECONDS.observe(time.time() - start, *labels)
+
+    def _send_and_invalidate(self, driver, send):
+        # the driver may change as soon as the command is sent and until it has completed
+        self.read_cache.invalidate(driver)
+        try:
+            return send()
+        finally:
+            self.read_cache.invalidate(driver)
+
+    def _execute_resource(self, target, command, kwargs, timeout):
         form = {'command': json.dumps(command), 'kwargs': json.dumps(kwargs),
                 'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'execute'), data=form))
+        return 'POST', 'execute', form, False
+
+    def _reset(self, target, timeout):
+        form = {'timeout': timeout, 'key': self.mission_id}
+        return 'POST', 'shutdown', form, True
+
+    def _ping(self, target, timeout):
+        form = {'timeout': timeout}
+        return 'POST', 'ping', form, False
+
+    def _discover(self, target, timeout):
+        form = {'timeout': timeout, 'key': self.mission_id}
+        return 'POST', 'discover', form, False
+
+    def _get_state(self, target, timeout):
+        form = {'timeout': timeout, 'key': self.mission_id}
+        return 'GET', 'state', form, False
+
+    def _get_resource(self, target, parameter, timeout):
+        form = {'timeout': timeout, 'resource': json.dumps(parameter), 'key': self.mission_id}
+        return 'GET', 'resource', form, False
+
+    def _set_resource(self, target, kwargs, timeout):
+        form = {'timeout': timeout, 'resource': json.dumps(kwargs), 'key': self.mission_id}
+        return 'POST', 'resource', form, False
+
+    def _disconnect(self, target, timeout):
+        form = {'timeout': timeout, 'key': self.mission_id}
+        return 'POST', 'disconnect', form, False
+
+    def _connect(self, target, timeout):
+        form = {'timeout': timeout, 'key': self.mission_id}
+        return 'POST', 'connect', form, False
+
+    def _set_init_params(self, target, config, timeout):
+        form = {'config': json.dumps(config), 'timeout': timeout, 'key': self.mission_id}
+        return 'POST', 'initparams', form, False
+
+    def _configure(self, target, config, timeout):
+        form = {'config': json.dumps(config), 'timeout': timeout, 'key': self.mission_id}
+        return 'POST', 'configure', form, False
+
+    def execute_resource(self, target, command, kwargs, timeout):
+        return self.prepare('execute_resource', target, (command, kwargs), timeout)()
 
     def reset(self, target, timeout):
         """
@@ -210,57 +269,54 @@ class RestExecutor(Executor):
         :param timeout:
         :return:
         """
-        form = {'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'shutdown'), data=form), timeout_ok=True)
+        return self.prepare('reset', target, (), timeout)()
 
     def ping(self, target, timeout):
-        form = {'timeout': timeout}
-        return RestResponse(requests.post(self._url(target, 'ping'), data=form))
+        return self.prepare('ping', target, (), timeout)()
 
     def discover(self, target, timeout):
-        form = {'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'discover'), data=form))
+        return self.prepare('discover', target, (), timeout)()
 
     def get_state(self, target, timeout):
-        form = {'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.get(self._url(target, 'state'), data=form))
+        return self.prepare('get_state', target, (), timeout)()
 
     def get_resource(self, target, parameter, timeout):
-        form = {'timeout': timeout, 'resource': json.dumps(parameter), 'key': self.mission_id}
-        return RestResponse(requests.get(self._url(target, 'resource'), data=form))
+        return self.prepare('get_resource', target, (parameter,), timeout)()
 
     def set_resource(self, target, kwargs, timeout):
-        form = {'timeout': timeout, 'resource': json.dumps(kwargs), 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'resource'), data=form))
+        return self.prepare('set_resource', target, (kwargs,), timeout)()
 
     def disconnect(self, target, timeout):
-        form = {'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'disconnect'), data=form))
+        return self.prepare('disconnect', target, (), timeout)()
 
     def connect(self, target, timeout):
-        form = {'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'connect'), data=form))
+        return self.prepare('connect', target, (), timeout)()
 
     def set_init_params(self, target, config, timeout):
-        form = {'config': json.dumps(config), 'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'initparams'), data=form))
+        return self.prepare('set_init_params', target, (config,), timeout)()
 
     def configure(self, target, config, timeout):
-        form = {'config': json.dumps(config), 'timeout': timeout, 'key': self.mission_id}
-        return RestResponse(requests.post(self._url(target, 'configure'), data=form))
-
-    def lock(self, instruments):
-        for instrument in instruments:
-            form = {'key': self.mission_id}
-            response = requests.post(self._url(instrument, 'lock'), data=form)
-            if response.status_code == 409:
-                raise LockException
-
-    def unlock(self, instruments):
-        for instrument in instruments:
-            locker = requests.get(self._url(instrument, 'lock')).json().get('locked-by')
-            if locker == self.mission_id:
-                log.info('Unlocking %s', instrument)
-                requests.post(self._url(instrument, 'unlock'))
-            else:
-                log.warn('Unable to unlock %s, lock held by %r', instrument, locker)
+        return self.prepare('configure', target, (config,), timeout)()
+
+    def lock_instrument(self, instrument, ttl=None):
+        form = {'key': self.mission_id}
+        if ttl:
+            form['ttl'] = ttl
+        with tracing.child('http', instrument):
+            response = self.session.post(self._url(instrument, 'lock'), data=form)
+        if response.status_code == 409:
+            raise LockException(instrument)
+
+    def unlock_instrument(self, instrument):
+        with tracing.child('http', instrument):
+            self._unlock_instrument(instrument)
+
+    def _unlock_instrument(self, instrument):
+        locker = self.session.get(self._url(instrument, 'lock')).json()
+        if isinstance(locker, dict):
+            locker = locker.get('locked-by')
+        if locker == self.mission_id:
+            log.info('Unlocking %s', instrument)
+            self.session.post(self._url(instrument, 'unlock'))
+        else:
+            log.warn('Unable to unlock %s, lock held by %r', instrument, locker)
@@ -0,0 +1,156 @@
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
+import json
+import logging
+import random
+import time
+import urlparse
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+BASE_PATH = 'instrument/api'
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.state = 'DRIVER_STATE_COMMAND'
+        self.resources = {}
+        self.locked_by = None
+        self.lock_expires = None
+
+
+class FakeAgentServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the instrument agent REST API.
+
+    Every driver is in command state and accepts any command. Each request is
+    delayed by latency seconds plus up to jitter seconds, fails with a driver
+    error with probability error_rate and, for lock requests, is refused as if
+    the driver were locked by another owner with probability contention.
+    :param port: port to listen on, 0 picks a free port
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, contention=0.0, seed=None):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeAgentHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.contention = contention
+        self.random = random.Random(seed)
+        self.drivers = {}
+        self.lock = Lock()
+        self.thread = None
+
+        self.requests = 0
+        self.errors = 0
+        self.conflicts = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = Thread(target=self.serve_forever, name='fake-agent')
+        self.thread.setDaemon(True)
+        self.thread.start()
+        log.info('Fake instrument agent listening on port %d', self.port)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def stats(self):
+        return {'requests': self.requests, 'errors': self.errors, 'conflicts': self.conflicts}
+
+    def handle(self, method, target, name, form):
+        """
+        :return: (status code, response body)
+        """
+        with self.lock:
+            self.requests += 1
+            driver = self.drivers.get(target)
+            if driver is None:
+                driver = self.drivers[target] = FakeDriver()
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+            contended = self.random.random() < self.contention
+
+        time.sleep(delay)
+
+        with self.lock:
+            if name == 'lock':
+                now = time.time()
+                if driver.lock_expires is not None and driver.lock_expires < now:
+                    driver.locked_by = None
+                if method == 'GET':
+                    return 200, {'locked-by': driver.locked_by}
+                key = form.get('key')
+                if contended or driver.locked_by not in (None, key):
+                    self.conflicts += 1
+                    return 409, {'locked-by': driver.locked_by or 'other'}
+                driver.locked_by = key
+                ttl = form.get('ttl')
+                driver.lock_expires = now + float(ttl) if ttl else None
+                return 200, {'locked-by': key}
+
+            if name == 'unlock':
+                driver.locked_by = None
+                driver.lock_expires = None
+                return 200, {}
+
+            if fail:
+                self.errors += 1
+                return 200, {'cmd': name, 'type': 'DRIVER_ASYNC_EVENT_ERROR', 'value': 'injected error',
+                             'time': time.time()}
+
+            value = None
+            if name == 'state':
+                value = driver.state
+            elif name == 'resource':
+                resource = json.loads(form.get('resource', 'null'))
+                if method == 'POST':
+                    driver.resources.update(resource)
+                elif isinstance(resource, list):
+                    value = {key: driver.resources.get(key) for key in resource}
+                else:
+                    value = driver.resources.get(resource)
+            return 200, {'cmd': name, 'type': 'DRIVER_ASYNC_RESULT', 'value': value, 'time': time.time()}
+
+
+class FakeAgentHandler(BaseHTTPRequestHandler):
+    # keep connections open like the instrument agent
+    protocol_version = 'HTTP/1.1'
+    # the status line and headers are written separately, do not let them wait for an ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt, *args)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        length = int(self.headers.get('content-length') or 0)
+        form = dict(urlparse.parse_qsl(self.rfile.read(length))) if length else {}
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) != 4 or '/'.join(parts[:2]) != BASE_PATH:
+            return self._respond(404, {'message': 'not found'})
+        status, body = self.server.handle(method, parts[2], parts[3], form)
+        self._respond(status, body)
+
+    def _respond(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
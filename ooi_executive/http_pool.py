@@ -0,0 +1,84 @@
+from threading import Lock
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+
+class SessionPool(object):
+    """
+    Process-wide pool of keep-alive HTTP sessions, one per instrument agent (host, port).
+    All executors talking to the same instrument agent share a session and
+    therefore its connection pool.
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=20, pool_block=False, keep_alive=True):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.sessions = {}
+        self.lock = Lock()
+
+    def configure(self, config):
+        self.pool_connections = config.get('HTTP_POOL_CONNECTIONS', self.pool_connections)
+        self.pool_maxsize = config.get('HTTP_POOL_MAXSIZE', self.pool_maxsize)
+        self.pool_block = config.get('HTTP_POOL_BLOCK', self.pool_block)
+        self.keep_alive = config.get('HTTP_KEEP_ALIVE', self.keep_alive)
+
+    def get(self, host, port):
+        key = (host, port)
+        session = self.sessions.get(key)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(key)
+                if session is None:
+                    session = self._create_session()
+                    self.sessions[key] = session
+                    log.info('Created HTTP session for instrument agent %s:%d', host, port)
+        return session
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              pool_block=self.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def stats(self):
+        """
+        Connection counters for each instrument agent
+        :return: {'host:port': {'requests': n, 'connections': n, 'reused': n}}
+        """
+        stats = {}
+        for (host, port), session in self.sessions.items():
+            requests_made = connections = 0
+            adapter = session.get_adapter('http://')
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_made += pool.num_requests
+                    connections += pool.num_connections
+            stats['%s:%d' % (host, port)] = {
+                'requests': requests_made,
+                'connections': connections,
+                'reused': requests_made - connections,
+            }
+        return stats
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+session_pool = SessionPool()
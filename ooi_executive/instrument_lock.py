@@ -1,19 +1,195 @@
 from contextlib import contextmanager
+from threading import Thread, Event as ThreadEvent, Lock
 import logging
+import time
+
+from concurrent import futures
+
+from ooi_executive import tracing
+from ooi_executive.metrics import registry
+from ooi_executive.shared import LockException
 
 __author__ = 'petercable'
 
 log = logging.getLogger(__name__)
 
+LOCK_ACQUIRE_SECONDS = registry.histogram('ooi_lock_acquire_seconds', 'Time to lock the drivers of a run',
+                                          ('result',))
+LOCK_HOLD_SECONDS = registry.histogram('ooi_lock_hold_seconds', 'Time a driver was locked by a run', ('driver',))
+
+
+class LockManager(object):
+    """
+    Acquires and releases the instrument locks of mission runs.
+
+    The locks of a run are requested concurrently, in a canonical (sorted)
+    order, and either all of them are taken or none are: on a partial failure
+    the locks already taken are released before the exception is raised.
+    Locks are released concurrently.
+
+    Locks are taken with a lease of ttl seconds which a background thread
+    renews every renew_interval seconds while the run holds the locks, so
+    the instrument agent expires the locks of an executive which has died.
+    A lease is lost when the agent refuses to renew it, because another owner
+    holds the lock, or when it could not be renewed for ttl seconds. Runs
+    check lost() at their step boundaries and abort.
+    """
+    def __init__(self, pool_size=20, ttl=300, renew_interval=60):
+        self.pool = futures.ThreadPoolExecutor(pool_size)
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.leases = {}
+        self.held_since = {}
+        self.renewed = {}
+        self.lost_leases = {}
+        self.lock = Lock()
+        self.thread = None
+        self.running = False
+        self.stopped = ThreadEvent()
 
-@contextmanager
-def lock_instrument(instruments, executor, add_event):
-    try:
+        self.renewals = 0
+        self.renew_failures = 0
+        self.leases_lost = 0
+
+    def start(self):
+        if self.ttl and self.renew_interval:
+            self.running = True
+            self.stopped.clear()
+            self.thread = Thread(target=self._run, name='lock-renewal')
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.stopped.set()
+            self.thread.join()
+
+    def acquire(self, instruments, executor, add_event):
+        """
+        Lock all instruments or none
+        :raises LockException: if an instrument is locked by another owner
+        """
+        instruments = sorted(set(instruments))
         log.info('Locking instruments %r', instruments)
-        executor.lock(instruments)
+        start = time.time()
+        results = self._map(executor.lock_instrument, instruments, self.ttl)
+        locked_time = time.time()
+
+        locked = [instrument for instrument, error in results if error is None]
+        errors = [error for _, error in results if error is not None]
+        if errors:
+            log.error('Unable to lock instruments %r, releasing %r',
+                      [instrument for instrument, error in results if error is not None], locked)
+            self._release(locked, executor)
+            # report a lock conflict in preference to any other failure
+            lock_errors = [error for error in errors if isinstance(error, LockException)]
+            LOCK_ACQUIRE_SECONDS.observe(locked_time - start, 'failed')
+            raise (lock_errors or errors)[0]
+
+        LOCK_ACQUIRE_SECONDS.observe(locked_time - start, 'locked')
+        with self.lock:
+            for instrument in instruments:
+                self.leases[(executor.mission_id, instrument)] = executor
+                self.held_since[(executor.mission_id, instrument)] = locked_time
+                self.renewed[(executor.mission_id, instrument)] = locked_time
+                self.lost_leases.pop((executor.mission_id, instrument), None)
         add_event('lock', '\n'.join(instruments))
-        yield
-    finally:
+
+    def release(self, instruments, executor, add_event):
+        instruments = sorted(set(instruments))
         log.info('Releasing lock on instruments %r', instruments)
-        executor.unlock(instruments)
+        now = time.time()
+        with self.lock:
+            for instrument in instruments:
+                self.leases.pop((executor.mission_id, instrument), None)
+                self.renewed.pop((executor.mission_id, instrument), None)
+                self.lost_leases.pop((executor.mission_id, instrument), None)
+                held_since = self.held_since.pop((executor.mission_id, instrument), None)
+                if held_since is not None:
+                    LOCK_HOLD_SECONDS.observe(now - held_since, instrument)
+        self._release(instruments, executor)
         add_event('unlock', '\n'.join(instruments))
+
+    @contextmanager
+    def locked(self, instruments, executor, add_event):
+        self.acquire(instruments, executor, add_event)
+        try:
+            yield
+        finally:
+            self.release(instruments, executor, add_event)
+
+    def renew(self):
+        """
+        Renew the lease of every lock currently held
+        """
+        with self.lock:
+            leases = [(key, executor, self.held_since.get(key)) for key, executor in self.leases.iteritems()]
+        if not leases:
+            return
+
+        def renew_lease(lease):
+            (_, instrument), executor, _ = lease
+            return executor.lock_instrument(instrument, self.ttl)
+
+        for (key, _, held_since), error in self._map(renew_lease, leases):
+            now = time.time()
+            with self.lock:
+                if self.held_since.get(key) != held_since:
+                    # released while it was renewed
+                    continue
+                if error is None:
+                    self.renewals += 1
+                    self.renewed[key] = now
+                    continue
+                self.renew_failures += 1
+                log.error('Unable to renew lock on %s for %s: %r', key[1], key[0], error)
+                if isinstance(error, LockException) or now - self.renewed.get(key, held_since) >= self.ttl:
+                    log.error('Lost lock on %s for %s', key[1], key[0])
+                    self.leases_lost += 1
+                    self.leases.pop(key, None)
+                    self.lost_leases[key] = error
+
+    def lost(self, instruments, executor):
+        """
+        :return: the instruments whose lease, taken for executor, was lost since they were locked
+        """
+        if not self.lost_leases:
+            return []
+        with self.lock:
+            return [instrument for instrument in sorted(set(instruments))
+                    if (executor.mission_id, instrument) in self.lost_leases]
+
+    def stats(self):
+        return {'leases': len(self.leases), 'renewals': self.renewals, 'renew_failures': self.renew_failures,
+                'leases_lost': self.leases_lost}
+
+    def _release(self, instruments, executor):
+        for instrument, error in self._map(executor.unlock_instrument, instruments):
+            if error is not None:
+                log.error('Unable to unlock %s: %r', instrument, error)
+
+    def _map(self, func, items, *args):
+        """
+        Call func on each item concurrently
+        :return: list of (item, exception or None) in the order of items
+        """
+        if len(items) == 1:
+            try:
+                func(items[0], *args)
+                return [(items[0], None)]
+            except Exception as e:
+                return [(items[0], e)]
+
+        func = tracing.bind(func)
+        pending = [self.pool.submit(func, item, *args) for item in items]
+        return [(item, future.exception()) for item, future in zip(items, pending)]
+
+    def _run(self):
+        while self.running:
+            self.stopped.wait(self.renew_interval)
+            if self.running:
+                try:
+                    self.renew()
+                except Exception as e:
+                    log.exception('Exception renewing instrument locks: %r', e)
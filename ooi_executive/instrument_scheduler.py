@@ -0,0 +1,308 @@
+from itertools import count
+from threading import Thread, Condition, Lock
+import heapq
+import logging
+import time
+
+from concurrent import futures
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+
+class RunRequest(object):
+    """
+    A mission run waiting for, or holding, its drivers
+    :param key: owner of the request (mission name), a key has at most one request at a time
+    :param callback: called with the request on a worker thread once every driver is free
+    :param priority: requests with a higher priority are started first
+    :param on_preempt: called with the request when an urgent request needs its drivers
+    :param submitted: time the request was queued, defaults to now
+    """
+    def __init__(self, key, drivers, callback, sequence, priority=0, on_preempt=None, submitted=None):
+        self.key = key
+        self.drivers = tuple(sorted(set(drivers)))
+        self.callback = callback
+        self.sequence = sequence
+        self.priority = priority
+        self.on_preempt = on_preempt
+        self.submitted = submitted if submitted is not None else time.time()
+        self.attempts = 0
+        self.run_id = None
+        self.state = None
+        self.trace = None
+        self.preempt_requested = False
+
+    @property
+    def order(self):
+        return -self.priority, self.sequence
+
+    def __repr__(self):
+        return 'RunRequest(%r, %r)' % (self.key, self.drivers)
+
+
+class DriverStats(object):
+    def __init__(self):
+        self.dispatched = 0
+        self.total_wait = 0
+        self.max_wait = 0
+        self.preemptions = 0
+
+    def record(self, wait):
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class InstrumentScheduler(object):
+    """
+    Executive side queue of the runs waiting for each driver.
+
+    Every driver has a queue of the runs which need it, ordered by priority
+    then submission. A run is started on the worker pool as soon as it is at
+    the head of the queue of each of its drivers and none of them is held by
+    another run, and holds the drivers until it is released. Requests are
+    queued on all of their drivers at once, so runs sharing drivers are always
+    started in the same order.
+
+    Runs with at least urgent_priority are started on a reserved pool and
+    preempt runs of lower priority holding their drivers: the holder is asked
+    to stop at its next step boundary and hands its drivers back with
+    preempted(), keeping its place ahead of runs submitted after it.
+
+    Nothing waits while a run is queued: the scheduler reacts to submit, release
+    and requeue. Runs which could not take an external lock are requeued by a
+    single timer thread after a delay.
+    :param clock: source of the submission and wait times, the simulation replaces it with a virtual clock
+    """
+    def __init__(self, pool_size=20, urgent_pool_size=4, urgent_priority=10, clock=time.time):
+        self.pool = futures.ThreadPoolExecutor(pool_size)
+        self.urgent_pool = futures.ThreadPoolExecutor(urgent_pool_size)
+        self.urgent_priority = urgent_priority
+        self.clock = clock
+        self.lock = Lock()
+        self.sequence = count()
+        self.requests = {}
+        self.queues = {}
+        self.busy = {}
+        self.stats_by_driver = {}
+
+        self.delayed = []
+        self.timer_condition = Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._run, name='instrument-scheduler')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        if self.running:
+            with self.timer_condition:
+                self.running = False
+                self.timer_condition.notify()
+            self.thread.join()
+
+    def submit(self, key, drivers, callback, priority=0, on_preempt=None):
+        """
+        Queue a run for the drivers
+        :return: False if key already has a run queued or in progress
+        """
+        with self.lock:
+            if key in self.requests:
+                return False
+            request = RunRequest(key, drivers, callback, next(self.sequence), priority, on_preempt, self.clock())
+            self.requests[key] = request
+            ready, victims = self._enqueue(request)
+        self._start(ready)
+        self._preempt(victims)
+        return True
+
+    def release(self, key):
+        """
+        Release the drivers held by the run of key, starting the runs waiting for them
+        """
+        with self.lock:
+            request = self.requests.get(key)
+            if request is None:
+                return
+            ready = self._remove(request)
+        self._start(ready)
+
+    def requeue(self, key, delay):
+        """
+        Release the drivers held by the run of key and queue the run again after delay seconds
+        """
+        with self.lock:
+            request = self.requests.get(key)
+            if request is None:
+                return
+            # the run gave up its drivers, as a preempted run does
+            request.preempt_requested = False
+            ready = self._free(request)
+        self._start(ready)
+
+        with self.timer_condition:
+            heapq.heappush(self.delayed, (time.time() + delay, request.sequence, request))
+            self.timer_condition.notify()
+
+    def preempted(self, key):
+        """
+        Called by a preempted run once it has stopped: release its drivers and queue it again
+        """
+        with self.lock:
+            request = self.requests.get(key)
+            if request is None:
+                return
+            request.preempt_requested = False
+            for driver in request.drivers:
+                if self.busy.get(driver) is request:
+                    del self.busy[driver]
+                    self.stats_by_driver[driver].preemptions += 1
+            ready, victims = self._enqueue(request)
+        self._start(ready)
+        self._preempt(victims)
+
+    def cancel(self, key):
+        """
+        Remove a run which has not started from the queues
+        :return: True if a queued run was removed
+        """
+        with self.lock:
+            request = self.requests.get(key)
+            if request is None or any(self.busy.get(driver) is request for driver in request.drivers):
+                return False
+            del self.requests[key]
+            for driver in request.drivers:
+                queue = self.queues.get(driver)
+                if queue and request in queue:
+                    queue.remove(request)
+            ready = self._ready(request.drivers)
+        self._start(ready)
+        return True
+
+    def is_queued(self, key):
+        request = self.requests.get(key)
+        return request is not None and not any(self.busy.get(driver) is request for driver in request.drivers)
+
+    def stats(self):
+        """
+        Queue depth and wait times (seconds) of each driver
+        """
+        now = self.clock()
+        with self.lock:
+            stats = {}
+            for driver in set(self.queues) | set(self.stats_by_driver):
+                queue = self.queues.get(driver) or ()
+                driver_stats = self.stats_by_driver.get(driver) or DriverStats()
+                holder = self.busy.get(driver)
+                stats[driver] = {
+                    'depth': len(queue),
+                    'held_by': holder.key if holder is not None else None,
+                    'oldest_wait': now - queue[0].submitted if queue else 0,
+                    'dispatched': driver_stats.dispatched,
+                    'mean_wait': driver_stats.total_wait / driver_stats.dispatched if driver_stats.dispatched else 0,
+                    'max_wait': driver_stats.max_wait,
+                    'preemptions': driver_stats.preemptions,
+                }
+            return stats
+
+    def _enqueue(self, request):
+        """
+        Insert request in the queue of each of its drivers
+        :return: requests ready to start, running requests to preempt
+        """
+        victims = []
+        for driver in request.drivers:
+            queue = self.queues.setdefault(driver, [])
+            index = len(queue)
+            while index > 0 and queue[index - 1].order > request.order:
+                index -= 1
+            queue.insert(index, request)
+
+            holder = self.busy.get(driver)
+            if (holder is not None and holder is not request and not holder.preempt_requested and
+                    request.priority >= self.urgent_priority and holder.priority < request.priority):
+                holder.preempt_requested = True
+                victims.append(holder)
+
+        ready = self._ready(request.drivers) if request.drivers else [request]
+        return ready, victims
+
+    def _preempt(self, victims):
+        for request in victims:
+            log.info('Preempting %r', request)
+            if request.on_preempt is not None:
+                try:
+                    request.on_preempt(request)
+                except Exception as e:
+                    log.exception('Exception preempting %r: %r', request, e)
+
+    def _remove(self, request):
+        if self.requests.get(request.key) is request:
+            del self.requests[request.key]
+        return self._free(request)
+
+    def _free(self, request):
+        for driver in request.drivers:
+            if self.busy.get(driver) is request:
+                del self.busy[driver]
+        return self._ready(request.drivers)
+
+    def _ready(self, drivers):
+        """
+        Take the drivers of every request which can start, looking at the queues of drivers
+        """
+        ready = []
+        for driver in drivers:
+            queue = self.queues.get(driver)
+            if not queue or driver in self.busy:
+                continue
+            request = queue[0]
+            if all(self.queues[d][0] is request and d not in self.busy for d in request.drivers):
+                now = self.clock()
+                for d in request.drivers:
+                    self.queues[d].pop(0)
+                    if not self.queues[d]:
+                        del self.queues[d]
+                    self.busy[d] = request
+                    self.stats_by_driver.setdefault(d, DriverStats()).record(now - request.submitted)
+                ready.append(request)
+        return ready
+
+    def _start(self, ready):
+        for request in ready:
+            log.debug('Starting %r', request)
+            pool = self.urgent_pool if request.priority >= self.urgent_priority else self.pool
+            pool.submit(self._execute, request)
+
+    def _execute(self, request):
+        try:
+            request.callback(request)
+        except Exception as e:
+            log.exception('Exception starting run %r: %r', request, e)
+            with self.lock:
+                ready = self._remove(request)
+            self._start(ready)
+
+    def _resubmit(self, request):
+        with self.lock:
+            if self.requests.get(request.key) is not request:
+                return
+            request.submitted = self.clock()
+            ready, victims = self._enqueue(request)
+        self._start(ready)
+        self._preempt(victims)
+
+    def _run(self):
+        while True:
+            with self.timer_condition:
+                while self.running and not (self.delayed and self.delayed[0][0] <= time.time()):
+                    self.timer_condition.wait(self.delayed[0][0] - time.time() if self.delayed else None)
+                if not self.running:
+                    return
+                _, _, request = heapq.heappop(self.delayed)
+            self._resubmit(request)
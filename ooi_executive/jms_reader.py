@@ -1,8 +1,11 @@
 from threading import Thread
 import logging
 import json
+import time
 
 from ooi_executive import app
+from ooi_executive.metrics import registry
+from ooi_executive.triggers import TriggerRegistry
 
 from kombu.mixins import ConsumerMixin
 from kombu import Connection, Queue, Exchange
@@ -11,11 +14,14 @@ __author__ = 'petercable'
 
 log = logging.getLogger(__name__)
 
+JMS_MESSAGES = registry.counter('ooi_jms_messages_total', 'OMS alert messages received')
+JMS_DISPATCH_SECONDS = registry.histogram('ooi_jms_dispatch_seconds', 'Time to match and dispatch an OMS alert')
+
 
 class JmsReader(ConsumerMixin):
     def __init__(self):
 
-        self.listeners = []
+        self.triggers = TriggerRegistry()
 
         oms_server = app.config['OMS_SERVER']
 
@@ -33,6 +39,8 @@ class JmsReader(ConsumerMixin):
 
     def on_message(self, body, message):
         log.info("RECEIVED JMS MESSAGE: %s" % (body, ))
+        JMS_MESSAGES.inc()
+        start = time.time()
 
         message.ack()
 
@@ -41,16 +49,13 @@ class JmsReader(ConsumerMixin):
         source = attributes.get('omsplatformId')
         event = oms_msg.get('messageText')
 
-        for listener in self.listeners:
-            listener(source, event)
+        self.triggers.dispatch(source, event)
+        JMS_DISPATCH_SECONDS.observe(time.time() - start)
 
     def start(self):
         reader_thread = Thread(target=self.run)
         reader_thread.setDaemon(True)
         reader_thread.start()
 
-    def add_listener(self, callback):
-        self.listeners.append(callback)
-
     def interrupt(self, *args):
         self.should_stop = True
@@ -0,0 +1,131 @@
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+import logging
+
+from apscheduler.events import EVENT_JOB_ADDED, EVENT_JOB_SUBMITTED
+from apscheduler.executors.pool import BasePoolExecutor
+
+from ooi_executive.backing_store import MissionData
+from ooi_executive.metrics import registry
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+SCHEDULER_LAG_SECONDS = registry.histogram('ooi_scheduler_lag_seconds',
+                                           'Delay between the scheduled and actual submission of a job')
+
+
+class PoolExecutor(BasePoolExecutor):
+    """
+    APScheduler executor running jobs on a concurrent.futures pool owned by the caller
+    """
+    def __init__(self, pool):
+        super(PoolExecutor, self).__init__(pool)
+
+
+class JobRouter(object):
+    """
+    Single APScheduler job event listener for all missions.
+
+    Job events are routed to the owning mission with a lookup by job id.
+    Missions which must be deactivated at the end of a run are collected and
+    written to the database in batches.
+
+    The router also counts the running instances of every job, by executor.
+    :param scheduler: scheduler the executor of each added job is read from
+    """
+    def __init__(self, session_factory, scheduler=None):
+        self.session_factory = session_factory
+        self.scheduler = scheduler
+        self.jobs = {}
+        self.pending = set()
+        self.lock = Lock()
+        self.flush_lock = Lock()
+        self.executors = {}
+        # a job may finish before its submission event is dispatched, counts are briefly negative
+        self.running = Counter()
+
+    def register(self, job_id, mission):
+        self.jobs[job_id] = mission
+
+    def unregister(self, job_id):
+        self.jobs.pop(job_id, None)
+
+    def dispatch(self, event):
+        if event.code == EVENT_JOB_ADDED:
+            # dispatched by add_job before the job can run
+            job = self.scheduler.get_job(event.job_id, event.jobstore) if self.scheduler is not None else None
+            if job is not None:
+                with self.lock:
+                    self.executors[event.job_id] = job.executor
+            return
+
+        mission = self.jobs.get(event.job_id)
+        if event.code == EVENT_JOB_SUBMITTED:
+            self._count(event.job_id, 1)
+            for run_time in event.scheduled_run_times:
+                SCHEDULER_LAG_SECONDS.observe((datetime.now(run_time.tzinfo) - run_time).total_seconds())
+            if mission is not None:
+                mission.job_submitted(event)
+            return
+
+        self._count(event.job_id, -1)
+        if mission is not None:
+            mission.job_finished(event)
+
+    def running_jobs(self):
+        """
+        :return: dictionary of executor name to the number of jobs it is executing
+        """
+        counts = Counter()
+        with self.lock:
+            for job_id, running in self.running.iteritems():
+                if running > 0:
+                    counts[self.executors.get(job_id, 'default')] += running
+        return counts
+
+    def _count(self, job_id, change):
+        with self.lock:
+            self.running[job_id] += change
+            if not self.running[job_id]:
+                del self.running[job_id]
+
+    def deactivate(self, mission_id):
+        """
+        Queue a mission to be marked inactive in the database
+        """
+        with self.lock:
+            self.pending.add(mission_id)
+        self.flush()
+
+    def flush(self):
+        # whichever thread holds flush_lock writes the ids queued by every other thread
+        while True:
+            if not self.flush_lock.acquire(False):
+                return
+            try:
+                with self.lock:
+                    mission_ids, self.pending = self.pending, set()
+                if mission_ids:
+                    self._write(mission_ids)
+            finally:
+                self.flush_lock.release()
+
+            with self.lock:
+                if not self.pending:
+                    return
+
+    def _write(self, mission_ids):
+        session = self.session_factory()
+        try:
+            session.query(MissionData).filter(MissionData.id.in_(mission_ids))\
+                .update({MissionData.active: False}, synchronize_session=False)
+            session.commit()
+            log.debug('Deactivated missions: %r', mission_ids)
+        except Exception as e:
+            session.rollback()
+            log.exception('Unable to deactivate missions %r: %r', mission_ids, e)
+        finally:
+            session.close()
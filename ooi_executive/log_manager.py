@@ -1,18 +1,201 @@
+from Queue import Queue, Empty, Full
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+from threading import Thread, Lock
+import atexit
+import json
 import logging
+import time
+
 from ooi_executive import app
 
 __author__ = 'petercable'
 
+TEXT_FORMAT = '%(asctime)s %(levelname)-5s %(name)-30s %(message)s'
+
+# arguments which cannot change before the listener formats the record
+IMMUTABLE = (basestring, int, long, float, bool, type(None))
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as JSON lines
+    """
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per logger and level: up to burst records at once, refilled at rate records per second.
+    The number of records dropped is appended to the next record let through.
+    """
+    def __init__(self, rate, burst):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.lock = Lock()
+        self.buckets = {}
+
+    def filter(self, record):
+        key = (record.name, record.levelno)
+        now = time.time()
+        with self.lock:
+            tokens, last, dropped = self.buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now, dropped + 1)
+                return False
+            self.buckets[key] = (tokens - 1, now, 0)
+
+        if dropped:
+            record.msg = '%s (%d similar records dropped)' % (record.getMessage(), dropped)
+            record.args = None
+        return True
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hand records to a QueueListener without formatting or writing them on the calling thread.
+    Records are dropped, and counted, when the queue is full.
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        # mutable arguments may change before the listener formats the record
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, IMMUTABLE) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        # tracebacks hold the frames of the caller alive
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
 
-def setup():
-    formatter = logging.Formatter('%(asctime)s %(levelname)-5s %(name)-30s %(message)s')
+class QueueListener(object):
+    """
+    Format and write the records of a QueueHandler to handlers on a background thread
+    """
+    _stop = object()
+
+    def __init__(self, queue, handlers, source=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.source = source
+        self.reported = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self._run, name='log-listener')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Write the records queued so far and stop
+        """
+        if self.thread is not None:
+            self.queue.put(self._stop)
+            self.thread.join()
+            self.thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report_dropped(self):
+        dropped = self.source.dropped if self.source is not None else 0
+        if dropped > self.reported:
+            record = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                       'Log queue full, dropped %d records', (dropped - self.reported,), None)
+            self.reported = dropped
+            self.handle(record)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._stop:
+                break
+            self._report_dropped()
+            self.handle(record)
+            # write everything queued while waiting on the handlers
+            try:
+                while True:
+                    record = self.queue.get_nowait()
+                    if record is self._stop:
+                        return
+                    self.handle(record)
+            except Empty:
+                pass
+
+
+def file_handler(config):
+    filename = config['LOG_FILE']
+    rotation = config['LOG_ROTATION']
+    if rotation == 'size':
+        return RotatingFileHandler(filename, maxBytes=config['LOG_MAX_BYTES'],
+                                   backupCount=config['LOG_BACKUP_COUNT'])
+    if rotation == 'time':
+        return TimedRotatingFileHandler(filename, when=config['LOG_ROTATE_WHEN'],
+                                        backupCount=config['LOG_BACKUP_COUNT'])
+    return logging.FileHandler(filename)
+
+
+def setup(config=None):
+    """
+    Log to the console and to LOG_FILE from a background thread.
+    Only the first call configures logging.
+    :return: QueueListener
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    config = config or app.config
+    text = logging.Formatter(TEXT_FORMAT)
     root_logger = logging.getLogger()
-    root_logger.setLevel(app.config['LOG_LEVEL'])
+    root_logger.setLevel(config['LOG_LEVEL'])
 
     ch = logging.StreamHandler()
-    ch.setFormatter(formatter)
-    root_logger.addHandler(ch)
+    ch.setFormatter(text)
+
+    fh = file_handler(config)
+    fh.setFormatter(JsonFormatter() if config['LOG_FORMAT'] == 'json' else text)
+
+    queue = Queue(config['LOG_QUEUE_SIZE'])
+    qh = QueueHandler(queue)
+    if config['LOG_RATE_LIMIT']:
+        qh.addFilter(RateLimitFilter(config['LOG_RATE_LIMIT'], config['LOG_RATE_BURST']))
+    root_logger.addHandler(qh)
 
-    fh = logging.FileHandler('executive.log')
-    fh.setFormatter(formatter)
-    root_logger.addHandler(fh)
+    _listener = QueueListener(queue, [ch, fh], source=qh)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
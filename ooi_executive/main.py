@@ -7,4 +7,5 @@ __author__ = 'petercable'
 
 if __name__ == "__main__":
     port = executive.app.config.get('EXEC_PORT')
-    executive.app.run(debug=True, use_reloader=False, host='0.0.0.0', port=port)
+    # event streams hold a request thread each
+    executive.app.run(debug=True, use_reloader=False, host='0.0.0.0', port=port, threaded=True)
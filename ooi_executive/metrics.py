@@ -0,0 +1,221 @@
+from bisect import bisect_left
+from threading import Lock, current_thread, local
+import logging
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+PERCENTILES = (50, 90, 99)
+# stores are pruned when a new thread pushes the list past this size
+PRUNE_THRESHOLD = 64
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, registry, name, description, labelnames):
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, **kwargs):
+        store = self.registry.store()
+        key = (self.name, labels)
+        store[key] = store.get(key, 0) + kwargs.get('value', 1)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, description, labelnames, buckets):
+        super(Histogram, self).__init__(registry, name, description, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        store = self.registry.store()
+        key = (self.name, labels)
+        data = store.get(key)
+        if data is None:
+            # per bucket counts (the last is +Inf), sum
+            data = store[key] = [[0] * (len(self.buckets) + 1), 0]
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+
+class Gauge(_Metric):
+    """
+    A value read when the metrics are collected
+    :param callback: returns a number, or a dictionary of label tuple to number
+    """
+    kind = 'gauge'
+
+    def __init__(self, registry, name, description, labelnames, callback):
+        super(Gauge, self).__init__(registry, name, description, labelnames)
+        self.callback = callback
+
+
+class Registry(object):
+    """
+    Counters and histograms aggregated per thread.
+
+    Each thread updates its own store without locking; the stores are only
+    combined when the metrics are collected. Stores of threads which have
+    exited are folded into a single retired store, when the metrics are
+    collected or when a new thread grows the list past a threshold.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.local = local()
+        self.lock = Lock()
+        self.stores = []
+        self.retired = {}
+        self.prune_at = PRUNE_THRESHOLD
+
+    def counter(self, name, description, labelnames=()):
+        return self._add(Counter(self, name, description, labelnames))
+
+    def histogram(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, name, description, labelnames, buckets))
+
+    def gauge(self, name, description, callback, labelnames=()):
+        return self._add(Gauge(self, name, description, labelnames, callback))
+
+    def _add(self, metric):
+        with self.lock:
+            self.metrics = [m for m in self.metrics if m.name != metric.name] + [metric]
+        return metric
+
+    def store(self):
+        try:
+            return self.local.store
+        except AttributeError:
+            store = self.local.store = {}
+            with self.lock:
+                self.stores.append((current_thread(), store))
+                if len(self.stores) >= self.prune_at:
+                    self._prune()
+                    # keep pruning amortized when most of the threads are alive
+                    self.prune_at = max(PRUNE_THRESHOLD, 2 * len(self.stores))
+            return store
+
+    def _prune(self):
+        # caller holds the lock, a thread which has exited no longer updates its store
+        live = []
+        for thread, store in self.stores:
+            if thread.is_alive():
+                live.append((thread, store))
+            else:
+                self._merge(self.retired, store)
+        self.stores = live
+
+    def collect(self):
+        """
+        :return: dictionary of (name, labels) to value, [bucket counts, sum] for histograms
+        """
+        with self.lock:
+            self._prune()
+            totals = {}
+            self._merge(totals, self.retired)
+            for _, store in self.stores:
+                self._merge(totals, store)
+        return totals
+
+    @staticmethod
+    def _merge(totals, store):
+        for key, value in store.items():
+            if isinstance(value, list):
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [list(value[0]), value[1]]
+                else:
+                    total[0] = [a + b for a, b in zip(total[0], value[0])]
+                    total[1] += value[1]
+            else:
+                totals[key] = totals.get(key, 0) + value
+
+    def render(self):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        totals = self.collect()
+        by_name = {}
+        for (name, labels), value in totals.iteritems():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for metric in self.metrics:
+            if isinstance(metric, Gauge):
+                try:
+                    values = metric.callback()
+                except Exception as e:
+                    log.error('Unable to collect %s: %r', metric.name, e)
+                    continue
+                if not isinstance(values, dict):
+                    values = {(): values}
+                samples = sorted(values.items())
+            else:
+                samples = sorted(by_name.get(metric.name, []))
+
+            lines.append('# HELP %s %s' % (metric.name, metric.description))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for labels, value in samples:
+                label_pairs = zip(metric.labelnames, labels)
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + ('+Inf',), value[0]):
+                        cumulative += count
+                        lines.append(_sample(metric.name + '_bucket', label_pairs + [('le', bound)], cumulative))
+                    lines.append(_sample(metric.name + '_sum', label_pairs, value[1]))
+                    lines.append(_sample(metric.name + '_count', label_pairs, cumulative))
+                else:
+                    lines.append(_sample(metric.name, label_pairs, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, label_pairs, value):
+    if label_pairs:
+        labels = ','.join('%s="%s"' % (label, _escape(v)) for label, v in label_pairs)
+        return '%s{%s} %s' % (name, labels, float(value))
+    return '%s %s' % (name, float(value))
+
+
+def pool_sizes(pools):
+    """
+    Gauge callback reporting the worker threads and queued work items of concurrent.futures thread pools
+    :param pools: callable returning a dictionary of pool name to pool
+    """
+    def sizes():
+        values = {}
+        for name, pool in pools().iteritems():
+            values[(name, 'threads')] = len(pool._threads)
+            values[(name, 'queued')] = pool._work_queue.qsize()
+        return values
+    return sizes
+
+
+def distribution(values):
+    """
+    :return: count, mean, max and nearest rank percentiles of values
+    """
+    values = sorted(values)
+    result = {'count': len(values)}
+    if values:
+        result['mean'] = float(sum(values)) / len(values)
+        result['max'] = values[-1]
+        for p in PERCENTILES:
+            result['p%d' % p] = values[max(0, int(round(p / 100.0 * len(values))) - 1)]
+    return result
+
+
+registry = Registry()
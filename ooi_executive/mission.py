@@ -1,22 +1,27 @@
 import json
 import time
+from datetime import datetime
 import logging
 import functools
+from collections import deque
 from contextlib import contextmanager
 
-import yaml
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.jobstores.base import JobLookupError
+from concurrent import futures
 from requests import ConnectionError
-from jsonschema import validate
 
-import mission_schema
-from ooi_executive.backing_store import MissionData, Script, Run, EventType, Event
-from ooi_executive.executors import RestExecutor
-from ooi_executive.instrument_lock import lock_instrument
+from ooi_executive.backing_store import MissionData, Script, Run, EventType, Event, ArchivedRun
+from ooi_executive.compiler import compile_mission, BlockStep, CommandStep, SleepStep, ParallelStep
+from ooi_executive.event_stream import event_stream
+from ooi_executive.executors import Executor, RestExecutor
 from ooi_executive import app
-from ooi_executive.policies import ErrorPolicy
+from ooi_executive.mission_snapshot import mission_snapshot
+from ooi_executive.retention import archived_events
+from ooi_executive.run_state import RunState
+from ooi_executive.script_cache import script_cache
 from ooi_executive.shared import Tags, MyEncoder, InstrumentException,\
     LockException, CommandArgumentException, PolicyException, DuplicateScriptException
+from ooi_executive import tracing
 
 __author__ = 'petercable'
 
@@ -44,12 +49,16 @@ class Mission(object):
         self.mission = None
         self.id = None
         self.name = None
-        self.blocks = None
+        self.program = None
+        self.executor = None
         self.version = None
         self.schedule = None
         self.active = False
         self.run_count = 0
         self.created = 0
+        self.next_run = None
+        self.job_trigger = None
+        self.deleted = False
         self.event_types = self._get_event_types()
 
         if dbobj is not None:
@@ -71,18 +80,15 @@ class Mission(object):
         self.job = None
         self.state = None
         self.current_step = None
+        self.current_run = None
+        self.run_request = None
 
         self.vars = {}
-        # self.executor = DummyExecutor()
-        host = app.config['IA_HOST']
-        port = app.config['IA_PORT']
-        self.executor = RestExecutor(self.name, host, port, timeout=self.DEFAULT_TIMEOUT)
-        app.scheduler.add_listener(self._job_event_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
-        app.jms_reader.add_listener(self.jms_listener)
 
         if self.active:
             self.state = Tags.MISSION
             self._schedule_mission()
+        self._publish(script=True)
 
     def _get_event_types(self):
         session = app.Session()
@@ -93,8 +99,8 @@ class Mission(object):
 
     def _create(self, session, data):
         log.info('Creating mission in database')
-        mission_dict = yaml.load(data)
-        validate(mission_dict, mission_schema.Mission.get_schema())
+        mission_dict = script_cache.load(data)
+        compile_mission(mission_dict, Executor(mission_dict['name'], self.DEFAULT_TIMEOUT))
         name = mission_dict['name']
         version = mission_dict['version']
 
@@ -123,23 +129,45 @@ class Mission(object):
     def _load(self, dbobj):
         log.info('Loading mission from database')
         self.mission_txt = dbobj.script.script
-        self.mission = yaml.load(self.mission_txt)
+        self.mission = script_cache.load(self.mission_txt)
         self.id = dbobj.id
         self.name = dbobj.name
         self.active = dbobj.active
-        validate(self.mission, mission_schema.Mission.get_schema())
-        self.blocks = self._load_blocks()
+        # self.executor = DummyExecutor()
+        host = app.config['IA_HOST']
+        port = app.config['IA_PORT']
+        self.executor = RestExecutor(self.name, host, port, timeout=self.DEFAULT_TIMEOUT)
+        self.program = compile_mission(self.mission, self.executor)
         self.version = dbobj.script.version
-        self.run_count = len(dbobj.runs)
+        self.run_count = dbobj.run_count or 0
         self.schedule = self.mission.get('schedule')
         self.created = dbobj.script.create_time
         self.description = self.mission.get('desc')
 
     def delete(self):
+        self._unschedule_mission()
+        app.instrument_scheduler.cancel(self.name)
+        self._cancel_suspended_run('mission deleted')
         with session_scope() as session:
             dbobj = self._get_dbobj(session)
             dbobj.script = None
             session.commit()
+        # a run executing a step completes without publishing the mission again
+        self.deleted = True
+        mission_snapshot.remove(self.id)
+        event_stream.remove(self.id)
+
+    def _publish(self, script=False):
+        """
+        Update the summary of this mission in the mission snapshot
+        :param script: also publish the mission script
+        """
+        if self.id is not None and not self.deleted:
+            mission_snapshot.update(self.id, self.small(), self.mission_txt if script else None)
+
+    def _set_next_run(self, next_run_time):
+        self.next_run = next_run_time.isoformat() if next_run_time is not None else None
+        self._publish()
 
     def _get_dbobj(self, session):
         return session.query(MissionData).filter(MissionData.id == self.id).one()
@@ -147,63 +175,90 @@ class Mission(object):
     def __repr__(self):
         return repr(self.mission)
 
-    def _load_blocks(self):
-        d = {}
-        for block in self.mission.get('blocks', []):
-            d[block['label']] = block
-        return d
+    def job_finished(self, event):
+        """
+        Called by the job router when this mission's scheduled job has executed
+        """
+        if Tags.SCHEDULE not in self.mission:
+            self.active = False
+            app.job_router.deactivate(self.id)
+            self._publish()
 
-    def _job_event_listener(self, event):
-        if event.job_id.startswith(self.name):
-            if Tags.SCHEDULE not in self.mission:
-                with session_scope() as session:
-                    dbobj = self._get_dbobj(session)
-                    dbobj.active = False
-                    session.commit()
-                    self.active = False
+    def job_submitted(self, event):
+        """
+        Called by the job router when this mission's scheduled job is submitted,
+        before the scheduler computes the next run time of the job
+        """
+        if self.job_trigger is not None:
+            run_time = event.scheduled_run_times[-1]
+            self._set_next_run(self.job_trigger.get_next_fire_time(run_time, datetime.now(run_time.tzinfo)))
 
     def jms_listener(self, source, event):
         """
-        Listen for JMS events
-        Trigger an execute if a target event is received
+        Called by the trigger registry when a JMS event matching this mission's schedule is received
+        :param source:
         :param event:
         :return:
         """
+        log.debug('Scheduling Mission to Run immediately...')
 
-        schedule = self.mission.get(Tags.SCHEDULE, {})
-
-        # check if the incoming event is a trigger to execute the mission
-        if schedule.get('source') == source and schedule.get('event') == event:
-
-            log.debug('Scheduling Mission to Run immediately...')
+        # Schedule the mission to run immediately
+        self._add_job()
 
-            # Schedule the mission to run immediately
-            self._add_job()
+    def _get_events(self, session, run_id=None, limit=10, after_id=None, since=None, until=None, event_types=None):
+        """
+        Query the events of a run, oldest first
+        :param run_id: run to query, defaults to the most recent run, read from the run archive if archived
+        :param after_id: only return events after this event id
+        :param event_types: only return events with these type names
+        :return: list of (timestamp, type, event), id of the last event returned if more may follow
+        """
+        query = session.query(Run.id).filter(Run.mission_id == self.id)
+        if run_id is None:
+            run_id = query.order_by(Run.id.desc()).limit(1).scalar()
+        else:
+            live_id = query.filter(Run.id == run_id).scalar()
+            if live_id is None:
+                run = self._get_archived_run(session, run_id)
+                if run is not None:
+                    return archived_events(run, after_id=after_id, since=since, until=until,
+                                           event_types=event_types, limit=limit)
+            run_id = live_id
 
-    def _get_events(self, session, run_id=None):
+        if run_id is None:
+            return [], None
+
+        query = session.query(Event.id, Event.timestamp, Event.event_type_id, Event.event)\
+            .filter(Event.run_id == run_id)
+        if after_id is not None:
+            query = query.filter(Event.id > after_id)
+        if since is not None:
+            query = query.filter(Event.timestamp >= since)
+        if until is not None:
+            query = query.filter(Event.timestamp < until)
+        if event_types:
+            query = query.filter(Event.event_type_id.in_([self.event_types.get(name) for name in event_types]))
+
+        type_names = {v: k for k, v in self.event_types.iteritems()}
         events = []
-        dbobj = self._get_dbobj(session)
-        if not dbobj.runs:
-            return []
+        last_id = None
+        for last_id, timestamp, event_type_id, event in query.order_by(Event.id).limit(limit):
+            try:
+                e = json.loads(event)
+            except ValueError:
+                e = event
+            events.append((timestamp.isoformat(), type_names.get(event_type_id), e))
 
-        if run_id is None:
-            run = dbobj.runs[0]
-        else:
-            run = session.query(Run).filter(Run.mission_id == self.id).filter(Run.id == run_id).one_or_none()
+        next_id = last_id if len(events) == limit else None
+        return events, next_id
 
-        if run and run.events:
-            for event in run.events[:10]:
-                try:
-                    e = json.loads(event.event)
-                except ValueError:
-                    e = event.event
-                events.append((event.timestamp.isoformat(), event.type.name, e))
-            return events
-        return []
+    def _get_archived_run(self, session, run_id):
+        entry = session.query(ArchivedRun).filter(ArchivedRun.mission_id == self.id)\
+            .filter(ArchivedRun.run_id == run_id).one_or_none()
+        if entry is not None:
+            return app.run_archive.read(entry.file, entry.offset, run_id)
 
     def small(self):
-        job = app.scheduler.get_job(self.name)
-        next_run = job.next_run_time.isoformat() if job else None
         return {
             'id': self.id,
             'name': self.name,
@@ -211,21 +266,40 @@ class Mission(object):
             'desc': self.description,
             'active': self.active,
             'running': self.running,
+            'queued': app.instrument_scheduler.is_queued(self.name),
             'current_step': self.current_step,
             'run_count': self.run_count,
             'schedule': self.schedule,
-            'next_run': next_run,
+            'next_run': self.next_run,
             'created': self.created.isoformat(),
         }
 
     def full(self):
         with session_scope() as session:
-            events = self._get_events(session)
+            events, _ = self._get_events(session)
             base = self.small()
             base['events'] = events
             base['script'] = self.mission_txt
             return base
 
+    def snapshot(self):
+        """
+        full() from the mission snapshot, the events of the most recent run are read once
+        :return: (ETag, JSON body), or None if the mission changed while its events were read
+        """
+        cached = mission_snapshot.full(self.id)
+        if cached is None:
+            # events still queued would be missing from the snapshot until the next run
+            app.event_writer.flush()
+            version = mission_snapshot.version_of(self.id)
+            with session_scope() as session:
+                run_id = session.query(Run.id).filter(Run.mission_id == self.id)\
+                    .order_by(Run.id.desc()).limit(1).scalar()
+                events, _ = self._get_events(session, run_id) if run_id is not None else ([], None)
+            mission_snapshot.load_events(self.id, version, run_id, events)
+            cached = mission_snapshot.full(self.id)
+        return cached
+
     def activate(self):
         if not self.active:
             with session_scope() as session:
@@ -237,12 +311,17 @@ class Mission(object):
                 self.active = True
                 self.state = Tags.MISSION
                 self._schedule_mission()
+            self._publish()
 
     def _add_job(self, trigger=None, kwargs=None):
         trigger = trigger or 'date'
         kwargs = kwargs or {}
         job_id = self.name
-        app.scheduler.add_job(self._execute_mission, trigger, id=job_id, **kwargs)
+        app.job_router.register(job_id, self)
+        job = app.scheduler.add_job(self._execute_mission, trigger, id=job_id, executor=self._executor_name(),
+                                    **kwargs)
+        self.job_trigger = job.trigger
+        self._set_next_run(getattr(job, 'next_run_time', None))
 
     def _schedule_mission(self):
         """
@@ -264,6 +343,17 @@ class Mission(object):
 
         if trigger:
             self._add_job(trigger, schedule)
+        elif 'source' in schedule and 'event' in schedule:
+            app.jms_reader.triggers.register(self.id, schedule['source'], schedule['event'],
+                                             self.jms_listener, pattern=schedule.get('pattern', False))
+
+    def _unschedule_mission(self):
+        app.jms_reader.triggers.unregister(self.id)
+        app.job_router.unregister(self.name)
+        if app.scheduler.get_job(self.name) is not None:
+            app.scheduler.remove_job(self.name)
+        self.job_trigger = None
+        self.next_run = None
 
     def deactivate(self):
         if self.active:
@@ -271,130 +361,446 @@ class Mission(object):
                 log.debug('Deactivating mission: %s', self.name)
                 dbobj = self._get_dbobj(session)
                 dbobj.active = False
-                job_id = self.name
-                app.scheduler.remove_job(job_id)
+                self._unschedule_mission()
                 self.active = False
+            self._publish()
 
-    def _add_event(self, session, run, event_type, event=''):
+    def _add_event(self, run_id, event_type, event=''):
         if event_type not in self.event_types:
-            et = EventType(name=event_type)
-            session.add(et)
-            session.commit()
-            self.event_types[event_type] = et.id
+            with session_scope() as session:
+                et = EventType(name=event_type)
+                session.add(et)
+                session.commit()
+                self.event_types[event_type] = et.id
 
+        encoded = False
         if not isinstance(event, basestring):
             try:
                 event = json.dumps(event, cls=MyEncoder)
+                encoded = True
             except TypeError:
                 log.error('Unable to create JSON from: %r %r', type(event), event)
                 event = str(event)
 
-        event = Event(run=run, event_type_id=self.event_types[event_type], event=event)
-        session.add(event)
-        session.commit()
+        # completion and exception events are forced to disk before returning
+        sync = event_type in ('completion', 'exception')
+        app.event_writer.add(run_id, self.event_types[event_type], event, sync=sync)
+        self._publish()
+        timestamp = datetime.now().isoformat()
+        mission_snapshot.add_event(self.id, run_id, timestamp, event_type, event)
+        # traces are read from the run timeline
+        if event_type != 'trace' and not self.deleted:
+            event_stream.publish(self.id, run_id, timestamp, event_type, event, encoded)
+
+    def _resume_job_id(self):
+        return '%s:resume' % self.name
+
+    def _executor_name(self):
+        # urgent missions have scheduler threads reserved for them
+        return 'urgent' if self.program.priority >= app.config['URGENT_PRIORITY'] else 'default'
 
     def _execute_mission(self):
-        with session_scope() as session:
-            dbobj = self._get_dbobj(session)
-            run = Run(mission=dbobj, script=dbobj.script)
-            session.add(run)
-            session.commit()
-            add_event = functools.partial(self._add_event, session, run)
-
-            add_event('start')
-
-            error_policy = ErrorPolicy(self.mission.get('onerror', {}))
-            sequence = self.blocks.get(Tags.MISSION)
-            if sequence is not None:
-                complete = False
-                attempt = 0
-                max_attempts = error_policy.count
-                backoff = error_policy.backoff
-                while not complete and attempt < max_attempts:
-                    try:
-                        with lock_instrument(self.mission.get(Tags.INSTRUMENT, []), self.executor, add_event):
-                            self.running = True
-                            self.run_count += 1
-                            self._execute_sequence(Tags.MISSION, add_event)
-                            complete = True
-                    except (LockException, ConnectionError) as e:
-                        log.error('Exception locking instruments for mission: %s (%r)', self.name, e)
-                        if error_policy.action == 'retry':
-                            attempt += 1
-                            time.sleep(backoff)
-                        else:
-                            break
-                    except (InstrumentException, PolicyException, CommandArgumentException, ConnectionError) as e:
-                        log.error('Exception when processing mission, aborting mission (%r)', e)
-                        add_event('exception', str(e))
-                        break
-                    finally:
-                        self.running = False
-                        self.current_step = None
+        if not app.instrument_scheduler.submit(self.name, self.program.drivers, self._start_run,
+                                               priority=self.program.priority, on_preempt=self._preempt):
+            log.warn('Mission %s is still running, skipping this run', self.name)
+        self._publish()
 
-                if not complete:
-                    log.error('Unable to complete mission: %s', self.name)
+    def _start_run(self, request):
+        """
+        Called by the instrument scheduler when no other run of this executive holds the mission's drivers
+        :param request: RunRequest, carrying the run id, lock attempts and checkpoint across requeues
+        """
+        if request.run_id is None:
+            with session_scope() as session:
+                dbobj = self._get_dbobj(session)
+                run = Run(mission=dbobj, script=dbobj.script)
+                session.add(run)
+                dbobj.run_count = MissionData.run_count + 1
+                session.commit()
+                request.run_id = run.id
+                self.run_count += 1
+            self._add_event(request.run_id, 'start')
+            request.trace = tracing.Trace('run', self.name, origin=request.submitted)
+            request.trace.start('queue', 'queue', request.trace.root, start=request.trace.base).finish()
+
+        run_id = request.run_id
+        add_event = functools.partial(self._add_event, run_id)
+
+        program = request.state.program if request.state is not None else self.program
+        error_policy = program.error_policy
+        if program.entry is not None:
+            try:
+                with request.trace.span('lock', 'lock'):
+                    app.lock_manager.acquire(program.drivers, self.executor, add_event)
+            except (LockException, ConnectionError) as e:
+                # held outside this executive, try again later without holding a thread
+                log.error('Exception locking instruments for mission: %s (%r)', self.name, e)
+                request.attempts += 1
+                if error_policy.action == 'retry' and request.attempts < error_policy.count:
+                    app.instrument_scheduler.requeue(self.name, error_policy.backoff)
+                    return
+            else:
+                state = request.state
+                if state is None:
+                    state = request.state = RunState(run_id, program, trace=request.trace)
+                    state.push(program.entry)
+                state.resumed()
+                self.run_request = request
+                self.current_run = state
+                if state.resume_time is not None and state.resume_time > time.time():
+                    # preempted while suspended in a sleep
+                    self._suspend(state)
+                else:
+                    self._run_segment(state)
+                return
+
+            log.error('Unable to complete mission: %s', self.name)
+
+        app.instrument_scheduler.release(self.name)
+        self._end_trace(request.trace, add_event)
+        add_event('completion')
+
+    def _resume_mission(self, state):
+        log.info('Resuming mission: %s run: %d', self.name, state.run_id)
+        state.resumed()
+        self._run_segment(state)
 
+    @staticmethod
+    def _flush_trace(trace, add_event):
+        """
+        Record the spans finished since the last flush in a trace event
+        """
+        data = trace.drain()
+        if data is not None:
+            add_event('trace', data)
+
+    def _end_trace(self, trace, add_event):
+        trace.close()
+        self._flush_trace(trace, add_event)
+
+    def _run_segment(self, state):
+        """
+        Execute the run described by state until it completes or is suspended.
+        Instruments are released only when the run is complete.
+        """
+        add_event = functools.partial(self._add_event, state.run_id)
+        complete = True
+        self.running = True
+        self.vars = state.vars
+        try:
+            complete = self._run(state, add_event)
+        except (InstrumentException, PolicyException, CommandArgumentException, ConnectionError,
+                LockException) as e:
+            log.error('Exception when processing mission, aborting mission (%r)', e)
+            add_event('exception', str(e))
+        finally:
+            self.current_step = None
+            if complete:
+                self.running = False
+                self.current_run = None
+                self.run_request = None
+                with state.trace.span('unlock', 'unlock'):
+                    app.lock_manager.release(state.program.drivers, self.executor, add_event)
+                app.instrument_scheduler.release(self.name)
+
+        if complete:
+            self._end_trace(state.trace, add_event)
             add_event('completion')
+        elif state.preempted:
+            self._checkpoint(state)
+        else:
+            self._suspend(state)
+
+    def _suspend(self, state):
+        if self.deleted:
+            self._cancel_run(state, 'mission deleted')
+            return
+        run_date = datetime.fromtimestamp(state.resume_time)
+        log.info('Suspending mission: %s run: %d until %s', self.name, state.run_id, run_date)
+        state.wait_for('suspend')
+        self._flush_trace(state.trace, functools.partial(self._add_event, state.run_id))
+        app.scheduler.add_job(self._resume_mission, 'date', run_date=run_date, args=[state],
+                              id=self._resume_job_id(), misfire_grace_time=None,
+                              executor=self._executor_name())
+        request = self.run_request
+        if request is not None and request.preempt_requested:
+            self._preempt(request)
+
+    def _cancel_suspended_run(self, reason):
+        """
+        End the run suspended in a sleep, if any. A run executing a step is not interrupted.
+        """
+        state = self.current_run
+        if state is None:
+            return
+        try:
+            app.scheduler.remove_job(self._resume_job_id())
+        except JobLookupError:
+            # not suspended, or already resuming
+            return
+        self._cancel_run(state, reason)
+
+    def _cancel_run(self, state, reason):
+        """
+        Release the drivers of a run which will not continue and record its end
+        """
+        log.info('Cancelling mission: %s run: %d (%s)', self.name, state.run_id, reason)
+        add_event = functools.partial(self._add_event, state.run_id)
+        add_event('exception', 'Run cancelled: %s' % reason)
+        self.running = False
+        self.current_run = None
+        self.run_request = None
+        with state.trace.span('unlock', 'unlock'):
+            app.lock_manager.release(state.program.drivers, self.executor, add_event)
+        app.instrument_scheduler.release(self.name)
+        self._end_trace(state.trace, add_event)
+        add_event('completion')
+
+    def _preempt(self, request):
+        """
+        Called by the instrument scheduler when an urgent run needs the drivers of this run.
+        A suspended run is checkpointed immediately, a running run at its next step boundary.
+        """
+        if request is not self.run_request:
+            return
+        try:
+            app.scheduler.remove_job(self._resume_job_id())
+        except JobLookupError:
+            # not suspended, or already resuming
+            return
+        self._checkpoint(request.state)
+
+    def _checkpoint(self, state):
+        """
+        Release the drivers of a preempted run and queue it to continue from state
+        """
+        log.info('Preempting mission: %s run: %d', self.name, state.run_id)
+        add_event = functools.partial(self._add_event, state.run_id)
+        add_event('preempt', state.to_dict())
+        state.preempted = False
+        state.wait_for('preempted')
+        self.running = False
+        self.current_run = None
+        self.run_request = None
+        with state.trace.span('unlock', 'unlock'):
+            app.lock_manager.release(state.program.drivers, self.executor, add_event)
+        self._flush_trace(state.trace, add_event)
+        app.instrument_scheduler.preempted(self.name)
+        self._publish()
+
+    def _can_suspend(self, step):
+        return app.config['RESUMABLE_SLEEP'] and step.duration >= app.config['RESUMABLE_SLEEP_THRESHOLD']
+
+    def _run(self, state, add_event):
+        """
+        Interpret the compiled mission from the position recorded in state
+        :param state: RunState checkpoint, updated as steps are executed
+        :param add_event:
+        :return: True if the run is complete, False if it was suspended by a sleep step or preempted
+        """
+        program = state.program
+        request = self.run_request
+        while not state.complete:
+            if request is not None and request.preempt_requested and not state.branch:
+                state.preempted = True
+                return False
+
+            lost = app.lock_manager.lost(program.drivers, self.executor) if not state.branch else None
+            if lost:
+                # another owner may be commanding the instruments
+                raise LockException('Lost the locks on %s' % ', '.join(lost))
+
+            frame = state.current
+            steps = frame.block.steps
 
-    def _execute_sequence(self, section, add_event):
-        block = self.blocks.get(section)
-        sequence = block.get('sequence', [])
-        block_error_policy = ErrorPolicy(block.get('onerror', self.mission.get('onerror', {})))
-        if sequence is not None:
-            for index, step in enumerate(sequence):
-                error_policy = ErrorPolicy(step.get('onerror', {})) if 'onerror' in block else block_error_policy
-                self.current_step = (index, step)
-                log.info('Executing step: %s from mission: %s section: %s', step, self.name, section)
-                add_event('step', step)
-                rval = self._handle_step(step, error_policy, add_event)
-                if rval is not None:
+            if frame.index >= len(steps):
+                state.next_iteration()
+                continue
+
+            step = steps[frame.index]
+            frame.index += 1
+
+            self.current_step = (step.index, step.source)
+            if program.verbose or program.debug:
+                log.info('Executing step: %s from mission: %s section: %s', step.source, self.name, frame.block.label)
+            for source in step.sources:
+                add_event('step', source)
+
+            try:
+                if isinstance(step, BlockStep):
+                    if step.condition is None or step.condition.evaluate(state.vars):
+                        state.push(step.block, step.loop, step.error_policy)
+                    elif program.debug:
+                        log.debug('Skipping block %s, condition not met: %r', step.block_name, step.condition)
+                    continue
+
+                if isinstance(step, SleepStep) and not state.branch and self._can_suspend(step):
+                    state.suspend(step.duration)
+                    return False
+
+                with state.trace.span('step', self._span_name(frame.block, step), state.parent_span()):
+                    rval = self._handle_step(step, state, add_event)
+            except Exception as e:
+                self._unwind(state, e)
+                continue
+
+            if rval is not None:
+                for _ in step.sources:
                     add_event('result', rval)
 
-    def _handle_step(self, step, error_policy, add_event):
-        log.info('step: %r', step)
+        return True
+
+    @staticmethod
+    def _span_name(block, step):
+        name = '%s[%d]' % (block.label, step.index)
+        if isinstance(step, CommandStep):
+            return '%s %s %s' % (name, step.command, step.target)
+        if isinstance(step, ParallelStep):
+            return '%s parallel' % name
+        if isinstance(step, SleepStep):
+            return '%s sleep' % name
+        return name
+
+    def _run_parallel(self, step, state, add_event):
+        """
+        Execute the branches of a parallel step, at most step.max_concurrency at a time.
+        Branch variables are merged back into the run in branch order once all branches have finished.
+        Branches of a parallel step nested inside another branch are executed one after another.
+        """
+        pending = deque(enumerate(step.branches))
+        running = {}
+        parent = tracing.current()
+        results = []
+        errors = []
+
+        while pending or running:
+            while pending and len(running) < step.max_concurrency and not (errors and step.join == 'fail_fast'):
+                index, branch = pending.popleft()
+                if state.branch:
+                    try:
+                        results.append((index, self._run_branch(branch, state, add_event, parent)))
+                    except Exception as e:
+                        errors.append(e)
+                    continue
+                running[app.branch_executor.submit(self._run_branch, branch, state, add_event, parent)] = index
+
+            if not running:
+                break
+
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    results.append((index, future.result()))
+                except Exception as e:
+                    errors.append(e)
+
+        for _, variables in sorted(results):
+            state.vars.update(variables)
+
+        if errors:
+            raise errors[0]
+
+    def _run_branch(self, branch, state, add_event, parent=None):
+        """
+        Execute one branch of a parallel step, applying the branch error policy
+        :param parent: Span of the parallel step
+        :return: the branch variables
+        """
+        error_policy = branch.error_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with state.trace.span('branch', branch.block_name, parent) as span:
+                    branch_state = state.branch_state(branch.block, span)
+                    try:
+                        self._run(branch_state, add_event)
+                    finally:
+                        while not branch_state.complete:
+                            branch_state.pop()
+                self._branch_event(branch, add_event, 'completed', attempt)
+                return branch_state.vars
+            except Exception as e:
+                if error_policy.action == 'retry' and attempt < error_policy.count:
+                    log.error('Exception in branch: %r retrying (%r)', branch.block_name, e)
+                    time.sleep(error_policy.backoff)
+                    continue
+                self._branch_event(branch, add_event, 'failed', attempt, e)
+                if error_policy.action in ('continue', 'ignore'):
+                    log.error('Exception in branch: %r executing %s policy: %r', branch.block_name, error_policy.action, e)
+                    return {}
+                raise
+
+    @staticmethod
+    def _branch_event(branch, add_event, status, attempts, exception=None):
+        """
+        Record the outcome of a fan-out branch, giving one result per driver for the run
+        """
+        if branch.driver is None:
+            return
+        event = {'driver': branch.driver, 'status': status, 'attempts': attempts}
+        if exception is not None:
+            event['error'] = str(exception)
+        add_event('branch', event)
+
+    def _unwind(self, state, exception):
+        """
+        Pop blocks off the run until one whose error policy handles the exception.
+        Blocks without an error policy of their own pass the exception on.
+        Re-raises the exception if no enclosing block handles it.
+        """
+        while state.current is not None:
+            frame = state.pop()
+            error_policy = frame.error_policy
+            if error_policy is None or error_policy.action == 'abort':
+                continue
+            if error_policy.action == 'continue':
+                log.error('Exception in block: %r executing continue policy: %r', frame.block.label, exception)
+                return
+            if frame.attempt < error_policy.count:
+                log.error('Exception in block: %r retrying (%r)', frame.block.label, exception)
+                time.sleep(error_policy.backoff)
+                retry = state.push(frame.block, frame.loop, error_policy)
+                retry.attempt = frame.attempt + 1
+                return
+            exception = PolicyException()
+
+        raise exception
+
+    def _handle_step(self, step, state, add_event):
+        error_policy = step.error_policy
         count = 0
         while count < error_policy.count:
             count += 1
             try:
-                if 'block_name' in step:
-                    if self._eval_conditional(step):
-                        loop = step.get('loop', 1)
-                        for _ in xrange(loop):
-                            self._execute_sequence(step['block_name'], add_event)
-                    return
-
-                if 'sleep' in step:
-                    return time.sleep(step['sleep'])
-
-                rval = self.executor.command(step)
-                if step.get('get_state'):
-                    self.vars['driver_state'] = rval.value
-                elif step.get('get') and step.get('parameter'):
-                    self.vars[step.get('parameter')] = rval.value
+                if isinstance(step, SleepStep):
+                    return time.sleep(step.duration)
+
+                if isinstance(step, ParallelStep):
+                    return self._run_parallel(step, state, add_event)
+
+                if state.branch:
+                    with state.driver_lock(step.target):
+                        rval = step.call()
+                else:
+                    rval = step.call()
+                if step.store is not None:
+                    state.vars[step.store] = rval.value
                 return rval
 
             except Exception as e:
                 if error_policy.action == 'abort':
                     raise e
                 if error_policy.action == 'continue':
-                    log.error('Exception in step: %r executing continue policy: %r', step, e)
+                    log.error('Exception in step: %r executing continue policy: %r', step.source, e)
                     return
+                if count < error_policy.count:
+                    log.error('Exception in step: %r retrying (%r)', step.source, e)
+                    time.sleep(error_policy.backoff)
 
         raise PolicyException
 
-    def _eval_conditional(self, step):
-        log.debug('eval_conditional: %r', step)
-        conditional = step.get('condition')
-        if not conditional:
-            return True
-
-        expected_value = conditional.get('value')
-        current_value = self.vars.get(conditional.get('variable'))
-        comparator = conditional.get('comparator', 'equal')
-        log.debug('eval_conditional %r %r %r', expected_value, comparator, current_value)
-        return (comparator == 'equal') ^ (not expected_value == current_value)
-
     @staticmethod
     def from_script(data):
         return Mission(script=data)
@@ -432,16 +838,91 @@ class Mission(object):
 
             dbobj = self._get_dbobj(session)
             dbobj.script = script
-            self.version = dbobj.script.version
             session.commit()
+
+            if self.active:
+                self._unschedule_mission()
+            self._load(dbobj)
+            if self.active:
+                self._schedule_mission()
+            self._publish(script=True)
             return True
 
-    def runs(self):
+    def runs(self, limit=100, after_id=None, since=None, until=None, descending=False, archived=False):
+        """
+        Page through the ids of this mission's runs
+        :param after_id: only return runs after this run id in the requested order
+        :param since: only return runs started at or after this time
+        :param until: only return runs started before this time
+        :param archived: include the archived runs
+        :return: list of run ids, id to pass as after_id for the next page or None
+        """
+        tables = [(Run.id, Run.mission_id, Run.start_time)]
+        if archived:
+            tables.append((ArchivedRun.run_id, ArchivedRun.mission_id, ArchivedRun.start_time))
+
+        runs = []
         with session_scope() as session:
-            runs = session.query(Run).filter(Run.mission_id == self.id).all()
-            runs = [run.id for run in runs]
-            return runs
+            for id_column, mission_column, time_column in tables:
+                query = session.query(id_column).filter(mission_column == self.id)
+                if since is not None:
+                    query = query.filter(time_column >= since)
+                if until is not None:
+                    query = query.filter(time_column < until)
+                if descending:
+                    if after_id is not None:
+                        query = query.filter(id_column < after_id)
+                    query = query.order_by(id_column.desc())
+                else:
+                    if after_id is not None:
+                        query = query.filter(id_column > after_id)
+                    query = query.order_by(id_column)
+                runs.extend(run_id for run_id, in query.limit(limit))
+
+        # merge the pages read from both tables
+        runs = sorted(set(runs), reverse=descending)[:limit]
+        next_id = runs[-1] if len(runs) == limit else None
+        return runs, next_id
+
+    def get_run(self, run_id, limit=100, after_id=None, since=None, until=None, event_types=None):
+        with session_scope() as session:
+            return self._get_events(session, run_id, limit=limit, after_id=after_id,
+                                    since=since, until=until, event_types=event_types)
 
-    def get_run(self, run_id):
+    def timeline(self, run_id):
+        """
+        The spans recorded by a run, including the unsaved spans of the run in progress
+        :return: dictionary of the run spans and their durations aggregated per kind and name,
+                 None if the run does not belong to this mission
+        """
         with session_scope() as session:
-            return self._get_events(session, run_id)
+            live_id = session.query(Run.id).filter(Run.mission_id == self.id).filter(Run.id == run_id).scalar()
+            if live_id is None:
+                run = self._get_archived_run(session, run_id)
+                if run is None:
+                    return None
+                traces = [event for _, _, event_type, event in run['events'] if event_type == 'trace']
+            else:
+                traces = [event for event, in session.query(Event.event).filter(Event.run_id == run_id)
+                          .filter(Event.event_type_id == self.event_types.get('trace')).order_by(Event.id)]
+            origin = None
+            spans = []
+            for event in traces:
+                data = json.loads(event)
+                origin = data['origin']
+                spans.extend(tracing.decode(data))
+
+        state = self.current_run
+        live = state is not None and state.run_id == run_id
+        if live:
+            origin = state.trace.origin
+            spans.extend(state.trace.snapshot())
+
+        spans.sort(key=lambda span: span['id'])
+        return {
+            'run_id': run_id,
+            'origin': datetime.fromtimestamp(origin).isoformat() if origin is not None else None,
+            'live': live,
+            'spans': spans,
+            'summary': tracing.summarize(spans),
+        }
@@ -0,0 +1,261 @@
+from contextlib import closing
+from io import BytesIO
+import logging
+import os
+import tarfile
+import zipfile
+
+from concurrent import futures
+from jsonschema import ValidationError
+from yaml import YAMLError
+
+import mission_schema
+from ooi_executive.backing_store import MissionData, Script
+from ooi_executive.compiler import compile_mission
+from ooi_executive.executors import Executor
+from ooi_executive.script_cache import parse
+from ooi_executive.shared import CompileException
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+SCRIPT_EXTENSIONS = ('.yml', '.yaml')
+# timeout given to the executor scripts are compiled against, as Mission.DEFAULT_TIMEOUT
+COMPILE_TIMEOUT = 30000
+
+
+class BatchScript(object):
+    """
+    A mission script of an imported or validated batch
+    :param source: archive member name or position of the document in the YAML stream
+    :param text: the script as stored in the database
+    """
+    def __init__(self, source, text):
+        self.source = source
+        self.text = text
+        self.mission = None
+        self.error = None
+        self.status = None
+        self.mission_id = None
+        self.script_id = None
+        self.conflicts = None
+
+    @property
+    def name(self):
+        return self.mission['name'] if self.mission is not None else None
+
+    @property
+    def version(self):
+        return self.mission['version'] if self.mission is not None else None
+
+    def fail(self, status, error):
+        self.status = status
+        self.error = error
+
+    def report(self):
+        report = {'source': self.source, 'status': self.status}
+        for key, value in (('name', self.name), ('version', self.version), ('id', self.mission_id),
+                           ('version_id', self.script_id), ('error', self.error),
+                           ('schedule_conflicts', self.conflicts)):
+            if value:
+                report[key] = value
+        return report
+
+
+def split_documents(text):
+    """
+    Split a YAML stream into the text of its documents, skipping empty documents
+    :return: list of BatchScript
+    """
+    documents = []
+    lines = []
+
+    def end_document():
+        if any(line.strip() and not line.lstrip().startswith('#') for line in lines):
+            documents.append(BatchScript('document %d' % (len(documents) + 1), ''.join(lines)))
+        del lines[:]
+
+    for line in text.splitlines(True):
+        if line.startswith('---') and line[3:4] in ('', ' ', '\t', '\r', '\n'):
+            end_document()
+            if line[3:].strip():
+                lines.append(line[3:].lstrip())
+        elif line.startswith('...') and not line[3:].strip():
+            end_document()
+        elif line.startswith('%') and not lines:
+            # directives precede the document start marker
+            continue
+        else:
+            lines.append(line)
+    end_document()
+    return documents
+
+
+def is_archive(data):
+    return (data[:4] == 'PK\x03\x04' or data[:2] == '\x1f\x8b' or data[:3] == 'BZh' or
+            data[257:262] == 'ustar')
+
+
+def _is_script(path):
+    name = os.path.basename(path)
+    return (os.path.splitext(name)[1].lower() in SCRIPT_EXTENSIONS and not name.startswith('.') and
+            '__MACOSX' not in path)
+
+
+def read_archive(data):
+    """
+    Mission scripts of a zip or (compressed) tar archive, by member name
+    :raises ValueError: if the archive can not be read
+    :return: list of BatchScript
+    """
+    buf = BytesIO(data)
+    try:
+        if zipfile.is_zipfile(buf):
+            with closing(zipfile.ZipFile(buf)) as archive:
+                members = [(info.filename, archive.read(info)) for info in archive.infolist()
+                           if _is_script(info.filename)]
+        else:
+            buf.seek(0)
+            with closing(tarfile.open(fileobj=buf, mode='r:*')) as archive:
+                members = [(info.name, archive.extractfile(info).read()) for info in archive
+                           if info.isfile() and _is_script(info.name)]
+    except (zipfile.BadZipfile, tarfile.TarError, IOError, EOFError) as e:
+        raise ValueError('Unable to read archive: %s' % e)
+    return [BatchScript(name, text) for name, text in sorted(members)]
+
+
+def read_batch(data):
+    """
+    :param data: a YAML stream of mission scripts or an archive of script files
+    :return: list of BatchScript, True if data is an archive
+    """
+    if is_archive(data):
+        return read_archive(data), True
+    return split_documents(data), False
+
+
+def _error_message(error):
+    if isinstance(error, ValidationError):
+        return error.message
+    return str(error)
+
+
+def validate_script(text):
+    """
+    Parse, validate and compile a mission script, run in the worker processes
+    :return: mission dictionary or None, error message or None
+    """
+    try:
+        mission = parse(text)
+        mission_schema.validate(mission)
+        compile_mission(mission, Executor(mission['name'], COMPILE_TIMEOUT))
+    except (ValidationError, YAMLError, CompileException) as e:
+        return None, _error_message(e)
+    except Exception as e:
+        return None, 'Unable to compile mission: %r' % e
+    return mission, None
+
+
+def validate_scripts(texts):
+    return [validate_script(text) for text in texts]
+
+
+class ValidationPool(object):
+    """
+    Validates the scripts of a batch in size worker processes, or in the
+    calling thread if size is 0. The scripts are sent in a few chunks per
+    worker and only the parsed missions are returned.
+    """
+    CHUNKS_PER_WORKER = 4
+
+    def __init__(self, size=0):
+        self.size = size
+        self.pool = None
+
+    def start(self):
+        if self.size > 0:
+            self.pool = futures.ProcessPoolExecutor(self.size)
+            # every worker is forked on the first submission, do it now before
+            # the executive starts its threads, without waiting for the result
+            # as the pool's threads may need the import lock held by our caller
+            self.pool.submit(int)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def validate(self, scripts):
+        """
+        Set the mission or error of each BatchScript, and the status 'invalid' of the failed scripts
+        and of the scripts of a mission already in the batch
+        """
+        texts = [script.text for script in scripts]
+        if self.pool is None or len(texts) < 2:
+            results = validate_scripts(texts)
+        else:
+            size = max(1, -(-len(texts) // (self.size * self.CHUNKS_PER_WORKER)))
+            chunks = [texts[i:i + size] for i in xrange(0, len(texts), size)]
+            results = [result for chunk in self.pool.map(validate_scripts, chunks) for result in chunk]
+
+        names = set()
+        for script, (mission, error) in zip(scripts, results):
+            script.mission = mission
+            if error is not None:
+                script.fail('invalid', error)
+            elif script.name in names:
+                script.fail('invalid', 'Mission %s appears more than once in the batch' % script.name)
+            names.add(script.name)
+
+
+def store_batch(session, scripts, activate=False):
+    """
+    Add the missions and versions of the valid scripts of a batch in the transaction of session
+    Sets the status of each script, 'created', 'updated' or 'unchanged' if stored, and the ids
+    of its mission and script.
+    :param scripts: BatchScripts validated by ValidationPool, scripts with a status are skipped
+    :param activate: activate the new missions
+    """
+    pending = [script for script in scripts if script.status is None]
+    names = {script.name for script in pending}
+    if not names:
+        return
+    missions = {mission.name: mission for mission in
+                session.query(MissionData).filter(MissionData.name.in_(names))}
+    versions = {(row.name, row.version): row for row in
+                session.query(Script).filter(Script.name.in_(names))}
+
+    current = []
+    for script in pending:
+        name, version = script.name, script.version
+        mission = missions.get(name)
+        row = versions.get((name, version))
+        if row is not None and row.script != script.text:
+            script.fail('invalid', 'Version %s of mission %s exists with a different script' % (version, name))
+            continue
+
+        if mission is None:
+            mission = MissionData(name=name, active=activate)
+            session.add(mission)
+            script.status = 'created'
+        elif mission.script_id is None:
+            # a deleted mission
+            mission.active = activate
+            script.status = 'created'
+        elif row is not None and mission.script_id == row.id:
+            script.status = 'unchanged'
+        else:
+            script.status = 'updated'
+        if row is None:
+            row = Script(script=script.text, name=name, version=version, mission=mission)
+            session.add(row)
+        current.append((script, mission, row))
+
+    # missions and scripts reference each other, the current script is set once both have ids
+    session.flush()
+    for script, mission, row in current:
+        mission.script = row
+        script.mission_id = mission.id
+        script.script_id = row.id
+    session.flush()
@@ -1,4 +1,5 @@
 import jsl
+from jsonschema.validators import validator_for
 
 
 __author__ = 'petercable'
@@ -34,8 +35,9 @@ class DateTime(jsl.Document):
 
 
 class Event(jsl.Document):
-    source = jsl.StringField(required=True)
+    source = jsl.StringField(required=True, description="OMS platform id, '*' matches any platform")
     event = jsl.StringField(required=True)
+    pattern = jsl.BooleanField(description="Match event as a regular expression against the message text")
 
 
 # COMMANDS
@@ -57,6 +59,7 @@ class Execute(Command):
 class GetParameter(Command):
     get = jsl.StringField(required=True)
     parameter = jsl.StringField(required=True)
+    max_age = jsl.NumberField(minimum=0, description="Accept a value read up to this many seconds ago")
 
 
 class SetParameter(Command):
@@ -71,8 +74,24 @@ class SetParameter(Command):
     )
 
 
+class SetParameters(Command):
+    set = jsl.StringField(required=True)
+    parameters = jsl.DictField(
+        additional_properties=jsl.OneOfField(
+            [
+                jsl.StringField(),
+                jsl.NumberField(),
+            ]
+        ),
+        required=True,
+        min_properties=1,
+        description="Parameters and values set in a single request"
+    )
+
+
 class GetState(Command):
     get_state = jsl.StringField(required=True)
+    max_age = jsl.NumberField(minimum=0, description="Accept a state read up to this many seconds ago")
 
 
 class Discover(Command):
@@ -118,6 +137,42 @@ class RunBlock(jsl.Document):
     block_name = jsl.StringField(required=True)
     condition = jsl.DocumentField(Condition)
     loop = jsl.IntField()
+    error_policy = jsl.OneOfField(
+        [
+            jsl.DocumentField(RetryPolicy),
+            jsl.DocumentField(SimplePolicy),
+        ], description="Applied to the block as a whole, overrides the policy of the block")
+
+
+class Branch(jsl.Document):
+    block_name = jsl.StringField(required=True)
+    error_policy = jsl.OneOfField(
+        [
+            jsl.DocumentField(RetryPolicy),
+            jsl.DocumentField(SimplePolicy),
+        ])
+
+
+class Parallel(jsl.Document):
+    parallel = jsl.ArrayField(
+        jsl.OneOfField(
+            [
+                jsl.StringField(),
+                jsl.DocumentField(Branch),
+            ]
+        ),
+        required=True,
+        min_items=1,
+        description="Blocks to execute concurrently"
+    )
+    max_concurrency = jsl.IntField(minimum=1, description="Maximum number of branches executing at once")
+    join = jsl.StringField(enum=['all', 'fail_fast'],
+                           description="Wait for all branches, or start no new branches after a failure")
+    error_policy = jsl.OneOfField(
+        [
+            jsl.DocumentField(RetryPolicy),
+            jsl.DocumentField(SimplePolicy),
+        ])
 
 
 class Block(jsl.Document):
@@ -128,6 +183,7 @@ class Block(jsl.Document):
                 jsl.DocumentField(Execute),
                 jsl.DocumentField(GetParameter),
                 jsl.DocumentField(SetParameter),
+                jsl.DocumentField(SetParameters),
                 jsl.DocumentField(GetState),
                 jsl.DocumentField(Discover),
                 jsl.DocumentField(Reset),
@@ -137,6 +193,7 @@ class Block(jsl.Document):
                 jsl.DocumentField(SetInitParams),
                 jsl.DocumentField(Configure),
                 jsl.DocumentField(RunBlock),
+                jsl.DocumentField(Parallel),
                 jsl.DocumentField(jsl.RECURSIVE_REFERENCE_CONSTANT),
             ]
         ),
@@ -144,6 +201,29 @@ class Block(jsl.Document):
     )
     condition = jsl.DocumentField(Condition)
     loop = jsl.IntField()
+    error_policy = jsl.OneOfField(
+        [
+            jsl.DocumentField(RetryPolicy),
+            jsl.DocumentField(SimplePolicy),
+        ], description="Applied to the block as a whole when one of its steps fails")
+
+
+class Fanout(jsl.Document):
+    max_concurrency = jsl.IntField(minimum=1, description="Maximum number of drivers processed at once")
+    join = jsl.StringField(enum=['all', 'fail_fast'],
+                           description="Wait for all drivers, or start no new drivers after a failure")
+    error_policy = jsl.OneOfField(
+        [
+            jsl.DocumentField(RetryPolicy),
+            jsl.DocumentField(SimplePolicy),
+        ],
+        description="Error policy applied to each driver")
+
+
+# HISTORY
+class Retention(jsl.Document):
+    runs = jsl.IntField(minimum=1, description="Keep the last runs runs in the database")
+    days = jsl.NumberField(minimum=0, description="Keep the runs started in the last days days in the database")
 
 
 # MISSION
@@ -165,4 +245,22 @@ class Mission(jsl.Document):
         ])
     debug = jsl.BooleanField()
     verbose = jsl.BooleanField()
+    priority = jsl.IntField(minimum=0, description="Runs with a higher priority are started first, "
+                                                   "urgent runs preempt lower priority runs")
+    max_age = jsl.NumberField(minimum=0, description="Default max_age of get and get_state steps")
+    fanout = jsl.DocumentField(Fanout, description="Execute the blocks once for each driver, "
+                                                   "substituting the driver for {driver}")
+    retention = jsl.DocumentField(Retention, description="Runs kept in the database, older runs are archived")
     blocks = jsl.ArrayField(jsl.DocumentField(Block), required=True)
+
+
+# the mission schema is generated and its validator built once at import
+SCHEMA = Mission.get_schema()
+VALIDATOR = validator_for(SCHEMA)(SCHEMA)
+
+
+def validate(mission):
+    """
+    Validate a mission dictionary, raising jsonschema.ValidationError if invalid
+    """
+    VALIDATOR.validate(mission)
@@ -0,0 +1,159 @@
+from threading import Lock
+from uuid import uuid4
+import json
+import logging
+
+from ooi_executive.shared import MyEncoder
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+# events of the most recent run included in the full view of a mission
+EVENT_LIMIT = 10
+
+
+class _Entry(object):
+    def __init__(self, summary, script):
+        self.summary = summary
+        self.script = script
+        self.version = 0
+        self.run_id = None
+        self.events = None
+        self.rendered = None
+
+
+class MissionSnapshot(object):
+    """
+    Versioned summaries of every mission, served to the mission endpoints without
+    querying the database or the scheduler.
+
+    Missions publish a new summary whenever their state changes and the events
+    of their current run as they are added. Every change increments the version
+    of the mission and of the snapshot, which form the ETags of the responses,
+    and rendered responses are kept until the next change.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = {}
+        self.version = 0
+        self.rendered = {}
+        # ETags of a previous process never match
+        self.epoch = uuid4().hex[:8]
+
+    def _changed(self, entry):
+        entry.version += 1
+        entry.rendered = None
+        self.version += 1
+
+    def update(self, mission_id, summary, script=None):
+        """
+        :param summary: Mission.small(), not modified once published
+        :param script: mission script, unchanged if None
+        """
+        with self.lock:
+            entry = self.entries.get(mission_id)
+            if entry is None:
+                entry = self.entries[mission_id] = _Entry(summary, script)
+            else:
+                entry.summary = summary
+                if script is not None:
+                    entry.script = script
+            self._changed(entry)
+
+    def add_event(self, mission_id, run_id, timestamp, event_type, event):
+        """
+        Record an event of a run, the first EVENT_LIMIT events of the most recent run are kept
+        :param event: event as written to the database, decoded if it is JSON
+        """
+        with self.lock:
+            entry = self.entries.get(mission_id)
+            if entry is None:
+                return
+            if entry.events is None and event_type == 'start':
+                # the events of earlier runs are no longer needed
+                entry.events = []
+            if entry.events is not None:
+                if run_id != entry.run_id:
+                    entry.run_id = run_id
+                    entry.events = []
+                if len(entry.events) < EVENT_LIMIT:
+                    try:
+                        event = json.loads(event)
+                    except ValueError:
+                        pass
+                    entry.events.append((timestamp, event_type, event))
+            self._changed(entry)
+
+    def load_events(self, mission_id, version, run_id, events):
+        """
+        Set the events read from the database while the mission was at version
+        :return: False if the mission changed since
+        """
+        with self.lock:
+            entry = self.entries.get(mission_id)
+            if entry is None or entry.version != version or entry.events is not None:
+                return False
+            entry.run_id = run_id
+            entry.events = list(events)
+            entry.rendered = None
+            return True
+
+    def remove(self, mission_id):
+        with self.lock:
+            if self.entries.pop(mission_id, None) is not None:
+                self.version += 1
+
+    def etag(self, version, mission_id=None):
+        if mission_id is None:
+            return '%s-%d' % (self.epoch, version)
+        return '%s-%d-%d' % (self.epoch, mission_id, version)
+
+    def summaries(self, state=None):
+        """
+        :param state: 'active', 'inactive' or None for every mission
+        :return: (ETag, JSON body)
+        """
+        with self.lock:
+            version = self.version
+            cached = self.rendered.get(state)
+            if cached is not None and cached[0] == version:
+                return self.etag(version), cached[1]
+            summaries = {mission_id: entry.summary for mission_id, entry in self.entries.iteritems()
+                         if state is None or entry.summary['active'] == (state == 'active')}
+
+        body = json.dumps(summaries, cls=MyEncoder)
+        with self.lock:
+            if self.version == version:
+                self.rendered[state] = (version, body)
+        return self.etag(version), body
+
+    def version_of(self, mission_id):
+        with self.lock:
+            entry = self.entries.get(mission_id)
+            return entry.version if entry is not None else None
+
+    def full(self, mission_id):
+        """
+        :return: (ETag, JSON body), or None if the events of the mission have not been loaded
+        """
+        with self.lock:
+            entry = self.entries.get(mission_id)
+            if entry is None or entry.events is None:
+                return None
+            version = entry.version
+            etag = self.etag(version, mission_id)
+            if entry.rendered is not None:
+                return etag, entry.rendered
+            full = dict(entry.summary)
+            full['events'] = list(entry.events)
+            full['script'] = entry.script
+
+        body = json.dumps(full, cls=MyEncoder)
+        with self.lock:
+            if entry.version == version:
+                entry.rendered = body
+        return etag, body
+
+
+mission_snapshot = MissionSnapshot()
@@ -0,0 +1,97 @@
+from threading import Event as ThreadEvent, Lock
+import logging
+import time
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+
+class _Entry(object):
+    def __init__(self, value, fetched):
+        self.value = value
+        self.fetched = fetched
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = ThreadEvent()
+        self.value = None
+        self.error = None
+
+
+class ReadCache(object):
+    """
+    Read-through cache of driver state and parameter reads shared by all missions.
+
+    Entries are grouped by driver so a command which may change the driver
+    drops all of them. Each read states how old a cached value it accepts.
+    Concurrent identical reads are merged into a single request whose result
+    is handed to every caller. A read started before an invalidation is
+    never cached, nor shared with reads started after it.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = {}
+        self.flights = {}
+        self.generations = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def get(self, driver, key, loader, max_age):
+        """
+        Return a value of driver's key no older than max_age seconds, calling loader when there is none
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(driver, {}).get(key)
+            if entry is not None and now - entry.fetched < max_age:
+                self.hits += 1
+                return entry.value
+
+            generation = self.generations.get(driver, 0)
+            flight_key = (driver, key, generation)
+            flight = self.flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[flight_key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            with self.lock:
+                if self.generations.get(driver, 0) == generation:
+                    self.entries.setdefault(driver, {})[key] = _Entry(flight.value, now)
+            return flight.value
+        finally:
+            with self.lock:
+                del self.flights[flight_key]
+            flight.done.set()
+
+    def invalidate(self, driver):
+        with self.lock:
+            self.entries.pop(driver, None)
+            self.generations[driver] = self.generations.get(driver, 0) + 1
+            self.invalidations += 1
+
+    def stats(self):
+        return {'drivers': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced, 'invalidations': self.invalidations}
+
+
+read_cache = ReadCache()
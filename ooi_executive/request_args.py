@@ -0,0 +1,72 @@
+from datetime import datetime
+import math
+
+from flask import request
+from werkzeug.exceptions import BadRequest
+
+from ooi_executive import app
+
+__author__ = 'petercable'
+
+
+def parse_time(value):
+    """
+    Parse a POSIX timestamp or an ISO 8601 date or time
+    :raises BadRequest: if value is neither
+    """
+    if value is None:
+        return None
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise BadRequest('Unable to parse time: %r' % value)
+
+
+def number_arg(name, kind=int, default=None):
+    """
+    A numeric request argument
+    :param kind: int or float
+    :raises BadRequest: if the argument is not a finite number of this kind
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = kind(value)
+    except ValueError:
+        value = None
+    if value is None or math.isinf(value) or math.isnan(value):
+        raise BadRequest('%s must be %s' % (name, 'an integer' if kind is int else 'a finite number'))
+    return value
+
+
+def history_args():
+    """
+    Parse the common pagination and filter arguments of the history endpoints
+    """
+    limit = number_arg('limit', default=app.config['HISTORY_PAGE_SIZE'])
+    limit = max(1, min(limit, app.config['HISTORY_MAX_PAGE_SIZE']))
+    return {
+        'limit': limit,
+        'after_id': number_arg('after_id'),
+        'since': parse_time(request.args.get('since')),
+        'until': parse_time(request.args.get('until')),
+    }
+
+
+def analysis_args():
+    """
+    Parse the arguments of the schedule analysis endpoints
+    :raises BadRequest: if hours is not positive or exceeds SCHEDULE_ANALYSIS_MAX_HOURS
+    """
+    hours = number_arg('hours', float, app.config['SCHEDULE_ANALYSIS_HOURS'])
+    if not 0 < hours <= app.config['SCHEDULE_ANALYSIS_MAX_HOURS']:
+        raise BadRequest('hours must be greater than 0 and at most %s' % app.config['SCHEDULE_ANALYSIS_MAX_HOURS'])
+    return {'hours': hours,
+            'worst': request.args.get('estimate') == 'worst'}
@@ -0,0 +1,227 @@
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime, timedelta
+import gzip
+import json
+import logging
+import os
+
+from sqlalchemy import func, or_
+
+from ooi_executive.backing_store import ArchivedRun, Event, EventType, MissionData, Run
+from ooi_executive.metrics import registry
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+RUNS_ARCHIVED = registry.counter('ooi_runs_archived_total', 'Runs moved from the database to the run archive')
+
+# archive file of the legacy runs without a start time or events
+UNKNOWN_MONTH = 'unknown'
+
+
+class RetentionPolicy(object):
+    """
+    Runs of a mission kept in the database. A run expires once it is neither one of
+    the last runs runs of its mission nor started in the last days days, a limit of
+    None is not applied. The most recent run of a mission is never archived.
+    """
+    def __init__(self, runs=None, days=None):
+        self.runs = runs
+        self.days = days
+
+    @property
+    def enabled(self):
+        return self.runs is not None or self.days is not None
+
+    def expired(self, session, mission_id, now, limit):
+        """
+        :return: list of (run id, start time) of the oldest expired runs of a mission
+        """
+        if not self.enabled:
+            return []
+        query = session.query(Run.id).filter(Run.mission_id == mission_id)
+        # the oldest run kept for the runs limit
+        oldest = query.order_by(Run.id.desc()).offset(max(self.runs or 1, 1) - 1).limit(1).scalar()
+        if oldest is None:
+            return []
+
+        query = session.query(Run.id, Run.start_time).filter(Run.mission_id == mission_id)\
+            .filter(Run.id < oldest)
+        if self.days is not None:
+            # legacy runs without a start time predate any cutoff
+            query = query.filter(or_(Run.start_time < now - timedelta(days=self.days), Run.start_time.is_(None)))
+        return query.order_by(Run.id).limit(limit).all()
+
+
+class RunArchive(object):
+    """
+    Append-only archive of the runs expired from the database, one gzip file of
+    JSON lines per mission and month. Each batch of runs appended to a file is a
+    new gzip member, and the offset of its member is recorded with each run so a
+    run is read without decompressing the runs before it.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def append(self, mission_id, month, runs):
+        """
+        :param month: 'YYYY-MM' of the start of the runs, or UNKNOWN_MONTH
+        :param runs: run dictionaries
+        :return: archive file, relative to the archive directory, and offset of the runs in it
+        """
+        name = os.path.join(str(mission_id), '%s.jsonl.gz' % month)
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'ab') as fh:
+            fh.seek(0, os.SEEK_END)
+            offset = fh.tell()
+            with closing(gzip.GzipFile(filename='', mode='wb', fileobj=fh)) as member:
+                for run in runs:
+                    member.write(json.dumps(run) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+        return name, offset
+
+    def read(self, name, offset, run_id):
+        """
+        :return: the run dictionary, or None if the run is not in the archive
+        """
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as fh:
+                fh.seek(offset)
+                with closing(gzip.GzipFile(mode='rb', fileobj=fh)) as member:
+                    for line in member:
+                        run = json.loads(line)
+                        if run['run_id'] == run_id:
+                            return run
+        except IOError as e:
+            log.error('Unable to read run %d from archive %s: %r', run_id, name, e)
+        return None
+
+
+class Retention(object):
+    """
+    Moves the expired runs of every mission and their events to the run archive,
+    batch_size runs at a time. Each batch is appended to the archive before it is
+    deleted from the database in one transaction, a batch archived again after a
+    failure is read from the offset recorded last.
+    :param default: RetentionPolicy of the missions without their own
+    """
+    def __init__(self, session_factory, archive, default=None, batch_size=100):
+        self.session_factory = session_factory
+        self.archive = archive
+        self.default = default or RetentionPolicy()
+        self.batch_size = batch_size
+
+    def run(self, policies=None, now=None):
+        """
+        :param policies: RetentionPolicy by mission id
+        :return: number of runs archived
+        """
+        policies = policies or {}
+        now = now or datetime.now()
+        session = self.session_factory()
+        try:
+            type_names = dict(session.query(EventType.id, EventType.name))
+            archived = 0
+            for mission_id, in session.query(MissionData.id).order_by(MissionData.id).all():
+                policy = policies.get(mission_id, self.default)
+                try:
+                    while True:
+                        runs = policy.expired(session, mission_id, now, self.batch_size)
+                        if not runs:
+                            break
+                        self._archive(session, mission_id, runs, type_names)
+                        archived += len(runs)
+                except Exception:
+                    # the other missions are still archived, this one is retried on the next run
+                    log.exception('Unable to archive the runs of mission %d', mission_id)
+            if archived:
+                log.info('Archived %d runs', archived)
+            return archived
+        finally:
+            session.close()
+
+    def _archive(self, session, mission_id, runs, type_names):
+        run_ids = [run_id for run_id, _ in runs]
+        events = OrderedDict((run_id, []) for run_id in run_ids)
+        first_events = {}
+        query = session.query(Event.id, Event.run_id, Event.timestamp, Event.event_type_id, Event.event)\
+            .filter(Event.run_id.in_(run_ids)).order_by(Event.run_id, Event.id)
+        for event_id, run_id, timestamp, event_type_id, event in query:
+            events[run_id].append((event_id, timestamp.isoformat(), type_names.get(event_type_id), event))
+            first_events.setdefault(run_id, timestamp)
+
+        months = OrderedDict()
+        for run_id, start_time in runs:
+            if start_time is None:
+                # legacy runs start with their first event, if they have one
+                start_time = first_events.get(run_id)
+            month = start_time.strftime('%Y-%m') if start_time is not None else UNKNOWN_MONTH
+            months.setdefault(month, []).append((run_id, start_time))
+
+        try:
+            for month, month_runs in months.iteritems():
+                name, offset = self.archive.append(mission_id, month, [
+                    {'run_id': run_id, 'mission_id': mission_id,
+                     'start_time': start_time.isoformat() if start_time is not None else None,
+                     'events': events[run_id]} for run_id, start_time in month_runs])
+                for run_id, start_time in month_runs:
+                    session.merge(ArchivedRun(run_id=run_id, mission_id=mission_id, start_time=start_time,
+                                              file=name, offset=offset))
+
+            session.query(Event).filter(Event.run_id.in_(run_ids)).delete(synchronize_session=False)
+            session.query(Run).filter(Run.id.in_(run_ids)).delete(synchronize_session=False)
+            session.query(MissionData).filter(MissionData.id == mission_id)\
+                .update({MissionData.archived: True}, synchronize_session=False)
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        RUNS_ARCHIVED.inc(value=len(run_ids))
+
+
+def archived_events(run, after_id=None, since=None, until=None, event_types=None, limit=100):
+    """
+    Filter the events of an archived run as Mission._get_events filters the events of a run
+    :return: list of (timestamp, type, event), id of the last event returned if more may follow
+    """
+    since = since.isoformat() if since is not None else None
+    until = until.isoformat() if until is not None else None
+    events = []
+    last_id = None
+    for event_id, timestamp, event_type, event in run['events']:
+        if ((after_id is not None and event_id <= after_id) or (since is not None and timestamp < since) or
+                (until is not None and timestamp >= until) or (event_types and event_type not in event_types)):
+            continue
+        try:
+            event = json.loads(event)
+        except ValueError:
+            pass
+        events.append((timestamp, event_type, event))
+        last_id = event_id
+        if len(events) == limit:
+            return events, last_id
+    return events, None
+
+
+def archived_missions(session):
+    """
+    The missions with archived runs, including deleted missions
+    :return: dictionary of mission summaries by mission id
+    """
+    query = session.query(MissionData.id, MissionData.name, MissionData.script_id, func.count(ArchivedRun.run_id),
+                          func.min(ArchivedRun.start_time), func.max(ArchivedRun.start_time))\
+        .join(ArchivedRun, ArchivedRun.mission_id == MissionData.id)\
+        .filter(MissionData.archived)\
+        .group_by(MissionData.id, MissionData.name, MissionData.script_id)
+    return {mission_id: {'id': mission_id,
+                         'name': name,
+                         'deleted': script_id is None,
+                         'archived_runs': count,
+                         'first_run': first.isoformat() if first is not None else None,
+                         'last_run': last.isoformat() if last is not None else None}
+            for mission_id, name, script_id, count, first, last in query}
@@ -0,0 +1,151 @@
+from threading import Lock
+import time
+
+from ooi_executive.tracing import Trace
+
+__author__ = 'petercable'
+
+
+class Frame(object):
+    """
+    Position of a run within a single block.
+    :param block: compiled block being executed
+    :param loop: number of times the block should be executed
+    :param error_policy: error policy applied to the block as a whole
+    """
+    def __init__(self, block, loop=1, error_policy=None):
+        self.block = block
+        self.index = 0
+        self.loop = loop
+        self.remaining = loop
+        self.error_policy = error_policy
+        self.attempt = 1
+        self.span = None
+        self.iteration = None
+
+    def to_dict(self):
+        return {
+            'block_name': self.block.label,
+            'index': self.index,
+            'remaining': self.remaining,
+            'attempt': self.attempt,
+        }
+
+
+class RunState(object):
+    """
+    Checkpoint of an in-progress mission run.
+
+    Holds everything needed to continue a run on a different thread: the
+    compiled program, the block stack, the step index and loop counter of
+    each block and the variables collected by previous steps.
+
+    Each block on the stack, and each iteration of a loop, is timed by a span
+    of the run's trace, nested inside the span of the enclosing block.
+    :param trace: Trace of the run, shared with its branches
+    :param span: Span enclosing the outermost block
+    """
+    def __init__(self, run_id, program, variables=None, branch=False, driver_locks=None, trace=None, span=None):
+        self.run_id = run_id
+        self.program = program
+        self.frames = []
+        self.vars = variables if variables is not None else {}
+        self.resume_time = None
+        self.preempted = False
+        self.branch = branch
+        self.driver_locks = driver_locks if driver_locks is not None else {}
+        self.lock = Lock()
+        self.trace = trace if trace is not None else Trace()
+        self.span = span if span is not None else self.trace.root
+        self.wait = None
+
+    def branch_state(self, block, span=None):
+        """
+        Create the state for a parallel branch of this run.
+        Branches start with a copy of the run variables and share the run's driver locks and trace.
+        :param span: Span timing the branch
+        """
+        state = RunState(self.run_id, self.program, dict(self.vars), branch=True, driver_locks=self.driver_locks,
+                         trace=self.trace, span=span)
+        state.lock = self.lock
+        state.push(block)
+        return state
+
+    def driver_lock(self, driver):
+        """
+        Lock serializing the commands sent to one driver by concurrent branches of this run
+        """
+        with self.lock:
+            lock = self.driver_locks.get(driver)
+            if lock is None:
+                lock = self.driver_locks[driver] = Lock()
+            return lock
+
+    def push(self, block, loop=1, error_policy=None):
+        frame = Frame(block, loop, error_policy)
+        frame.span = self.trace.start('block', block.label, self.parent_span())
+        if loop != 1:
+            frame.iteration = self.trace.start('iteration', block.label, frame.span)
+        self.frames.append(frame)
+        return frame
+
+    def pop(self):
+        frame = self.frames.pop()
+        if frame.iteration is not None:
+            frame.iteration.finish()
+        frame.span.finish()
+        return frame
+
+    def next_iteration(self):
+        """
+        Start the next iteration of the current block, or pop it after the last
+        """
+        frame = self.current
+        frame.index = 0
+        frame.remaining -= 1
+        if frame.remaining <= 0:
+            self.pop()
+        elif frame.iteration is not None:
+            frame.iteration.finish()
+            frame.iteration = self.trace.start('iteration', frame.block.label, frame.span)
+
+    def parent_span(self):
+        """
+        Span enclosing the next step of the run
+        """
+        frame = self.current
+        if frame is None:
+            return self.span
+        return frame.iteration or frame.span
+
+    def wait_for(self, kind):
+        """
+        Time the run while it is suspended or preempted, until resumed()
+        """
+        self.resumed()
+        self.wait = self.trace.start(kind, kind, self.trace.root)
+
+    def resumed(self):
+        if self.wait is not None:
+            self.wait.finish()
+            self.wait = None
+
+    @property
+    def current(self):
+        return self.frames[-1] if self.frames else None
+
+    @property
+    def complete(self):
+        return not self.frames
+
+    def suspend(self, seconds):
+        self.resume_time = time.time() + seconds
+
+    def to_dict(self):
+        return {
+            'run_id': self.run_id,
+            'frames': [frame.to_dict() for frame in self.frames],
+            'vars': self.vars,
+            'resume_time': self.resume_time,
+            'preempted': self.preempted,
+        }
@@ -0,0 +1,487 @@
+from datetime import datetime, timedelta
+import logging
+import time
+
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from tzlocal import get_localzone
+
+from ooi_executive.compiler import BlockStep, CommandStep, ParallelStep, SleepStep
+from ooi_executive.shared import Tags
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+CRON_KEYS = {'year', 'month', 'day', 'week', 'day_of_week', 'hour', 'minute', 'second', 'start_date', 'end_date'}
+
+# free windows reported per driver, earliest first
+MAX_WINDOWS = 20
+
+
+def mission_trigger(schedule, start):
+    """
+    The APScheduler trigger Mission._schedule_mission adds for a schedule
+    :param start: timezone aware datetime, run time of missions without a schedule
+    :return: trigger, or None for missions triggered by OMS alerts
+    """
+    if CRON_KEYS.intersection(schedule):
+        return CronTrigger(timezone=start.tzinfo, **schedule)
+    if 'run_date' in schedule:
+        return DateTrigger(schedule['run_date'], timezone=start.tzinfo)
+    if not {'source', 'event'}.intersection(schedule):
+        return DateTrigger(start, timezone=start.tzinfo)
+    return None
+
+
+class Estimate(object):
+    """
+    Duration of a block in seconds
+    :param expected: with commands taking their historical mean latency
+    :param worst: with every command timing out after all of its retries
+    """
+    def __init__(self, expected=0.0, worst=0.0):
+        self.expected = expected
+        self.worst = worst
+
+    def add(self, other, times=1):
+        self.expected += other.expected * times
+        self.worst += other.worst * times
+
+
+def _parallel(durations, concurrency):
+    # branches are started as others complete, at most concurrency at once
+    if not durations:
+        return 0
+    return max(max(durations), sum(durations) / float(max(1, min(concurrency, len(durations)))))
+
+
+def estimate_duration(program, model=None, default=1.0):
+    """
+    Estimate the time a run holds the drivers of a mission, from lock to unlock.
+    Conditional blocks are assumed to execute.
+    :param model: command latencies, an object with mean(command, driver) returning None if unknown
+    :param default: seconds taken by commands without a historical latency
+    :return: Estimate
+    """
+    def latency(command, driver):
+        mean = model.mean(command, driver) if model is not None else None
+        return default if mean is None else mean
+
+    memo = {}
+
+    def block_estimate(block):
+        key = id(block)
+        if key in memo:
+            # a block executing itself never completes, count it once
+            return memo[key] or Estimate()
+        memo[key] = None
+        estimate = Estimate()
+        for step in block.steps:
+            if isinstance(step, CommandStep):
+                policy = step.error_policy
+                retries = policy.count if policy.action == 'retry' else 1
+                estimate.add(Estimate(latency(step.command, step.target),
+                                      retries * step.timeout / 1000.0 + (retries - 1) * policy.backoff))
+            elif isinstance(step, SleepStep):
+                estimate.add(Estimate(step.duration, step.duration))
+            elif isinstance(step, BlockStep):
+                estimate.add(block_estimate(step.block), max(step.loop, 1))
+            elif isinstance(step, ParallelStep):
+                branches = [block_estimate(branch.block) for branch in step.branches]
+                concurrency = step.max_concurrency
+                estimate.add(Estimate(_parallel([branch.expected for branch in branches], concurrency),
+                                      _parallel([branch.worst for branch in branches], concurrency)))
+        memo[key] = estimate
+        return estimate
+
+    estimate = Estimate()
+    if program.entry is not None:
+        for command in ('lock', 'unlock'):
+            # drivers are locked and unlocked concurrently
+            seconds = max([latency(command, driver) for driver in program.drivers] or [0])
+            estimate.add(Estimate(seconds, seconds))
+        estimate.add(block_estimate(program.entry))
+    return estimate
+
+
+class Interval(object):
+    """
+    Time a run holds its drivers, in seconds from the start of the analysis
+    """
+    __slots__ = ('start', 'end', 'mission')
+
+    def __init__(self, start, end, mission):
+        self.start = start
+        self.end = end
+        self.mission = mission
+
+    def __repr__(self):
+        return 'Interval(%r, %r, %r)' % (self.start, self.end, self.mission)
+
+
+class IntervalTree(object):
+    """
+    Static centered interval tree.
+
+    Each node holds the intervals containing its center, sorted by start and
+    by end, and the intervals entirely before and after the center are held
+    by its left and right subtrees. Intervals are half open, [start, end),
+    empty intervals overlap nothing and are not indexed.
+    """
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, intervals):
+        intervals = sorted((interval for interval in intervals if interval.end > interval.start),
+                           key=lambda interval: interval.start)
+        self.center = None
+        self.by_start = []
+        self.by_end = []
+        self.left = None
+        self.right = None
+        if not intervals:
+            return
+
+        middle = intervals[len(intervals) // 2]
+        self.center = middle.start + (middle.end - middle.start) / 2.0
+        left = []
+        right = []
+        for interval in intervals:
+            if interval.end <= self.center:
+                left.append(interval)
+            elif interval.start > self.center:
+                right.append(interval)
+            else:
+                self.by_start.append(interval)
+        self.by_end = sorted(self.by_start, key=lambda interval: -interval.end)
+        if left:
+            self.left = IntervalTree(left)
+        if right:
+            self.right = IntervalTree(right)
+
+    def overlapping(self, start, end):
+        """
+        :return: list of the intervals overlapping [start, end)
+        """
+        found = []
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.center is None:
+                continue
+            if end <= node.center:
+                # only the intervals of this node starting before end can overlap
+                for interval in node.by_start:
+                    if interval.start >= end:
+                        break
+                    found.append(interval)
+                if node.left is not None:
+                    nodes.append(node.left)
+            elif start > node.center:
+                for interval in node.by_end:
+                    if interval.end <= start:
+                        break
+                    found.append(interval)
+                if node.right is not None:
+                    nodes.append(node.right)
+            else:
+                found.extend(node.by_start)
+                if node.left is not None:
+                    nodes.append(node.left)
+                if node.right is not None:
+                    nodes.append(node.right)
+        return found
+
+    def __iter__(self):
+        if self.left is not None:
+            for interval in self.left:
+                yield interval
+        for interval in self.by_start:
+            yield interval
+        if self.right is not None:
+            for interval in self.right:
+                yield interval
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class ScheduledMission(object):
+    """
+    A mission as seen by the analyzer
+    :param mission: validated mission script dictionary
+    :param program: compiled Program
+    """
+    def __init__(self, name, mission, program):
+        self.name = name
+        self.mission = mission
+        self.program = program
+
+
+def occurrences(trigger, start, horizon, limit):
+    """
+    :return: fire times of a trigger in seconds from start, up to limit of them
+    """
+    end = start + timedelta(seconds=horizon)
+    times = []
+    previous = None
+    now = start
+    while len(times) < limit:
+        fire_time = trigger.get_next_fire_time(previous, now)
+        if fire_time is None or fire_time >= end:
+            break
+        times.append(max(0.0, (fire_time - start).total_seconds()))
+        previous = now = fire_time
+    return times
+
+
+def _free_windows(intervals, horizon, min_window):
+    free = 0.0
+    windows = []
+    cursor = 0.0
+    for interval in sorted(intervals, key=lambda interval: interval.start) + [Interval(horizon, horizon, None)]:
+        gap = min(interval.start, horizon) - cursor
+        if gap > 0:
+            free += gap
+            if gap >= min_window and len(windows) < MAX_WINDOWS:
+                windows.append((cursor, cursor + gap))
+        cursor = max(cursor, interval.end)
+    return free, windows
+
+
+def _peak(intervals, size):
+    """
+    :return: (peak concurrency, offset it is first reached, seconds above size)
+    """
+    edges = sorted([(interval.start, 1) for interval in intervals] + [(interval.end, -1) for interval in intervals])
+    current = peak = 0
+    peak_at = None
+    over = 0.0
+    last = 0.0
+    # ends sort before starts at the same offset, back to back runs do not overlap
+    for offset, change in edges:
+        if current > size:
+            over += offset - last
+        last = offset
+        current += change
+        if current > peak:
+            peak, peak_at = current, offset
+    return peak, peak_at, over
+
+
+def analyze(missions, start, horizon, model=None, default=1.0, worst=False, pool_sizes=None,
+            urgent_priority=10, min_window=60, limit=10000):
+    """
+    Expand the schedules of missions over a horizon and report driver contention.
+
+    Each run is assumed to hold the drivers of its mission from its fire time
+    for the estimated duration of the mission, and a run firing while the
+    previous run of its mission still holds the drivers is skipped, as the
+    executive does. The runs of every driver are indexed in an IntervalTree.
+    Peak concurrency counts runs holding drivers, an upper bound of the
+    threads they use as runs sleeping at least RESUMABLE_SLEEP_THRESHOLD
+    seconds release theirs.
+    :param missions: list of ScheduledMission
+    :param start: timezone aware datetime
+    :param horizon: seconds analyzed
+    :param worst: hold drivers for the worst case instead of the expected duration
+    :param pool_sizes: threads of the 'runs' and 'urgent_runs' pools
+    :param min_window: shortest free window reported, in seconds
+    :param limit: runs expanded per mission
+    :return: dictionary of results
+    """
+    started = time.time()
+    pool_sizes = pool_sizes or {}
+
+    def timestamp(offset):
+        return (start + timedelta(seconds=offset)).isoformat()
+
+    report = {}
+    unscheduled = []
+    by_driver = {}
+    by_pool = {'runs': [], 'urgent_runs': []}
+    for mission in missions:
+        trigger = mission_trigger(mission.mission.get(Tags.SCHEDULE, {}), start)
+        if trigger is None:
+            unscheduled.append(mission.name)
+            continue
+        estimate = estimate_duration(mission.program, model, default)
+        duration = estimate.worst if worst else estimate.expected
+        fire_times = occurrences(trigger, start, horizon, limit)
+        runs = []
+        skipped = 0
+        for offset in fire_times:
+            if runs and runs[-1].end > offset:
+                skipped += 1
+                continue
+            runs.append(Interval(offset, offset + duration, mission.name))
+
+        pool = 'urgent_runs' if mission.program.priority >= urgent_priority else 'runs'
+        by_pool[pool].extend(runs)
+        for driver in mission.program.drivers:
+            by_driver.setdefault(driver, []).extend(runs)
+        report[mission.name] = {
+            'expected_seconds': estimate.expected,
+            'worst_seconds': estimate.worst,
+            'runs': len(runs),
+            'skipped': skipped,
+            'truncated': len(fire_times) == limit,
+            'drivers': mission.program.drivers,
+            'pool': pool,
+        }
+
+    instruments = {}
+    total = 0
+    for driver, intervals in by_driver.iteritems():
+        tree = IntervalTree(intervals)
+        pairs = {}
+        for interval in intervals:
+            for other in tree.overlapping(interval.start, interval.end):
+                # every overlapping pair once, ordered by start
+                if other.mission == interval.mission or (other.start, other.mission) < (interval.start,
+                                                                                        interval.mission):
+                    continue
+                overlap = min(interval.end, other.end) - max(interval.start, other.start)
+                key = tuple(sorted((interval.mission, other.mission)))
+                entry = pairs.get(key)
+                if entry is None:
+                    entry = pairs[key] = {'missions': list(key), 'count': 0, 'seconds': 0.0,
+                                          'first': max(interval.start, other.start)}
+                entry['count'] += 1
+                entry['seconds'] += overlap
+                entry['first'] = min(entry['first'], max(interval.start, other.start))
+
+        free, windows = _free_windows(intervals, horizon, min_window)
+        peak, _, _ = _peak(intervals, 1)
+        conflicts = sorted(pairs.values(), key=lambda entry: -entry['seconds'])
+        for entry in conflicts:
+            entry['first'] = timestamp(entry['first'])
+        total += sum(entry['count'] for entry in conflicts)
+        instruments[driver] = {
+            'runs': len(intervals),
+            'held_fraction': (horizon - free) / float(horizon) if horizon else 0,
+            'peak': peak,
+            'conflicts': conflicts,
+            'free_windows': [{'start': timestamp(a), 'end': timestamp(b), 'seconds': b - a} for a, b in windows],
+        }
+
+    pools = {}
+    for name, intervals in by_pool.iteritems():
+        size = pool_sizes.get(name)
+        peak, peak_at, over = _peak(intervals, size if size is not None else float('inf'))
+        pools[name] = {
+            'size': size,
+            'peak': peak,
+            'peak_time': timestamp(peak_at) if peak_at is not None else None,
+            'saturated': size is not None and peak > size,
+            'oversubscribed_seconds': over,
+        }
+
+    return {
+        'start': start.isoformat(),
+        'horizon_seconds': horizon,
+        'estimate': 'worst' if worst else 'expected',
+        'elapsed_seconds': time.time() - started,
+        'conflicts': total,
+        'missions': report,
+        'instruments': instruments,
+        'pools': pools,
+        'unscheduled': unscheduled,
+    }
+
+
+def mission_conflicts(results, name):
+    """
+    The contention a mission is involved in
+    :param results: returned by analyze
+    :return: dictionary of the conflicts with other missions and the pool of the mission if saturated,
+    empty if none
+    """
+    conflicts = []
+    for driver, usage in sorted(results['instruments'].iteritems()):
+        for entry in usage['conflicts']:
+            if name in entry['missions']:
+                others = [mission for mission in entry['missions'] if mission != name]
+                conflicts.append({'driver': driver, 'mission': others[0], 'count': entry['count'],
+                                  'seconds': entry['seconds'], 'first': entry['first']})
+    found = {}
+    if conflicts:
+        found['conflicts'] = conflicts
+    mission = results['missions'].get(name)
+    if mission is not None and results['pools'][mission['pool']]['saturated']:
+        found['saturated_pool'] = mission['pool']
+    return found
+
+
+class ScheduleAnalyzer(object):
+    """
+    Analyzes the schedules of the executive's missions with command latencies
+    fitted from the events of past runs, refitted at most every refresh seconds.
+    :param session_factory: sessionmaker of the run history database
+    :param model_factory: callable returning an empty latency model with fit(session, since) and mean()
+    :param history: days of run history the latencies are fitted from
+    """
+    def __init__(self, session_factory, config, model_factory=None, history=7, refresh=3600):
+        self.session_factory = session_factory
+        self.config = config
+        self.model_factory = model_factory
+        self.history = history
+        self.refresh = refresh
+        self.model = None
+        self.fitted = None
+
+    def latencies(self):
+        if self.model_factory is None:
+            return None
+        if self.fitted is None or time.time() - self.fitted > self.refresh:
+            model = self.model_factory()
+            session = self.session_factory()
+            try:
+                model.fit(session, datetime.now() - timedelta(days=self.history))
+            except Exception as e:
+                log.error('Unable to fit command latencies from run history: %r', e)
+            finally:
+                session.close()
+            self.model = model
+            self.fitted = time.time()
+        return self.model
+
+    def analyze(self, missions, hours=None, worst=False):
+        """
+        :param missions: list of ScheduledMission
+        :param hours: horizon, defaults to SCHEDULE_ANALYSIS_HOURS
+        """
+        config = self.config
+        hours = config['SCHEDULE_ANALYSIS_HOURS'] if hours is None else hours
+        start = get_localzone().localize(datetime.now().replace(microsecond=0))
+        return analyze(missions, start, hours * 3600, model=self.latencies(),
+                       default=config['SCHEDULE_COMMAND_SECONDS'], worst=worst,
+                       pool_sizes={'runs': config['RUN_POOL_SIZE'], 'urgent_runs': config['URGENT_POOL_SIZE']},
+                       urgent_priority=config['URGENT_PRIORITY'],
+                       min_window=config['SCHEDULE_MIN_WINDOW'])
+
+    def check(self, candidate, missions):
+        """
+        Analyze a new or updated mission against the active missions
+        :param candidate: ScheduledMission
+        :param missions: the other active missions, as ScheduledMission
+        :return: conflicts of the candidate, see mission_conflicts
+        """
+        return self.check_batch([candidate], missions).get(candidate.name, {})
+
+    def check_batch(self, candidates, missions):
+        """
+        Analyze new or updated missions together against the active missions
+        :param candidates: list of ScheduledMission
+        :param missions: the active missions, as ScheduledMission, those replaced by a candidate are ignored
+        :return: conflicts of each candidate with any, by mission name
+        """
+        names = {candidate.name for candidate in candidates}
+        results = self.analyze(candidates + [mission for mission in missions if mission.name not in names])
+        conflicts = {}
+        for candidate in candidates:
+            found = mission_conflicts(results, candidate.name)
+            if found:
+                log.warn('Mission %s contends with active missions: %r', candidate.name, found)
+                conflicts[candidate.name] = found
+        return conflicts
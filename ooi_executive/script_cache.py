@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import logging
+
+import yaml
+
+import mission_schema
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+# use the libyaml parser when PyYAML was built with it
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def script_hash(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+def parse(text):
+    return yaml.load(text, Loader=YamlLoader)
+
+
+class ScriptCache(object):
+    """
+    Parsed and validated mission scripts keyed by the hash of the script text.
+    The returned dictionaries are shared between callers and must not be modified.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.scripts = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, text):
+        """
+        Parse and validate a mission script
+        :raises yaml.YAMLError: if the script can not be parsed
+        :raises jsonschema.ValidationError: if the script does not match the mission schema
+        """
+        key = script_hash(text)
+        with self.lock:
+            mission = self.scripts.pop(key, None)
+            if mission is not None:
+                self.scripts[key] = mission
+                self.hits += 1
+                return mission
+
+        mission = parse(text)
+        mission_schema.validate(mission)
+
+        with self.lock:
+            self.misses += 1
+            self.scripts[key] = mission
+            while len(self.scripts) > self.max_size:
+                self.scripts.popitem(last=False)
+        return mission
+
+    def add(self, text, mission):
+        """
+        Add a mission script parsed and validated elsewhere
+        """
+        with self.lock:
+            self.scripts[script_hash(text)] = mission
+            while len(self.scripts) > self.max_size:
+                self.scripts.popitem(last=False)
+
+    def stats(self):
+        return {'size': len(self.scripts), 'hits': self.hits, 'misses': self.misses}
+
+
+script_cache = ScriptCache()
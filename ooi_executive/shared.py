@@ -32,6 +32,22 @@ class DuplicateScriptException(Exception):
     pass
 
 
+class CompileException(Exception):
+    pass
+
+
+class ScheduleConflictException(Exception):
+    """
+    A mission would contend with the active missions for its drivers
+    :param conflicts: returned by schedule_analyzer.mission_conflicts
+    """
+    status_code = 409
+
+    def __init__(self, name, conflicts):
+        super(ScheduleConflictException, self).__init__('Mission %s contends with active missions' % name)
+        self.conflicts = conflicts
+
+
 class MyEncoder(JSONEncoder):
     def default(self, o):
         if hasattr(o, 'to_dict'):
@@ -87,6 +103,7 @@ class _Tags(Enumeration):
     INSTRUMENT = 'drivers'
     PLATFORM = 'platform'
     DATETIME = 'datetime'
+    FANOUT = 'fanout'
 
 
 class _LocalCommands(Enumeration):
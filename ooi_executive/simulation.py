@@ -0,0 +1,617 @@
+#!/usr/bin/env python
+"""
+Simulate the executive on a virtual clock.
+
+Missions are scheduled by their APScheduler triggers, queued per driver by the
+instrument scheduler and interpreted step by step, but commands and sleeps
+only advance a virtual clock: a day of schedules runs in seconds. Command
+durations are sampled from latency models fitted from the events of past runs.
+
+    python -m ooi_executive.simulation missions/ --history postgresql://... --hours 24 --output day.json
+"""
+from __future__ import print_function
+
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import count
+import argparse
+import functools
+import heapq
+import json
+import logging
+import os
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tzlocal import get_localzone
+
+from ooi_executive import app, tracing
+from ooi_executive.backing_store import Event, EventType
+from ooi_executive.compiler import compile_mission, BlockStep, SleepStep, ParallelStep
+from ooi_executive.executors import Executor, READ_COMMANDS, SAFE_COMMANDS
+from ooi_executive.instrument_scheduler import InstrumentScheduler
+from ooi_executive.metrics import distribution
+from ooi_executive.run_state import RunState
+from ooi_executive.schedule_analyzer import mission_trigger
+from ooi_executive.script_cache import script_cache
+from ooi_executive.shared import Tags
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+# values returned by simulated commands, so conditions on the driver state take the command state branch
+SIMULATED_VALUES = {'get_state': 'DRIVER_STATE_COMMAND'}
+
+
+class LatencyModel(object):
+    """
+    Durations of instrument agent commands.
+
+    Up to max_samples observed durations are kept for each command and driver,
+    and for each command over all drivers. A command is simulated with a
+    duration drawn from the samples of its driver, or of its command on any
+    driver, or default if it was never observed.
+    """
+    def __init__(self, default=1.0, max_samples=1000, seed=None):
+        self.default = default
+        self.max_samples = max_samples
+        self.random = random.Random(seed)
+        self.samples = {}
+
+    def add(self, command, driver, duration):
+        for key in ((command, driver), (command, None)):
+            entry = self.samples.get(key)
+            if entry is None:
+                entry = self.samples[key] = [0, []]
+            # reservoir sampling keeps a uniform sample of every duration seen
+            entry[0] += 1
+            if len(entry[1]) < self.max_samples:
+                entry[1].append(duration)
+            else:
+                index = self.random.randint(0, entry[0] - 1)
+                if index < self.max_samples:
+                    entry[1][index] = duration
+
+    def sample(self, command, driver):
+        entry = self.samples.get((command, driver)) or self.samples.get((command, None))
+        if entry is None:
+            return self.default
+        return self.random.choice(entry[1])
+
+    def mean(self, command, driver):
+        """
+        :return: mean sampled duration of a command on a driver, or on any driver, None if never observed
+        """
+        entry = self.samples.get((command, driver)) or self.samples.get((command, None))
+        if entry is None:
+            return None
+        return sum(entry[1]) / float(len(entry[1]))
+
+    def fit(self, session, since=None):
+        """
+        Add the command durations recorded by past runs.
+        Runs with a trace are read from their step and agent request spans,
+        older runs from the time between their step and result events.
+        """
+        type_ids = dict(session.query(EventType.name, EventType.id))
+        query = session.query(Event.run_id, Event.timestamp, Event.event_type_id, Event.event)\
+            .filter(Event.event_type_id.in_([type_ids.get(name) for name in ('trace', 'step', 'result')]))
+        if since is not None:
+            query = query.filter(Event.timestamp >= since)
+
+        traced = set()
+        pending = {}
+        pairs = []
+        parser = Executor('simulation', 0)
+        for run_id, timestamp, event_type_id, event in query.order_by(Event.id).yield_per(1000):
+            if event_type_id == type_ids.get('trace'):
+                traced.add(run_id)
+                self._add_spans(tracing.decode(json.loads(event)))
+            elif event_type_id == type_ids.get('step'):
+                try:
+                    parsed = parser.parse(json.loads(event))
+                except (ValueError, TypeError, AttributeError):
+                    parsed = None
+                pending[run_id] = (parsed[0], parsed[1], timestamp) if parsed is not None else None
+            elif pending.get(run_id) is not None:
+                command, driver, start = pending.pop(run_id)
+                pairs.append((run_id, command, driver, (timestamp - start).total_seconds()))
+
+        for run_id, command, driver, duration in pairs:
+            if run_id not in traced:
+                self.add(command, driver, duration)
+
+    def _add_spans(self, spans):
+        by_id = {span['id']: span for span in spans}
+        for span in spans:
+            if span['kind'] == 'step':
+                parts = span['name'].split()
+                if len(parts) == 3:
+                    self.add(parts[1], parts[2], span['duration'])
+            elif span['kind'] == 'http':
+                parent = by_id.get(span['parent'])
+                if parent is not None and parent['kind'] in ('lock', 'unlock'):
+                    self.add(parent['kind'], span['name'], span['duration'])
+
+    def stats(self):
+        return {'%s %s' % key: {'samples': entry[0], 'mean': self.mean(*key)}
+                for key in self.samples if key[1] is not None}
+
+
+class SimulatedResponse(object):
+    def __init__(self, value, duration):
+        self.value = value
+        self.duration = duration
+
+
+class SimulatedExecutor(Executor):
+    """
+    Executor returning a response immediately with the duration the command would have taken.
+    Reads with a max_age are answered without a duration from the reads of the last max_age seconds.
+    :param clock: virtual clock
+    :param reads: time of the last read of each driver and command, shared by the executors of all missions
+    """
+    def __init__(self, mission_id, model, clock, reads, default_timeout=30000):
+        super(SimulatedExecutor, self).__init__(mission_id, default_timeout)
+        self.model = model
+        self.clock = clock
+        self.reads = reads
+
+    def prepare(self, command, target, args, timeout, max_age=None):
+        return functools.partial(self._simulate, command, target, repr(args), max_age)
+
+    def _simulate(self, command, target, args, max_age):
+        value = SIMULATED_VALUES.get(command)
+        if command in READ_COMMANDS:
+            if max_age is not None:
+                fetched = self.reads.get(target, {}).get((command, args))
+                if fetched is not None and self.clock() - fetched < max_age:
+                    return SimulatedResponse(value, 0)
+            duration = self.model.sample(command, target)
+            self.reads.setdefault(target, {})[(command, args)] = self.clock() + duration
+            return SimulatedResponse(value, duration)
+        if command not in SAFE_COMMANDS:
+            self.reads.pop(target, None)
+        return SimulatedResponse(value, self.model.sample(command, target))
+
+
+class SimulatedPool(object):
+    """
+    A thread pool on the virtual clock: work submitted while every thread is busy waits for release()
+    """
+    def __init__(self, simulation, name, size):
+        self.simulation = simulation
+        self.name = name
+        self.size = size
+        self.busy = 0
+        self.waiting = deque()
+
+        self.max_busy = 0
+        self.busy_time = 0
+        self.saturated_time = 0
+        self.last_change = 0
+        self.waits = []
+
+    def submit(self, func, *args):
+        if self.busy < self.size:
+            self._take(0, func, args)
+        else:
+            self.waiting.append((self.simulation.now, func, args))
+
+    def release(self):
+        self._update()
+        self.busy -= 1
+        if self.waiting:
+            submitted, func, args = self.waiting.popleft()
+            self._take(self.simulation.now - submitted, func, args)
+
+    def _take(self, wait, func, args):
+        self._update()
+        self.busy += 1
+        self.max_busy = max(self.max_busy, self.busy)
+        self.waits.append(wait)
+        self.simulation.schedule(0, func, *args)
+
+    def _update(self):
+        now = self.simulation.now
+        elapsed = now - self.last_change
+        self.busy_time += self.busy * elapsed
+        if self.busy >= self.size:
+            self.saturated_time += elapsed
+        self.last_change = now
+
+    def stats(self, horizon):
+        self._update()
+        return {
+            'size': self.size,
+            'max_busy': self.max_busy,
+            'mean_busy': self.busy_time / float(horizon) if horizon else 0,
+            'saturated_fraction': self.saturated_time / float(horizon) if horizon else 0,
+            'backlog': len(self.waiting),
+            'wait_seconds': distribution(self.waits),
+        }
+
+
+class SimulatedMission(object):
+    def __init__(self, name, program, trigger):
+        self.name = name
+        self.program = program
+        self.trigger = trigger
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.durations = []
+
+
+class SimulatedRun(object):
+    """
+    A run, or a branch of a parallel step, interpreted on the virtual clock
+    :param pool: SimulatedPool whose thread the run holds, None while suspended
+    :param join: ParallelJoin of the parallel step the branch belongs to, None for a run
+    """
+    def __init__(self, mission, request, state, pool=None, join=None):
+        self.mission = mission
+        self.request = request
+        self.state = state
+        self.pool = pool
+        self.join = join
+        self.started = None
+
+
+class ParallelJoin(object):
+    def __init__(self, run, step):
+        self.run = run
+        self.step = step
+        self.pending = deque(step.branches)
+        self.running = 0
+
+
+class DriverUsage(object):
+    def __init__(self):
+        self.runs = 0
+        self.conflicts = 0
+        self.commands = 0
+        self.busy_time = 0
+        self.held_time = 0
+        self.held_since = None
+
+
+class Simulation(object):
+    """
+    Discrete event simulation of the executive.
+
+    The instrument scheduler is the executive's own, with a virtual clock and
+    the run, urgent run, scheduler and parallel branch thread pools replaced by
+    SimulatedPools of the configured sizes. Mission runs are interpreted with
+    RunState as Mission._run does, but every command and sleep schedules the
+    continuation of the run on the virtual clock instead of blocking.
+
+    Commands always succeed, runs are not preempted and missions triggered by
+    OMS alerts are not simulated.
+    :param start: datetime of the start of the simulation
+    :param model: LatencyModel of the commands
+    """
+    def __init__(self, start, model, config=None):
+        config = config or app.config
+        self.start = start
+        self.model = model
+        self.now = 0
+        self.events = []
+        self.sequence = count()
+        self.reads = {}
+        self.run_ids = count(1)
+        self.missions = []
+        self.unscheduled = []
+        self.drivers = {}
+        self.queue_waits = []
+
+        self.resumable_sleep = config['RESUMABLE_SLEEP']
+        self.resumable_sleep_threshold = config['RESUMABLE_SLEEP_THRESHOLD']
+        self.urgent_priority = config['URGENT_PRIORITY']
+
+        self.scheduler = InstrumentScheduler(urgent_priority=self.urgent_priority, clock=self.clock)
+        self.scheduler.pool = SimulatedPool(self, 'runs', config['RUN_POOL_SIZE'])
+        self.scheduler.urgent_pool = SimulatedPool(self, 'urgent_runs', config['URGENT_POOL_SIZE'])
+        self.pools = {
+            'runs': self.scheduler.pool,
+            'urgent_runs': self.scheduler.urgent_pool,
+            # resumed runs are executed by app.scheduler, as executive.setup configures it
+            'scheduler_default': SimulatedPool(self, 'scheduler_default', 20),
+            'scheduler_urgent': SimulatedPool(self, 'scheduler_urgent', config['URGENT_POOL_SIZE']),
+            'branches': SimulatedPool(self, 'branches', config['PARALLEL_POOL_SIZE']),
+        }
+
+    def clock(self):
+        return self.now
+
+    def schedule(self, delay, func, *args):
+        heapq.heappush(self.events, (self.now + delay, next(self.sequence), func, args))
+
+    def add_mission(self, script):
+        """
+        Compile a mission script and schedule its first run
+        :return: False if the mission is triggered by OMS alerts and is not simulated
+        """
+        mission = script_cache.load(script)
+        name = mission['name']
+        executor = SimulatedExecutor(name, self.model, self.clock, self.reads)
+        program = compile_mission(mission, executor)
+        trigger = mission_trigger(mission.get(Tags.SCHEDULE, {}), self.start)
+        if trigger is None:
+            self.unscheduled.append(name)
+            return False
+        simulated = SimulatedMission(name, program, trigger)
+        self.missions.append(simulated)
+        self._schedule_next(simulated, None)
+        return True
+
+    def _schedule_next(self, mission, previous):
+        now = self.start + timedelta(seconds=self.now)
+        fire_time = mission.trigger.get_next_fire_time(previous, previous or now)
+        if fire_time is not None:
+            self.schedule(max(0, (fire_time - now).total_seconds()), self._fire, mission, fire_time)
+
+    def run(self, horizon):
+        """
+        Simulate horizon seconds
+        :return: dictionary of results
+        """
+        started = time.time()
+        while self.events and self.events[0][0] <= horizon:
+            self.now, _, func, args = heapq.heappop(self.events)
+            func(*args)
+        self.now = horizon
+        return self.results(horizon, time.time() - started)
+
+    def _usage(self, driver):
+        usage = self.drivers.get(driver)
+        if usage is None:
+            usage = self.drivers[driver] = DriverUsage()
+        return usage
+
+    def _fire(self, mission, fire_time):
+        self._schedule_next(mission, fire_time)
+        mission.submitted += 1
+        program = mission.program
+        for driver in program.drivers:
+            if driver in self.scheduler.busy or self.scheduler.queues.get(driver):
+                self._usage(driver).conflicts += 1
+        if not self.scheduler.submit(mission.name, program.drivers, functools.partial(self._start_run, mission),
+                                     priority=program.priority):
+            mission.skipped += 1
+
+    def _start_run(self, mission, request):
+        """
+        Called by the instrument scheduler on a run pool thread once the drivers of the mission are free
+        """
+        self.queue_waits.append(self.now - request.submitted)
+        program = mission.program
+        state = RunState(next(self.run_ids), program)
+        if program.entry is not None:
+            state.push(program.entry)
+        run = SimulatedRun(mission, request, state, self.pools['urgent_runs' if self._urgent(mission) else 'runs'])
+        run.started = self.now
+        for driver in program.drivers:
+            usage = self._usage(driver)
+            usage.runs += 1
+            usage.held_since = self.now
+        # the drivers are locked concurrently
+        duration = max([self.model.sample('lock', driver) for driver in program.drivers] or [0])
+        self.schedule(duration, self._advance, run)
+
+    def _urgent(self, mission):
+        return mission.program.priority >= self.urgent_priority
+
+    def _advance(self, run):
+        """
+        Interpret the run until it has to wait on the virtual clock
+        """
+        state = run.state
+        while not state.complete:
+            frame = state.current
+            steps = frame.block.steps
+            if frame.index >= len(steps):
+                state.next_iteration()
+                continue
+
+            step = steps[frame.index]
+            frame.index += 1
+
+            if isinstance(step, BlockStep):
+                if step.condition is None or step.condition.evaluate(state.vars):
+                    state.push(step.block, step.loop, step.error_policy)
+                continue
+
+            if isinstance(step, SleepStep):
+                if not state.branch and self.resumable_sleep and step.duration >= self.resumable_sleep_threshold:
+                    self._suspend(run, step.duration)
+                else:
+                    self.schedule(step.duration, self._advance, run)
+                return
+
+            if isinstance(step, ParallelStep):
+                self._start_branches(ParallelJoin(run, step))
+                return
+
+            response = step.call()
+            usage = self._usage(step.target)
+            usage.commands += 1
+            usage.busy_time += response.duration
+            if step.store is not None:
+                state.vars[step.store] = response.value
+            self.schedule(response.duration, self._advance, run)
+            return
+
+        self._finish(run)
+
+    def _suspend(self, run, duration):
+        run.pool.release()
+        run.pool = None
+        pool = self.pools['scheduler_urgent' if self._urgent(run.mission) else 'scheduler_default']
+        self.schedule(duration, pool.submit, self._resume, run, pool)
+
+    def _resume(self, run, pool):
+        run.pool = pool
+        self._advance(run)
+
+    def _start_branches(self, join):
+        parent = join.run
+        limit = 1 if parent.state.branch else join.step.max_concurrency
+        while join.pending and join.running < limit:
+            branch = join.pending.popleft()
+            join.running += 1
+            run = SimulatedRun(parent.mission, parent.request, parent.state.branch_state(branch.block), join=join)
+            if parent.state.branch:
+                # branches of a nested parallel step run one after another on the branch thread
+                self.schedule(0, self._advance, run)
+            else:
+                self.pools['branches'].submit(self._resume, run, self.pools['branches'])
+
+    def _finish(self, run):
+        join = run.join
+        if join is not None:
+            if run.pool is not None:
+                run.pool.release()
+            join.running -= 1
+            join.run.state.vars.update(run.state.vars)
+            if join.pending:
+                self._start_branches(join)
+            elif not join.running:
+                self._advance(join.run)
+            return
+
+        duration = max([self.model.sample('unlock', driver) for driver in run.mission.program.drivers] or [0])
+        self.schedule(duration, self._complete, run)
+
+    def _complete(self, run):
+        mission = run.mission
+        mission.completed += 1
+        mission.durations.append(self.now - run.started)
+        for driver in mission.program.drivers:
+            usage = self._usage(driver)
+            usage.held_time += self.now - usage.held_since
+            usage.held_since = None
+        run.pool.release()
+        self.scheduler.release(mission.name)
+
+    def results(self, horizon, elapsed):
+        for usage in self.drivers.itervalues():
+            if usage.held_since is not None:
+                usage.held_time += horizon - usage.held_since
+                usage.held_since = horizon
+
+        missions = self.missions
+        durations = [duration for mission in missions for duration in mission.durations]
+        return {
+            'start': self.start.isoformat(),
+            'horizon_seconds': horizon,
+            'elapsed_seconds': elapsed,
+            'runs': {
+                'submitted': sum(mission.submitted for mission in missions),
+                'skipped': sum(mission.skipped for mission in missions),
+                'completed': sum(mission.completed for mission in missions),
+                'in_progress': len(self.scheduler.requests),
+                'duration_seconds': distribution(durations),
+                'queue_wait_seconds': distribution(self.queue_waits),
+            },
+            'missions': {
+                mission.name: {
+                    'submitted': mission.submitted,
+                    'skipped': mission.skipped,
+                    'completed': mission.completed,
+                    'mean_duration': sum(mission.durations) / float(len(mission.durations)) if mission.durations else 0,
+                } for mission in missions
+            },
+            'not_simulated': self.unscheduled,
+            'instruments': {
+                driver: {
+                    'runs': usage.runs,
+                    'commands': usage.commands,
+                    'conflicts': usage.conflicts,
+                    'held_fraction': usage.held_time / float(horizon),
+                    'busy_fraction': usage.busy_time / float(horizon),
+                } for driver, usage in self.drivers.iteritems()
+            },
+            'pools': {name: pool.stats(horizon) for name, pool in self.pools.iteritems()},
+        }
+
+
+def load_scripts(paths):
+    """
+    :param paths: mission script files and directories of mission scripts
+    :return: list of mission scripts
+    """
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.endswith(('.yml', '.yaml')))
+            files = [os.path.join(path, name) for name in names]
+        else:
+            files = [path]
+        for filename in files:
+            with open(filename) as f:
+                scripts.append(f.read())
+    return scripts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate mission schedules on a virtual clock')
+    parser.add_argument('missions', nargs='+', help='mission scripts, or directories of mission scripts')
+    parser.add_argument('--hours', type=float, default=24, help='simulated horizon')
+    parser.add_argument('--start', help='start of the simulation (YYYY-MM-DDTHH:MM:SS), defaults to now')
+    parser.add_argument('--history', help='database URI of past runs to fit the command latencies from')
+    parser.add_argument('--since', help='only fit from events after this time (YYYY-MM-DD)')
+    parser.add_argument('--latency', type=float, default=1.0, help='duration of commands without history')
+    parser.add_argument('--seed', type=int, help='random seed of the latency model')
+    parser.add_argument('--output', default='simulation.json', help='file the JSON results are written to')
+    parser.add_argument('--log-level', default='ERROR')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)-5s %(name)-30s %(message)s')
+
+    model = LatencyModel(default=args.latency, seed=args.seed)
+    if args.history:
+        session = sessionmaker(bind=create_engine(args.history))()
+        try:
+            model.fit(session, datetime.strptime(args.since, '%Y-%m-%d') if args.since else None)
+        finally:
+            session.close()
+
+    timezone = get_localzone()
+    start = datetime.strptime(args.start, '%Y-%m-%dT%H:%M:%S') if args.start else datetime.now()
+    simulation = Simulation(timezone.localize(start.replace(microsecond=0)), model)
+    for script in load_scripts(args.missions):
+        simulation.add_mission(script)
+
+    results = simulation.run(args.hours * 3600)
+    results['latency_model'] = model.stats()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    runs = results['runs']
+    print('%d missions, %.1f simulated hours in %.1f s: %d runs completed, %d skipped, %d in progress' %
+          (len(simulation.missions), args.hours, results['elapsed_seconds'], runs['completed'], runs['skipped'],
+           runs['in_progress']))
+    wait = runs['queue_wait_seconds']
+    if wait['count']:
+        print('queue wait: p50 %.1f s  p99 %.1f s  max %.1f s' % (wait['p50'], wait['p99'], wait['max']))
+    busiest = sorted(results['instruments'].iteritems(), key=lambda item: -item[1]['held_fraction'])[:5]
+    for driver, usage in busiest:
+        print('%-40s held %5.1f%%  busy %5.1f%%  conflicts %d' %
+              (driver, usage['held_fraction'] * 100, usage['busy_fraction'] * 100, usage['conflicts']))
+    for name, pool in sorted(results['pools'].iteritems()):
+        print('%-20s max %d/%d  saturated %5.1f%%' %
+              (name, pool['max_busy'], pool['size'], pool['saturated_fraction'] * 100))
+    if results['not_simulated']:
+        print('not simulated (OMS alert triggers): %s' % ', '.join(results['not_simulated']))
+    print('results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+from datetime import datetime
+import unittest
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive.backing_store import Base, MissionData, Run, upgrade_db
+
+__author__ = 'petercable'
+
+
+# the tables as first released, without run counts, run start times or indexes
+LEGACY_SCHEMA = (
+    'CREATE TABLE scripts (id INTEGER PRIMARY KEY, mission_id INTEGER, name VARCHAR NOT NULL, '
+    'version VARCHAR NOT NULL, script VARCHAR NOT NULL, create_time DATETIME)',
+    'CREATE TABLE missions (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, script_id INTEGER, '
+    'active BOOLEAN, archived BOOLEAN)',
+    'CREATE TABLE runs (id INTEGER PRIMARY KEY, mission_id INTEGER, script_id INTEGER)',
+    'CREATE TABLE event_types (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL)',
+    'CREATE TABLE events (id INTEGER PRIMARY KEY, run_id INTEGER, timestamp DATETIME, '
+    'event_type_id INTEGER, event VARCHAR)',
+)
+
+
+class BackingStoreUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        for statement in LEGACY_SCHEMA:
+            self.engine.execute(statement)
+        self.engine.execute("INSERT INTO missions (id, name) VALUES (1, 'a'), (2, 'b')")
+        self.engine.execute('INSERT INTO runs (id, mission_id) VALUES (1, 1), (2, 1), (3, 1)')
+        self.engine.execute("INSERT INTO events (run_id, timestamp, event_type_id, event) VALUES "
+                            "(1, '2016-01-02 03:04:06.000000', 1, ''), (1, '2016-01-02 03:04:05.000000', 1, ''), "
+                            "(2, '2016-01-03 00:00:00.000000', 1, '')")
+
+    def upgrade(self):
+        Base.metadata.create_all(self.engine)
+        upgrade_db(self.engine)
+        return sessionmaker(bind=self.engine)()
+
+    def test_upgrade(self):
+        session = self.upgrade()
+        inspector = inspect(self.engine)
+        self.assertIn('start_time', [column['name'] for column in inspector.get_columns('runs')])
+        self.assertIn('ix_events_run_id', [index['name'] for index in inspector.get_indexes('events')])
+
+        self.assertEqual(dict(session.query(MissionData.name, MissionData.run_count)), {'a': 3, 'b': 0})
+        # run start times are backfilled from their first event, runs without events have none
+        self.assertEqual(dict(session.query(Run.id, Run.start_time)),
+                         {1: datetime(2016, 1, 2, 3, 4, 5), 2: datetime(2016, 1, 3), 3: None})
+
+    def test_upgrade_twice(self):
+        self.upgrade().close()
+        self.engine.execute('UPDATE runs SET start_time = NULL WHERE id = 2')
+        session = self.upgrade()
+        self.assertEqual(session.query(Run.start_time).filter(Run.id == 2).scalar(), datetime(2016, 1, 3))
+        self.assertEqual(session.query(MissionData.run_count).filter(MissionData.name == 'a').scalar(), 3)
@@ -0,0 +1,77 @@
+import os
+import unittest
+
+import requests
+
+from ooi_executive.benchmark import EXAMPLE_DIR, DEFAULT_SHAPES, synthetic_missions, distribution
+from ooi_executive.compiler import compile_mission
+from ooi_executive.executors import Executor, RestExecutor
+from ooi_executive.fake_agent import FakeAgentServer
+from ooi_executive.script_cache import script_cache
+from ooi_executive.shared import InstrumentException, LockException
+
+__author__ = 'petercable'
+
+
+class FakeAgentUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.agent = FakeAgentServer(seed=1)
+        self.agent.start()
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.agent.stop()
+
+    def executor(self, key):
+        return RestExecutor(key, '127.0.0.1', self.agent.port, session=self.session)
+
+    def test_commands(self):
+        executor = self.executor('test')
+        self.assertEqual(executor.get_state('driver', 1000).value, 'DRIVER_STATE_COMMAND')
+        executor.set_resource('driver', {'PRESET_NUMBER': 2}, 1000)
+        self.assertEqual(executor.get_resource('driver', 'PRESET_NUMBER', 1000).value, 2)
+        self.assertEqual(self.agent.stats()['requests'], 3)
+
+    def test_lock(self):
+        first = self.executor('first')
+        second = self.executor('second')
+        first.lock_instrument('driver', 300)
+        with self.assertRaises(LockException):
+            second.lock_instrument('driver', 300)
+        second.unlock_instrument('driver')
+        first.unlock_instrument('driver')
+        second.lock_instrument('driver', 300)
+        self.assertEqual(self.agent.stats()['conflicts'], 1)
+
+    def test_injected_failures(self):
+        self.agent.error_rate = 1
+        self.agent.contention = 1
+        executor = self.executor('test')
+        with self.assertRaises(InstrumentException):
+            executor.execute_resource('driver', 'DRIVER_EVENT_ACQUIRE_STATUS', {}, 1000)
+        with self.assertRaises(LockException):
+            executor.lock_instrument('driver', 300)
+
+
+class BenchmarkUnitTest(unittest.TestCase):
+    def test_synthetic_missions(self):
+        shapes = [os.path.join(EXAMPLE_DIR, shape) for shape in DEFAULT_SHAPES]
+        scripts = synthetic_missions(shapes, 8, 4, 2, 0.5)
+        names = set()
+        for script in scripts:
+            mission = script_cache.load(script)
+            program = compile_mission(mission, Executor(mission['name'], 1000))
+            names.add(mission['name'])
+            self.assertEqual(mission['schedule'], {'second': '*/2'})
+            self.assertTrue(all(driver.startswith('BENCH-') for driver in program.drivers))
+        self.assertEqual(len(names), 8)
+        self.assertIn('sleep: 2.5', scripts[3])
+
+    def test_distribution(self):
+        stats = distribution(range(1, 101))
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['p50'], 50)
+        self.assertEqual(stats['p99'], 99)
+        self.assertEqual(stats['max'], 100)
+        self.assertEqual(distribution([]), {'count': 0})
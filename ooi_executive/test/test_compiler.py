@@ -0,0 +1,196 @@
+import unittest
+
+from ooi_executive.compiler import compile_mission, CommandStep, SleepStep, BlockStep, Condition, ParallelStep, \
+    SetStep
+from ooi_executive.executors import Executor
+from ooi_executive.shared import CompileException
+
+__author__ = 'petercable'
+
+
+class RecordingExecutor(Executor):
+    def __init__(self):
+        super(RecordingExecutor, self).__init__('test', 30000)
+        self.calls = []
+
+    def execute_resource(self, target, command, kwargs, timeout):
+        self.calls.append(('execute_resource', target, command, kwargs, timeout))
+
+    def set_resource(self, target, kwargs, timeout):
+        self.calls.append(('set_resource', target, kwargs, timeout))
+
+    def get_state(self, target, timeout):
+        self.calls.append(('get_state', target, timeout))
+
+
+class CompilerUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = RecordingExecutor()
+        self.mission = {
+            'name': 'test',
+            'desc': 'test',
+            'version': '1',
+            'drivers': ['refdes'],
+            'error_policy': {'type': 'retry', 'count': 2, 'backoff': 1},
+            'blocks': [
+                {'label': 'mission',
+                 'sequence': [
+                     {'get_state': 'refdes'},
+                     {'block_name': 'capture', 'loop': 3,
+                      'condition': {'variable': 'driver_state', 'value': 'COMMAND'}},
+                     {'sleep': 5},
+                     {'sequence': [{'set': 'refdes', 'parameter': 'p1', 'value': 1,
+                                    'error_policy': {'type': 'continue'}}]},
+                 ]},
+                {'label': 'capture',
+                 'sequence': [
+                     {'execute': 'refdes', 'command': 'ACQUIRE', 'kwargs': {'a': 1}, 'timeout': 10},
+                 ]},
+            ],
+        }
+
+    def test_compile(self):
+        program = compile_mission(self.mission, self.executor)
+        self.assertIs(program.entry, program.blocks['mission'])
+        self.assertEqual(program.drivers, ['refdes'])
+
+        get_state, capture, sleep, inline = program.entry.steps
+        self.assertIsInstance(get_state, CommandStep)
+        self.assertEqual(get_state.store, 'driver_state')
+        self.assertIsInstance(capture, BlockStep)
+        self.assertIs(capture.block, program.blocks['capture'])
+        self.assertEqual(capture.loop, 3)
+        self.assertIsInstance(sleep, SleepStep)
+        self.assertEqual(sleep.duration, 5)
+        self.assertIsInstance(inline, BlockStep)
+        self.assertEqual(len(inline.block), 1)
+        self.assertEqual(len(list(program.steps())), 6)
+
+    def test_bound_calls(self):
+        program = compile_mission(self.mission, self.executor)
+        program.blocks['capture'].steps[0].call()
+        program.entry.steps[3].block.steps[0].call()
+        self.assertEqual(self.executor.calls, [
+            ('execute_resource', 'refdes', 'ACQUIRE', {'a': 1}, 10),
+            ('set_resource', 'refdes', {'p1': 1}, 30000),
+        ])
+
+    def test_error_policies(self):
+        program = compile_mission(self.mission, self.executor)
+        self.assertEqual(program.error_policy.action, 'retry')
+        self.assertIs(program.entry.steps[0].error_policy, program.error_policy)
+        self.assertEqual(program.entry.steps[3].block.steps[0].error_policy.action, 'continue')
+        # blocks do not inherit the mission policy
+        self.assertIsNone(program.entry.steps[1].error_policy)
+        self.assertIsNone(program.entry.steps[3].error_policy)
+        self.mission['blocks'][0]['sequence'][1]['error_policy'] = {'type': 'continue'}
+        program = compile_mission(self.mission, self.executor)
+        self.assertEqual(program.entry.steps[1].error_policy.action, 'continue')
+
+    def test_condition(self):
+        condition = Condition({'variable': 'x', 'value': 1})
+        self.assertTrue(condition.evaluate({'x': 1}))
+        self.assertFalse(condition.evaluate({}))
+        condition = Condition({'variable': 'x', 'value': 1, 'comparator': 'not_equal'})
+        self.assertFalse(condition.evaluate({'x': 1}))
+        self.assertTrue(condition.evaluate({'x': 2}))
+
+    def test_unknown_block(self):
+        self.mission['blocks'][0]['sequence'].append({'block_name': 'missing'})
+        with self.assertRaises(CompileException):
+            compile_mission(self.mission, self.executor)
+
+    def test_duplicate_block(self):
+        self.mission['blocks'].append({'label': 'capture', 'sequence': []})
+        with self.assertRaises(CompileException):
+            compile_mission(self.mission, self.executor)
+
+    def test_unknown_step(self):
+        self.mission['blocks'][0]['sequence'].append({'fly': 'refdes'})
+        with self.assertRaises(CompileException):
+            compile_mission(self.mission, self.executor)
+
+    def test_bad_event_pattern(self):
+        self.mission['schedule'] = {'source': 'oms', 'event': '(', 'pattern': True}
+        with self.assertRaises(CompileException):
+            compile_mission(self.mission, self.executor)
+
+    def test_parallel(self):
+        self.mission['drivers'].append('other')
+        self.mission['blocks'][0]['sequence'].append(
+            {'parallel': ['capture', {'block_name': 'other', 'error_policy': {'type': 'continue'}}],
+             'max_concurrency': 1})
+        self.mission['blocks'].append({'label': 'other', 'sequence': [{'get_state': 'other'}]})
+        program = compile_mission(self.mission, self.executor)
+
+        parallel = program.entry.steps[-1]
+        self.assertIsInstance(parallel, ParallelStep)
+        self.assertEqual(parallel.max_concurrency, 1)
+        self.assertEqual(parallel.join, 'all')
+        capture, other = parallel.branches
+        self.assertIs(capture.block, program.blocks['capture'])
+        self.assertIs(other.block, program.blocks['other'])
+        self.assertEqual(capture.error_policy.action, 'abort')
+        self.assertEqual(other.error_policy.action, 'continue')
+
+    def test_parallel_unlocked_driver(self):
+        self.mission['blocks'][0]['sequence'].append({'parallel': ['other']})
+        self.mission['blocks'].append({'label': 'other', 'sequence': [{'get_state': 'other'}]})
+        with self.assertRaises(CompileException):
+            compile_mission(self.mission, self.executor)
+
+    def test_fanout(self):
+        mission = {
+            'name': 'test',
+            'desc': 'test',
+            'version': '1',
+            'drivers': ['a', 'b', 'c'],
+            'error_policy': {'type': 'retry', 'count': 2, 'backoff': 1},
+            'fanout': {'max_concurrency': 2},
+            'blocks': [
+                {'label': 'mission',
+                 'sequence': [{'get_state': '{driver}'}, {'block_name': 'acquire'}]},
+                {'label': 'acquire',
+                 'sequence': [{'execute': '{driver}', 'command': 'ACQUIRE', 'kwargs': {'src': '{driver}'}}]},
+            ],
+        }
+        program = compile_mission(mission, self.executor)
+        self.assertEqual(len(program.blocks), 7)
+
+        parallel, = program.entry.steps
+        self.assertIsInstance(parallel, ParallelStep)
+        self.assertEqual(parallel.max_concurrency, 2)
+        self.assertEqual([branch.driver for branch in parallel.branches], ['a', 'b', 'c'])
+        self.assertEqual(parallel.branches[0].error_policy.action, 'retry')
+
+        get_state, acquire = parallel.branches[1].block.steps
+        self.assertEqual(get_state.target, 'b')
+        self.assertIs(acquire.block, program.blocks['acquire:b'])
+        acquire.block.steps[0].call()
+        self.assertEqual(self.executor.calls, [('execute_resource', 'b', 'ACQUIRE', {'src': 'b'}, 30000)])
+
+        # the cached template is shared and must not be modified
+        self.assertEqual(mission['blocks'][1]['sequence'][0]['execute'], '{driver}')
+
+    def test_coalesce_sets(self):
+        self.mission['blocks'][1]['sequence'] = [
+            {'set': 'refdes', 'parameter': 'p1', 'value': 1},
+            {'set': 'refdes', 'parameters': {'p2': 2, 'p3': 3}},
+            {'set': 'refdes', 'parameter': 'p4', 'value': 4},
+            {'set': 'refdes', 'parameter': 'p5', 'value': 5, 'error_policy': {'type': 'continue'}},
+            {'set': 'other', 'parameter': 'p6', 'value': 6},
+            {'execute': 'refdes', 'command': 'ACQUIRE'},
+            {'set': 'refdes', 'parameter': 'p7', 'value': 7},
+        ]
+        program = compile_mission(self.mission, self.executor)
+        steps = program.blocks['capture'].steps
+        self.assertEqual(len(steps), 5)
+
+        merged = steps[0]
+        self.assertIsInstance(merged, SetStep)
+        self.assertEqual(len(merged.sources), 3)
+        self.assertEqual(merged.sources[1], {'set': 'refdes', 'parameters': {'p2': 2, 'p3': 3}})
+        merged.call()
+        self.assertEqual(self.executor.calls, [('set_resource', 'refdes', {'p1': 1, 'p2': 2, 'p3': 3, 'p4': 4}, 30000)])
+
+        self.assertEqual([type(step) for step in steps[1:]], [CommandStep] * 4)
@@ -0,0 +1,75 @@
+from threading import Timer
+import json
+import time
+import unittest
+
+from ooi_executive.event_stream import EventStream, parse_event_id
+
+__author__ = 'petercable'
+
+
+class EventStreamUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = EventStream(buffer_size=3, runs=2)
+
+    def publish(self, run_id, event_type, event='', encoded=False):
+        self.stream.publish(1, run_id, '2016-01-01T00:00:00', event_type, event, encoded)
+
+    def ids(self, batch):
+        return [event_id for event_id, _, _ in batch.events]
+
+    def test_payload(self):
+        self.publish(5, 'step', json.dumps({'sleep': 1}), encoded=True)
+        self.publish(5, 'exception', 'failed "badly"')
+        batch = self.stream.read(1, 5)
+        payloads = [json.loads(payload) for _, _, payload in batch.events]
+        self.assertEqual(payloads[0], {'id': '5.0', 'run_id': 5, 'type': 'step',
+                                       'timestamp': '2016-01-01T00:00:00', 'event': {'sleep': 1}})
+        self.assertEqual(payloads[1]['event'], 'failed "badly"')
+        self.assertEqual(batch.last_id, '5.1')
+        self.assertFalse(batch.complete)
+
+    def test_resume(self):
+        for event_type in ('start', 'step', 'result', 'step', 'completion'):
+            self.publish(5, event_type)
+        batch = self.stream.read(1, 5, after=(5, 2))
+        self.assertEqual(self.ids(batch), ['5.3', '5.4'])
+        self.assertEqual(batch.missed, 0)
+        self.assertTrue(batch.complete)
+
+        # only the last three events are buffered
+        batch = self.stream.read(1, 5, after=(5, 0))
+        self.assertEqual(self.ids(batch), ['5.2', '5.3', '5.4'])
+        self.assertEqual(batch.missed, 1)
+        self.assertEqual(self.ids(self.stream.read(1, 5, after=(5, 4))), [])
+
+    def test_mission(self):
+        self.publish(5, 'start')
+        self.publish(5, 'completion')
+        self.publish(6, 'start')
+        # a new client starts with the most recent run
+        self.assertEqual(self.ids(self.stream.read(1)), ['6.0'])
+        self.assertEqual(self.ids(self.stream.read(1, after=(5, 0))), ['5.1', '6.0'])
+
+        self.publish(7, 'start')
+        self.assertFalse(self.stream.has_run(1, 5))
+        self.assertEqual(self.ids(self.stream.read(1, after=(5, 0))), ['6.0', '7.0'])
+        self.assertEqual(self.stream.read(1, 5).events, [])
+        self.assertTrue(self.stream.read(1, 5).complete)
+
+    def test_wait(self):
+        self.publish(5, 'start')
+        Timer(0.1, self.publish, (5, 'step')).start()
+        start = time.time()
+        batch = self.stream.read(1, after=(5, 0), timeout=5)
+        self.assertEqual(self.ids(batch), ['5.1'])
+        self.assertLess(time.time() - start, 1)
+
+        start = time.time()
+        self.assertEqual(self.stream.read(1, after=(5, 1), timeout=0.1).events, [])
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_parse_event_id(self):
+        self.assertEqual(parse_event_id('5.12'), (5, 12))
+        self.assertIsNone(parse_event_id('5'))
+        self.assertIsNone(parse_event_id(None))
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive.backing_store import Base, Event
+from ooi_executive.event_writer import EventWriter
+
+__author__ = 'petercable'
+
+
+class EventWriterUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        engine = create_engine('sqlite:///%s' % os.path.join(self.tmpdir, 'test.db'))
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.writer = EventWriter(self.Session, batch_size=10, flush_interval=60)
+        self.writer.start()
+
+    def tearDown(self):
+        self.writer.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def count(self):
+        session = self.Session()
+        try:
+            return session.query(Event).count()
+        finally:
+            session.close()
+
+    def test_sync_add(self):
+        self.writer.add(1, 1, 'first')
+        self.writer.add(1, 2, 'second', sync=True)
+        self.assertEqual(self.count(), 2)
+
+    def test_batch_size(self):
+        for i in xrange(25):
+            self.writer.add(1, 1, str(i))
+        self.writer.flush()
+        self.assertEqual(self.count(), 25)
+        stats = self.writer.stats()
+        self.assertEqual(stats['events_written'], 25)
+        self.assertGreaterEqual(stats['flushes'], 3)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_bad_event(self):
+        for i in xrange(5):
+            self.writer.add(1, 1, str(i))
+        # not a string, rejected by the database
+        self.writer.add(1, 1, object())
+        for i in xrange(3):
+            self.writer.add(1, 1, str(i))
+        # the rest of the batch is written, the waiter is told an event was dropped
+        self.assertFalse(self.writer.add(1, 3, 'completion', sync=True))
+        self.assertEqual(self.count(), 9)
+        self.assertEqual(self.writer.stats()['events_dropped'], 1)
+
+        self.assertTrue(self.writer.add(1, 3, 'completion', sync=True))
+        self.assertEqual(self.count(), 10)
@@ -4,6 +4,9 @@ import httpretty
 import time
 from ooi_executive import log_manager
 from ooi_executive.executors import RestExecutor
+from ooi_executive.http_pool import session_pool
+from ooi_executive.read_cache import ReadCache
+from ooi_executive.shared import LockException
 
 __author__ = 'petercable'
 
@@ -99,3 +102,55 @@ class RestExecutorUnitTest(unittest.TestCase):
         httpretty.register_uri(httpretty.POST, self.executor._url('target', 'unlock'), body=self.response_json)
         self.executor.unlock(['target'])
 
+    @httpretty.activate
+    def test_lock_ttl(self):
+        httpretty.register_uri(httpretty.POST, self.executor._url('target', 'lock'), body=self.response_json)
+        self.executor.lock_instrument('target', ttl=30)
+        self.assertEqual(httpretty.last_request().parsed_body, {'key': ['test'], 'ttl': ['30']})
+
+    @httpretty.activate
+    def test_lock_conflict(self):
+        httpretty.register_uri(httpretty.POST, self.executor._url('target', 'lock'), body='{}', status=409)
+        with self.assertRaises(LockException):
+            self.executor.lock_instrument('target')
+
+    def test_shared_session(self):
+        other = RestExecutor('other', 'test', 12345)
+        self.assertIs(self.executor.session, other.session)
+        self.assertIsNot(self.executor.session, RestExecutor('other', 'test2', 12345).session)
+
+    @httpretty.activate
+    def test_session_stats(self):
+        httpretty.register_uri(httpretty.POST, self.executor._url('target', 'ping'), body=self.response_json)
+        self.executor.ping('target', timeout=60000)
+        self.executor.ping('target', timeout=60000)
+        stats = session_pool.stats()['test:12345']
+        self.assertGreaterEqual(stats['requests'], 2)
+        self.assertEqual(stats['reused'], stats['requests'] - stats['connections'])
+
+    @httpretty.activate
+    def test_prepare(self):
+        httpretty.register_uri(httpretty.POST, self.executor._url('target', 'execute'), body=self.response_json)
+        call = self.executor.prepare('execute_resource', 'target', ('test', {'key1': 'value1'}), 60000)
+        self.assert_response(call())
+        self.assert_response(call())
+        self.assertEqual(httpretty.last_request().parsed_body['command'], ['"test"'])
+
+    @httpretty.activate
+    def test_cached_read(self):
+        httpretty.register_uri(httpretty.GET, self.executor._url('target', 'state'), body=self.response_json)
+        httpretty.register_uri(httpretty.POST, self.executor._url('target', 'execute'), body=self.response_json)
+        executor = RestExecutor('test', 'test', 12345, read_cache=ReadCache())
+        get_state = executor.prepare('get_state', 'target', (), 60000, max_age=60)
+        self.assert_response(get_state())
+        self.assert_response(get_state())
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+
+        executor.execute_resource('target', 'test', {}, timeout=60000)
+        self.assert_response(get_state())
+        self.assertEqual(len(httpretty.latest_requests()), 3)
+
+    def test_parse(self):
+        step = {'get': 'target', 'parameter': 'p1', 'timeout': 5}
+        self.assertEqual(self.executor.parse(step), ('get_resource', 'target', ('p1',), 5))
+        self.assertIsNone(self.executor.parse({'sleep': 5}))
@@ -0,0 +1,109 @@
+from threading import Lock
+import time
+import unittest
+
+from requests import ConnectionError
+
+from ooi_executive.executors import Executor
+from ooi_executive.instrument_lock import LockManager
+from ooi_executive.shared import LockException
+
+__author__ = 'petercable'
+
+
+class FakeLockExecutor(Executor):
+    def __init__(self, mission_id='test', locked_by_others=()):
+        super(FakeLockExecutor, self).__init__(mission_id, 30000)
+        self.locked_by_others = set(locked_by_others)
+        self.unreachable = set()
+        self.locks = {}
+        self.requests = []
+        self.lock = Lock()
+
+    def lock_instrument(self, instrument, ttl=None):
+        with self.lock:
+            self.requests.append(('lock', instrument, ttl))
+            if instrument in self.locked_by_others:
+                raise LockException(instrument)
+            if instrument in self.unreachable:
+                raise ConnectionError(instrument)
+            self.locks[instrument] = ttl
+
+    def unlock_instrument(self, instrument):
+        with self.lock:
+            self.requests.append(('unlock', instrument))
+            self.locks.pop(instrument, None)
+
+
+class LockManagerUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = LockManager(pool_size=4, ttl=30, renew_interval=10)
+        self.events = []
+
+    def add_event(self, event_type, event=''):
+        self.events.append((event_type, event))
+
+    def test_acquire_release(self):
+        executor = FakeLockExecutor()
+        self.manager.acquire(['c', 'a', 'b', 'a'], executor, self.add_event)
+        self.assertEqual(executor.locks, {'a': 30, 'b': 30, 'c': 30})
+        self.assertEqual(self.events, [('lock', 'a\nb\nc')])
+        self.assertEqual(self.manager.stats()['leases'], 3)
+
+        self.manager.release(['a', 'b', 'c'], executor, self.add_event)
+        self.assertEqual(executor.locks, {})
+        self.assertEqual(self.events[-1], ('unlock', 'a\nb\nc'))
+        self.assertEqual(self.manager.stats()['leases'], 0)
+
+    def test_rollback(self):
+        executor = FakeLockExecutor(locked_by_others=['b'])
+        with self.assertRaises(LockException):
+            self.manager.acquire(['a', 'b', 'c'], executor, self.add_event)
+        self.assertEqual(executor.locks, {})
+        self.assertEqual(sorted(r[1] for r in executor.requests if r[0] == 'unlock'), ['a', 'c'])
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.manager.stats()['leases'], 0)
+
+    def test_renew(self):
+        executor = FakeLockExecutor()
+        with self.manager.locked(['a', 'b'], executor, self.add_event):
+            self.manager.renew()
+            self.assertEqual(self.manager.stats()['renewals'], 2)
+
+        self.manager.renew()
+        self.assertEqual(self.manager.stats()['renewals'], 2)
+        self.assertEqual(len([r for r in executor.requests if r[0] == 'lock']), 4)
+
+    def test_renew_failure(self):
+        executor = FakeLockExecutor()
+        self.manager.acquire(['a', 'b'], executor, self.add_event)
+        self.assertEqual(self.manager.lost(['a', 'b'], executor), [])
+        executor.locked_by_others.add('a')
+        self.manager.renew()
+        stats = self.manager.stats()
+        self.assertEqual(stats['renew_failures'], 1)
+        self.assertEqual(stats['leases_lost'], 1)
+        self.assertEqual(self.manager.lost(['a', 'b'], executor), ['a'])
+        self.assertEqual(self.manager.lost(['a'], FakeLockExecutor('other')), [])
+
+        # the lost lease is no longer renewed, until the run locks the instrument again
+        self.manager.renew()
+        self.assertEqual(self.manager.stats()['renew_failures'], 1)
+        self.manager.release(['a', 'b'], executor, self.add_event)
+        self.assertEqual(self.manager.lost(['a'], executor), [])
+        executor.locked_by_others.clear()
+        self.manager.acquire(['a'], executor, self.add_event)
+        self.manager.renew()
+        self.assertEqual(self.manager.lost(['a'], executor), [])
+
+    def test_renew_unreachable(self):
+        executor = FakeLockExecutor()
+        self.manager.acquire(['a'], executor, self.add_event)
+        executor.unreachable.add('a')
+        # the lease is kept until it expires
+        self.manager.renew()
+        self.assertEqual(self.manager.lost(['a'], executor), [])
+        self.manager.renewed[('test', 'a')] = time.time() - self.manager.ttl
+        self.manager.renew()
+        self.assertEqual(self.manager.lost(['a'], executor), ['a'])
+        self.assertEqual(self.manager.stats()['renew_failures'], 2)
@@ -0,0 +1,135 @@
+from threading import Event as ThreadEvent
+import unittest
+
+from ooi_executive.instrument_scheduler import InstrumentScheduler
+
+__author__ = 'petercable'
+
+
+class Recorder(object):
+    def __init__(self):
+        self.started = []
+        self.events = {}
+        self.preempted = []
+
+    def callback(self, request):
+        self.started.append(request.key)
+        self.events.setdefault(request.key, ThreadEvent()).set()
+
+    def on_preempt(self, request):
+        self.preempted.append(request.key)
+
+    def wait(self, key, timeout=5):
+        return self.events.setdefault(key, ThreadEvent()).wait(timeout)
+
+
+class InstrumentSchedulerUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = InstrumentScheduler(pool_size=4, urgent_pool_size=1, urgent_priority=10)
+        self.scheduler.start()
+        self.recorder = Recorder()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def submit(self, key, drivers, priority=0):
+        return self.scheduler.submit(key, drivers, self.recorder.callback, priority, self.recorder.on_preempt)
+
+    def test_fifo_per_driver(self):
+        self.assertTrue(self.submit('one', ['a', 'b']))
+        self.assertTrue(self.recorder.wait('one'))
+        self.assertTrue(self.submit('two', ['b']))
+        self.assertTrue(self.submit('three', ['a']))
+        self.assertFalse(self.submit('one', ['a']))
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats['a']['depth'], 1)
+        self.assertEqual(stats['b']['held_by'], 'one')
+        self.assertTrue(self.scheduler.is_queued('two'))
+
+        self.scheduler.release('one')
+        self.assertTrue(self.recorder.wait('two'))
+        self.assertTrue(self.recorder.wait('three'))
+        self.assertEqual(self.scheduler.stats()['a']['dispatched'], 2)
+
+    def test_no_overtaking(self):
+        # 'two' needs a driver held by 'one', so 'three' may not take 'c' ahead of it
+        self.submit('one', ['a'])
+        self.assertTrue(self.recorder.wait('one'))
+        self.submit('two', ['a', 'c'])
+        self.submit('three', ['c'])
+        self.assertFalse(self.recorder.wait('three', timeout=0.1))
+
+        self.scheduler.release('one')
+        self.assertTrue(self.recorder.wait('two'))
+        self.scheduler.release('two')
+        self.assertTrue(self.recorder.wait('three'))
+        self.assertEqual(self.recorder.started, ['one', 'two', 'three'])
+
+    def test_requeue(self):
+        self.submit('one', ['a'])
+        self.assertTrue(self.recorder.wait('one'))
+        self.recorder.events['one'].clear()
+        self.scheduler.requeue('one', 0.05)
+        self.assertTrue(self.recorder.wait('one'))
+        self.assertEqual(self.recorder.started, ['one', 'one'])
+
+    def test_requeue_preempted(self):
+        # preempted before it took its external locks, the run is not asked to stop again once restarted
+        self.submit('routine', ['a'])
+        self.assertTrue(self.recorder.wait('routine'))
+        self.recorder.events['routine'].clear()
+        self.submit('alarm', ['a'], priority=10)
+        self.assertTrue(self.scheduler.requests['routine'].preempt_requested)
+        self.scheduler.requeue('routine', 0.05)
+        self.assertFalse(self.scheduler.requests['routine'].preempt_requested)
+        self.assertTrue(self.recorder.wait('alarm'))
+        self.scheduler.release('alarm')
+        self.assertTrue(self.recorder.wait('routine'))
+        self.assertEqual(self.recorder.preempted, ['routine'])
+
+    def test_cancel(self):
+        self.submit('one', ['a'])
+        self.assertTrue(self.recorder.wait('one'))
+        self.submit('two', ['a'])
+        self.assertFalse(self.scheduler.cancel('one'))
+        self.assertTrue(self.scheduler.cancel('two'))
+        self.scheduler.release('one')
+        self.assertEqual(self.scheduler.stats()['a']['depth'], 0)
+        self.assertTrue(self.submit('two', ['a']))
+        self.assertTrue(self.recorder.wait('two'))
+
+    def test_no_drivers(self):
+        self.submit('one', [])
+        self.assertTrue(self.recorder.wait('one'))
+
+    def test_priority(self):
+        self.submit('one', ['a'])
+        self.assertTrue(self.recorder.wait('one'))
+        self.submit('low', ['a'])
+        self.submit('high', ['a'], priority=5)
+        self.scheduler.release('one')
+        self.assertTrue(self.recorder.wait('high'))
+        self.assertFalse(self.recorder.wait('low', timeout=0.1))
+        self.assertEqual(self.recorder.preempted, [])
+
+    def test_preempt(self):
+        self.submit('routine', ['a', 'b'])
+        self.assertTrue(self.recorder.wait('routine'))
+        self.recorder.events['routine'].clear()
+        self.submit('later', ['b'])
+        self.submit('alarm', ['a'], priority=10)
+        self.assertEqual(self.recorder.preempted, ['routine'])
+        self.assertTrue(self.scheduler.requests['routine'].preempt_requested)
+
+        # the preempted run hands back its drivers and keeps its place ahead of 'later'
+        self.scheduler.preempted('routine')
+        self.assertTrue(self.recorder.wait('alarm'))
+        self.assertTrue(self.scheduler.is_queued('routine'))
+        self.assertEqual(self.scheduler.stats()['a']['preemptions'], 1)
+
+        self.scheduler.release('alarm')
+        self.assertTrue(self.recorder.wait('routine'))
+        self.assertFalse(self.recorder.wait('later', timeout=0.1))
+        self.scheduler.release('routine')
+        self.assertTrue(self.recorder.wait('later'))
@@ -0,0 +1,99 @@
+from threading import Event as ThreadEvent
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from apscheduler.events import EVENT_JOB_ADDED, EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_SUBMITTED
+from apscheduler.schedulers.background import BackgroundScheduler
+from concurrent import futures
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive.backing_store import Base, MissionData
+from ooi_executive.job_router import JobRouter, PoolExecutor
+
+__author__ = 'petercable'
+
+
+class FakeMission(object):
+    def __init__(self):
+        self.events = []
+
+    def job_finished(self, event):
+        self.events.append(event)
+
+
+class FakeJobEvent(object):
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.code = EVENT_JOB_EXECUTED
+
+
+class JobRouterUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        engine = create_engine('sqlite:///%s' % os.path.join(self.tmpdir, 'test.db'))
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.router = JobRouter(self.Session)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_dispatch_exact_job_id(self):
+        short = FakeMission()
+        long_name = FakeMission()
+        self.router.register('mission', short)
+        self.router.register('mission_two', long_name)
+
+        self.router.dispatch(FakeJobEvent('mission_two'))
+        self.router.dispatch(FakeJobEvent('mission:resume'))
+        self.assertEqual(len(short.events), 0)
+        self.assertEqual(len(long_name.events), 1)
+
+        self.router.unregister('mission_two')
+        self.router.dispatch(FakeJobEvent('mission_two'))
+        self.assertEqual(len(long_name.events), 1)
+
+    def test_deactivate(self):
+        session = self.Session()
+        session.add_all([MissionData(name='one', active=True), MissionData(name='two', active=True)])
+        session.commit()
+
+        self.router.deactivate(1)
+        self.router.deactivate(2)
+        session.expire_all()
+        self.assertEqual([m.active for m in session.query(MissionData).order_by(MissionData.id)], [False, False])
+        session.close()
+
+    def test_running_jobs(self):
+        pools = {'default': futures.ThreadPoolExecutor(2), 'urgent': futures.ThreadPoolExecutor(1)}
+        scheduler = BackgroundScheduler()
+        scheduler.configure(executors={name: PoolExecutor(pool) for name, pool in pools.iteritems()})
+        router = JobRouter(self.Session, scheduler)
+        scheduler.add_listener(router.dispatch,
+                               EVENT_JOB_ADDED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_SUBMITTED)
+        scheduler.start()
+        try:
+            started = ThreadEvent()
+            finish = ThreadEvent()
+
+            def job():
+                started.set()
+                finish.wait(5)
+
+            scheduler.add_job(job, 'date', id='alarm', executor='urgent')
+            self.assertTrue(started.wait(5))
+            deadline = time.time() + 5
+            while router.running_jobs() != {'urgent': 1} and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(router.running_jobs(), {'urgent': 1})
+
+            finish.set()
+            while router.running_jobs() and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(router.running_jobs(), {})
+        finally:
+            scheduler.shutdown()
@@ -0,0 +1,104 @@
+from Queue import Queue
+import json
+import logging
+import sys
+import threading
+import unittest
+
+from ooi_executive.log_manager import JsonFormatter, QueueHandler, QueueListener, RateLimitFilter
+
+__author__ = 'petercable'
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.threads.add(threading.current_thread().name)
+        self.records.append(self.format(record))
+
+
+def make_record(msg, args=None, level=logging.INFO, name='test', exc_info=None):
+    return logging.LogRecord(name, level, __file__, 0, msg, args, exc_info)
+
+
+class LogManagerUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = Queue(100)
+        self.handler = QueueHandler(self.queue)
+        self.output = ListHandler()
+        self.output.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.listener = QueueListener(self.queue, [self.output], source=self.handler)
+
+    def test_listener(self):
+        self.listener.start()
+        for i in range(10):
+            self.handler.handle(make_record('record %d', (i,)))
+        self.listener.stop()
+        self.assertEqual(self.output.records, ['INFO record %d' % i for i in range(10)])
+        self.assertEqual(self.output.threads, {'log-listener'})
+
+    def test_handler_level(self):
+        self.output.setLevel(logging.WARNING)
+        self.listener.start()
+        self.handler.handle(make_record('debug', level=logging.DEBUG))
+        self.handler.handle(make_record('error', level=logging.ERROR))
+        self.listener.stop()
+        self.assertEqual(self.output.records, ['ERROR error'])
+
+    def test_prepare(self):
+        value = {'a': 1}
+        record = self.handler.prepare(make_record('%r %s', (value, 'b')))
+        value['a'] = 2
+        self.assertEqual(record.getMessage(), "{'a': 1} b")
+
+        record = self.handler.prepare(make_record('%d %s', (1, 'b')))
+        self.assertEqual(record.args, (1, 'b'))
+
+        try:
+            raise ValueError('failed')
+        except ValueError:
+            record = self.handler.prepare(make_record('error', exc_info=sys.exc_info()))
+        self.assertIsNone(record.exc_info)
+        self.assertIn('ValueError: failed', record.exc_text)
+
+    def test_queue_full(self):
+        self.handler.queue = Queue(1)
+        self.listener.queue = self.handler.queue
+        for i in range(3):
+            self.handler.handle(make_record('record %d', (i,)))
+        self.assertEqual(self.handler.dropped, 2)
+        self.listener.start()
+        self.listener.stop()
+        self.assertEqual(self.output.records, ['WARNING Log queue full, dropped 2 records', 'INFO record 0'])
+
+    def test_rate_limit(self):
+        self.handler.addFilter(RateLimitFilter(0.0001, 3))
+        self.listener.start()
+        for i in range(5):
+            self.handler.handle(make_record('driver error %d', (i,), level=logging.ERROR))
+        self.handler.handle(make_record('other logger', level=logging.ERROR, name='other'))
+        self.handler.handle(make_record('other level'))
+        self.listener.stop()
+        self.assertEqual(self.output.records, ['ERROR driver error 0', 'ERROR driver error 1',
+                                               'ERROR driver error 2', 'ERROR other logger', 'INFO other level'])
+
+    def test_rate_limit_dropped(self):
+        limit = RateLimitFilter(1000, 1)
+        self.assertTrue(limit.filter(make_record('first')))
+        self.assertFalse(limit.filter(make_record('second')))
+        limit.buckets[('test', logging.INFO)] = (1, 0, 1)
+        record = make_record('third %d', (3,))
+        self.assertTrue(limit.filter(record))
+        self.assertEqual(record.getMessage(), 'third 3 (1 similar records dropped)')
+
+    def test_json(self):
+        line = JsonFormatter().format(make_record('value %d', (5,), level=logging.WARNING))
+        data = json.loads(line)
+        self.assertEqual(data['message'], 'value 5')
+        self.assertEqual(data['level'], 'WARNING')
+        self.assertEqual(data['logger'], 'test')
+        self.assertNotIn('exception', data)
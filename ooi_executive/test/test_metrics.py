@@ -0,0 +1,69 @@
+from threading import Thread
+import unittest
+
+from ooi_executive.metrics import Registry, PRUNE_THRESHOLD
+
+__author__ = 'petercable'
+
+
+class MetricsUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_threads(self):
+        counter = self.registry.counter('test_total', 'test', ('kind',))
+
+        def work():
+            for _ in range(100):
+                counter.inc('a')
+            counter.inc('b', value=5)
+
+        threads = [Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc('a')
+
+        totals = self.registry.collect()
+        self.assertEqual(totals[('test_total', ('a',))], 401)
+        self.assertEqual(totals[('test_total', ('b',))], 20)
+        # the stores of the finished threads have been folded together
+        self.assertEqual(len(self.registry.stores), 1)
+        self.assertEqual(self.registry.collect()[('test_total', ('a',))], 401)
+
+    def test_short_lived_threads(self):
+        # one thread per request, without the metrics ever being collected
+        histogram = self.registry.histogram('test_seconds', 'test', buckets=(1,))
+
+        for _ in range(1000):
+            thread = Thread(target=histogram.observe, args=(0.5,))
+            thread.start()
+            thread.join()
+
+        self.assertLessEqual(len(self.registry.stores), PRUNE_THRESHOLD)
+        buckets, total = self.registry.collect()[('test_seconds', ())]
+        self.assertEqual(buckets, [1000, 0])
+        self.assertEqual(total, 500)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('test_seconds', 'test', ('command',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'get')
+        histogram.observe(0.5, 'get')
+        histogram.observe(5, 'get')
+        text = self.registry.render()
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn('test_seconds_bucket{command="get",le="0.1"} 1.0', text)
+        self.assertIn('test_seconds_bucket{command="get",le="1"} 2.0', text)
+        self.assertIn('test_seconds_bucket{command="get",le="+Inf"} 3.0', text)
+        self.assertIn('test_seconds_count{command="get"} 3.0', text)
+        self.assertIn('test_seconds_sum{command="get"} 5.55', text)
+
+    def test_gauge(self):
+        self.registry.gauge('test_depth', 'test', lambda: {('a',): 2}, ('driver',))
+        self.registry.gauge('test_size', 'test', lambda: 3)
+        self.registry.gauge('test_broken', 'test', lambda: 1 / 0)
+        text = self.registry.render()
+        self.assertIn('test_depth{driver="a"} 2.0', text)
+        self.assertIn('test_size 3.0', text)
+        self.assertNotIn('test_broken', text)
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+import json
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive import app
+from ooi_executive.backing_store import Base, Event, EventType, MissionData, Run
+from ooi_executive.mission import Mission
+
+__author__ = 'petercable'
+
+START = datetime(2016, 1, 1)
+
+
+class MissionHistoryUnitTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.saved_session = getattr(app, 'Session', None)
+        app.Session = sessionmaker(bind=engine)
+
+        session = app.Session()
+        session.add_all([EventType(id=1, name='start'), EventType(id=2, name='step'),
+                         EventType(id=3, name='completion')])
+        session.add_all([MissionData(id=1, name='a'), MissionData(id=2, name='b')])
+        # runs of both missions, interleaved, one hour apart
+        self.runs = []
+        for i in range(6):
+            mission_id = 2 if i % 3 == 2 else 1
+            run = Run(mission_id=mission_id, start_time=START + timedelta(hours=i))
+            session.add(run)
+            session.flush()
+            if mission_id == 1:
+                self.runs.append(run.id)
+            for j, type_id in enumerate((1, 2, 2, 3)):
+                session.add(Event(run_id=run.id, timestamp=run.start_time + timedelta(minutes=j),
+                                  event_type_id=type_id, event=json.dumps({'step': j}) if type_id == 2 else ''))
+        session.commit()
+        session.close()
+
+        self.mission = Mission()
+        self.mission.id = 1
+
+    def tearDown(self):
+        app.Session = self.saved_session
+
+    def test_runs(self):
+        self.assertEqual(len(self.runs), 4)
+        runs, next_id = self.mission.runs(limit=3)
+        self.assertEqual(runs, self.runs[:3])
+        self.assertEqual(next_id, self.runs[2])
+        self.assertEqual(self.mission.runs(limit=3, after_id=next_id), (self.runs[3:], None))
+
+        runs, next_id = self.mission.runs(limit=2, descending=True)
+        self.assertEqual(runs, [self.runs[3], self.runs[2]])
+        self.assertEqual(self.mission.runs(limit=2, after_id=next_id, descending=True),
+                         ([self.runs[1], self.runs[0]], self.runs[0]))
+
+    def test_runs_time_range(self):
+        # the runs of mission 1 start at hours 0, 1, 3 and 4
+        runs, _ = self.mission.runs(since=START + timedelta(hours=1), until=START + timedelta(hours=4))
+        self.assertEqual(runs, self.runs[1:3])
+
+    def test_events(self):
+        session = app.Session()
+        try:
+            # the most recent run by default
+            events, next_id = self.mission._get_events(session, limit=10)
+            self.assertEqual([event[1] for event in events], ['start', 'step', 'step', 'completion'])
+            self.assertEqual(events[0][0], (START + timedelta(hours=4)).isoformat())
+            self.assertIsNone(next_id)
+
+            run_id = self.runs[0]
+            events, next_id = self.mission._get_events(session, run_id, limit=2)
+            self.assertEqual(events, [(START.isoformat(), 'start', ''),
+                                      ((START + timedelta(minutes=1)).isoformat(), 'step', {'step': 1})])
+            events, next_id = self.mission._get_events(session, run_id, limit=2, after_id=next_id)
+            self.assertEqual([event[2] for event in events], [{'step': 2}, ''])
+            self.assertIsNotNone(next_id)
+            self.assertEqual(self.mission._get_events(session, run_id, limit=2, after_id=next_id), ([], None))
+
+            events, _ = self.mission._get_events(session, run_id, event_types=['step'],
+                                                 since=START + timedelta(minutes=2))
+            self.assertEqual(events, [((START + timedelta(minutes=2)).isoformat(), 'step', {'step': 2})])
+            events, _ = self.mission._get_events(session, run_id, until=START + timedelta(minutes=1))
+            self.assertEqual([event[1] for event in events], ['start'])
+
+            # a run of another mission
+            self.assertEqual(self.mission._get_events(session, 3), ([], None))
+        finally:
+            session.close()
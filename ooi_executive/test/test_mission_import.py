@@ -0,0 +1,124 @@
+from io import BytesIO
+import tarfile
+import unittest
+import zipfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive.backing_store import Base, MissionData, Script
+from ooi_executive.mission_import import BatchScript, ValidationPool, read_batch, split_documents, store_batch
+
+__author__ = 'petercable'
+
+
+SCRIPT = '''name: %s
+desc: test mission
+version: 1-00
+drivers:
+- refdes
+blocks:
+- label: mission
+  sequence:
+  - get_state: refdes
+'''
+
+
+def scripts(*names):
+    return [BatchScript(name, SCRIPT % name) for name in names]
+
+
+def tar_archive(members):
+    buf = BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as archive:
+        for name, text in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(text)
+            archive.addfile(info, BytesIO(text))
+    return buf.getvalue()
+
+
+def zip_archive(members):
+    buf = BytesIO()
+    archive = zipfile.ZipFile(buf, 'w')
+    for name, text in members:
+        archive.writestr(name, text)
+    archive.close()
+    return buf.getvalue()
+
+
+class MissionImportUnitTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def test_split_documents(self):
+        stream = '%YAML 1.1\n---\n' + SCRIPT % 'a' + '...\n# comment\n---\n' + SCRIPT % 'b' + '---\n\n'
+        documents = split_documents(stream)
+        self.assertEqual([document.source for document in documents], ['document 1', 'document 2'])
+        self.assertEqual([document.text for document in documents], [SCRIPT % 'a', SCRIPT % 'b'])
+        self.assertEqual(split_documents(SCRIPT % 'a')[0].text, SCRIPT % 'a')
+
+    def test_read_archive(self):
+        members = [('missions/b.yml', SCRIPT % 'b'), ('missions/a.yaml', SCRIPT % 'a'),
+                   ('missions/README', 'not a script'), ('__MACOSX/missions/._a.yaml', '')]
+        for data in (tar_archive(members), zip_archive(members)):
+            batch, archive = read_batch(data)
+            self.assertTrue(archive)
+            self.assertEqual([(script.source, script.text) for script in batch],
+                             [('missions/a.yaml', SCRIPT % 'a'), ('missions/b.yml', SCRIPT % 'b')])
+
+        with self.assertRaises(ValueError):
+            read_batch('\x1f\x8b not gzip')
+
+    def test_validate(self):
+        batch = scripts('a', 'b', 'a') + [BatchScript('bad', 'name: [')]
+        batch[1].text = batch[1].text.replace('name: b', '')
+        ValidationPool().validate(batch)
+        self.assertEqual([script.status for script in batch], [None, 'invalid', 'invalid', 'invalid'])
+        self.assertEqual(batch[0].name, 'a')
+        self.assertIn("'name' is a required property", batch[1].error)
+        self.assertIn('more than once', batch[2].error)
+
+    def test_validate_pool(self):
+        pool = ValidationPool(2)
+        pool.start()
+        try:
+            batch = scripts(*('mission%d' % i for i in range(20)))
+            batch[7].text = 'name: ['
+            pool.validate(batch)
+        finally:
+            pool.stop()
+        self.assertEqual([script.name for script in batch if script.status is None],
+                         ['mission%d' % i for i in range(20) if i != 7])
+        self.assertEqual(batch[7].status, 'invalid')
+
+    def test_store(self):
+        batch = scripts('a', 'b')
+        ValidationPool().validate(batch)
+        store_batch(self.session, batch, activate=True)
+        self.session.commit()
+        self.assertEqual([script.status for script in batch], ['created', 'created'])
+        mission = self.session.query(MissionData).filter(MissionData.id == batch[0].mission_id).one()
+        self.assertEqual(mission.script.id, batch[0].script_id)
+        self.assertTrue(mission.active)
+
+        batch = scripts('a', 'b', 'c')
+        batch[1].text = batch[1].text.replace('1-00', '1-01')
+        batch[2].fail('rejected', 'Mission contends with active missions')
+        ValidationPool().validate(batch)
+        store_batch(self.session, batch)
+        self.session.commit()
+        self.assertEqual([script.status for script in batch], ['unchanged', 'updated', 'rejected'])
+        self.assertEqual(self.session.query(Script).count(), 3)
+        mission = self.session.query(MissionData).filter(MissionData.name == 'b').one()
+        self.assertEqual(mission.script.version, '1-01')
+
+        # an existing version may not be changed
+        batch = scripts('a')
+        batch[0].text = batch[0].text.replace('test mission', 'changed')
+        ValidationPool().validate(batch)
+        store_batch(self.session, batch)
+        self.assertEqual(batch[0].status, 'invalid')
+        self.assertIsNone(batch[0].mission_id)
@@ -0,0 +1,424 @@
+import sys
+import time
+import unittest
+
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive import app
+from ooi_executive.backing_store import Base, EventType
+from ooi_executive.compiler import compile_mission
+from ooi_executive.executors import Executor
+from ooi_executive.instrument_scheduler import InstrumentScheduler
+from ooi_executive.job_router import JobRouter
+from ooi_executive.mission import Mission
+from ooi_executive.mission_snapshot import mission_snapshot
+from ooi_executive.shared import InstrumentException, LockException
+
+__author__ = 'petercable'
+
+SAMPLER = '''
+name: sampler
+desc: samples twice
+version: 1-00
+drivers:
+- CAMDS
+%(options)s
+blocks:
+- label: mission
+  sequence:
+  - execute: CAMDS
+    command: FIRST
+  - sleep: %(sleep)s
+  - execute: CAMDS
+    command: SECOND
+'''
+
+NESTED = '''
+name: nested
+desc: fails three blocks deep
+version: 1-00
+drivers:
+- CAMDS
+error_policy:
+  type: retry
+  count: 3
+  backoff: %(backoff)s
+blocks:
+- label: mission
+  sequence:
+  - block_name: outer
+  - execute: CAMDS
+    command: LAST
+- label: outer
+  sequence:
+  - block_name: inner
+%(run_policy)s
+- label: inner
+%(inner_policy)s
+  sequence:
+  - execute: CAMDS
+    command: FAIL
+'''
+
+
+class StubResponse(object):
+    def __init__(self, value):
+        self.value = value
+
+    def to_dict(self):
+        return {'value': self.value}
+
+
+class StubExecutor(Executor):
+    """
+    Executor recording the commands sent, before_command is called with each command before it returns
+    """
+    def __init__(self, mission_id):
+        super(StubExecutor, self).__init__(mission_id, 30000)
+        self.commands = []
+        self.before_command = None
+
+    def prepare(self, command, target, args, timeout, max_age=None):
+        return lambda: self._execute(args[0] if args else command)
+
+    def _execute(self, command):
+        self.commands.append(command)
+        if self.before_command is not None:
+            self.before_command(command)
+        return StubResponse(command)
+
+
+class StubJob(object):
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.trigger = None
+        self.next_run_time = None
+
+
+class StubScheduler(object):
+    """
+    The parts of the APScheduler scheduler used by Mission, jobs are run by fire()
+    """
+    def __init__(self):
+        self.jobs = {}
+
+    def add_job(self, func, trigger, args=None, id=None, **kwargs):
+        if id in self.jobs:
+            raise ConflictingIdError(id)
+        job = self.jobs[id] = StubJob(func, args or [])
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def remove_job(self, job_id):
+        if self.jobs.pop(job_id, None) is None:
+            raise JobLookupError(job_id)
+
+    def fire(self, job_id):
+        job = self.jobs.pop(job_id)
+        job.func(*job.args)
+
+
+class StubTriggers(object):
+    def unregister(self, mission_id):
+        pass
+
+
+class StubJmsReader(object):
+    def __init__(self):
+        self.triggers = StubTriggers()
+
+
+class InlinePool(object):
+    def submit(self, func, *args):
+        func(*args)
+
+
+class StubLockManager(object):
+    def __init__(self):
+        self.held = set()
+        self.lost_instruments = set()
+        self.before_acquire = None
+
+    def acquire(self, instruments, executor, add_event):
+        if self.before_acquire is not None:
+            self.before_acquire()
+        self.held.update(instruments)
+
+    def release(self, instruments, executor, add_event):
+        self.held.difference_update(instruments)
+        self.lost_instruments.difference_update(instruments)
+
+    def lost(self, instruments, executor):
+        return sorted(self.lost_instruments.intersection(instruments))
+
+
+class StubEventWriter(object):
+    def __init__(self):
+        self.events = []
+
+    def add(self, run_id, event_type_id, event, sync=False):
+        self.events.append((run_id, event_type_id, event))
+
+    def flush(self):
+        pass
+
+
+class MissionRunUnitTest(unittest.TestCase):
+    """
+    Runs of a mission against stub drivers, locks and schedulers.
+    Instrument scheduler callbacks are executed inline, its timer thread is not started.
+    """
+    STUBS = ('Session', 'scheduler', 'instrument_scheduler', 'lock_manager', 'event_writer', 'jms_reader',
+             'job_router')
+
+    def setUp(self):
+        self.saved = {name: getattr(app, name, None) for name in self.STUBS}
+        self.saved_config = dict(app.config)
+        app.config['RESUMABLE_SLEEP'] = True
+        app.config['RESUMABLE_SLEEP_THRESHOLD'] = 5
+        app.config['URGENT_PRIORITY'] = 10
+
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        app.Session = sessionmaker(bind=engine)
+        session = app.Session()
+        session.add_all([EventType(name=name) for name in ('start', 'step', 'result', 'completion', 'exception')])
+        session.commit()
+        session.close()
+
+        app.scheduler = StubScheduler()
+        app.instrument_scheduler = InstrumentScheduler(pool_size=1, urgent_pool_size=1, urgent_priority=10)
+        app.instrument_scheduler.pool = app.instrument_scheduler.urgent_pool = InlinePool()
+        app.lock_manager = StubLockManager()
+        app.event_writer = StubEventWriter()
+        app.jms_reader = StubJmsReader()
+        app.job_router = JobRouter(app.Session)
+        self.urgent_started = []
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(app, name, value)
+        app.config.clear()
+        app.config.update(self.saved_config)
+
+    def create(self, sleep=600, options='', script=None):
+        mission = Mission(script=script or SAMPLER % {'sleep': sleep, 'options': options})
+        self.addCleanup(mission_snapshot.remove, mission.id)
+        mission.executor = StubExecutor(mission.name)
+        mission.program = compile_mission(mission.mission, mission.executor)
+        return mission
+
+    def events(self, mission):
+        type_names = {v: k for k, v in mission.event_types.iteritems()}
+        return [type_names[event_type_id] for _, event_type_id, _ in app.event_writer.events
+                if type_names[event_type_id] not in ('step', 'result', 'trace')]
+
+    def urgent(self):
+        """
+        Submit an urgent run of the driver, holding it until the run is released
+        """
+        app.instrument_scheduler.submit('urgent', ['CAMDS'], self.urgent_started.append, priority=10)
+
+    def test_run(self):
+        mission = self.create(sleep=0)
+        mission._execute_mission()
+        self.assertEqual(mission.executor.commands, ['FIRST', 'SECOND'])
+        self.assertEqual(self.events(mission), ['start', 'completion'])
+        self.assertFalse(app.lock_manager.held)
+        self.assertIsNone(mission.current_run)
+
+    def test_suspend_resume(self):
+        mission = self.create()
+        mission._execute_mission()
+        # the drivers are held while the run is suspended
+        self.assertEqual(mission.executor.commands, ['FIRST'])
+        self.assertTrue(mission.running)
+        self.assertEqual(app.lock_manager.held, {'CAMDS'})
+        self.assertEqual(app.instrument_scheduler.stats()['CAMDS']['held_by'], mission.name)
+
+        app.scheduler.fire(mission._resume_job_id())
+        self.assertEqual(mission.executor.commands, ['FIRST', 'SECOND'])
+        self.assertEqual(self.events(mission), ['start', 'completion'])
+        self.assertFalse(mission.running)
+        self.assertFalse(app.lock_manager.held)
+        self.assertFalse(app.instrument_scheduler.requests)
+
+    def test_delete_suspended(self):
+        mission = self.create()
+        mission._execute_mission()
+        mission.delete()
+        self.assertFalse(app.scheduler.jobs)
+        self.assertFalse(app.lock_manager.held)
+        self.assertFalse(app.instrument_scheduler.requests)
+        self.assertIsNone(mission.current_run)
+        self.assertEqual(self.events(mission), ['start', 'exception', 'completion'])
+        self.assertIsNone(mission_snapshot.version_of(mission.id))
+
+        # the mission is created again under the same name and suspends its first run
+        mission = self.create()
+        mission._execute_mission()
+        self.assertIn(mission._resume_job_id(), app.scheduler.jobs)
+
+    def test_delete_running(self):
+        mission = self.create()
+        # deleted while the first command is executing, the run ends instead of suspending
+        mission.executor.before_command = lambda command: command == 'FIRST' and mission.delete()
+        mission._execute_mission()
+        self.assertEqual(mission.executor.commands, ['FIRST'])
+        self.assertFalse(app.scheduler.jobs)
+        self.assertFalse(app.lock_manager.held)
+        self.assertFalse(app.instrument_scheduler.requests)
+        self.assertIsNone(mission_snapshot.version_of(mission.id))
+
+    def test_deactivate_suspended(self):
+        mission = self.create()
+        mission.activate()
+        app.scheduler.fire(mission.name)
+        self.assertIn(mission._resume_job_id(), app.scheduler.jobs)
+
+        # only future runs are unscheduled, the suspended run resumes and completes
+        mission.deactivate()
+        self.assertEqual(list(app.scheduler.jobs), [mission._resume_job_id()])
+        self.assertEqual(app.lock_manager.held, {'CAMDS'})
+
+        app.scheduler.fire(mission._resume_job_id())
+        self.assertEqual(mission.executor.commands, ['FIRST', 'SECOND'])
+        self.assertEqual(self.events(mission), ['start', 'completion'])
+        self.assertFalse(app.lock_manager.held)
+        self.assertFalse(app.instrument_scheduler.requests)
+
+    def failing(self, backoff=0, inner_policy='', run_policy=''):
+        """
+        :param inner_policy: error_policy lines of the inner block definition
+        :param run_policy: error_policy lines of the step running the inner block
+        """
+        mission = self.create(script=NESTED % {'backoff': backoff, 'inner_policy': inner_policy,
+                                               'run_policy': run_policy})
+
+        def fail(command):
+            if command == 'FAIL':
+                raise InstrumentException(command)
+
+        mission.executor.before_command = fail
+        return mission
+
+    def test_nested_retries(self):
+        # the mission policy applies to the failing step, not again to each enclosing block
+        mission = self.failing()
+        mission._execute_mission()
+        self.assertEqual(mission.executor.commands, ['FAIL'] * 3)
+        self.assertEqual(self.events(mission), ['start', 'exception', 'completion'])
+
+    def test_block_retries(self):
+        mission = self.failing(inner_policy='  error_policy:\n    type: retry\n    count: 2\n    backoff: 0')
+        mission._execute_mission()
+        # the inner block is attempted twice, its failing step three times each
+        self.assertEqual(mission.executor.commands, ['FAIL'] * 6)
+        self.assertEqual(self.events(mission), ['start', 'exception', 'completion'])
+
+    def test_block_continue(self):
+        mission = self.failing(run_policy='    error_policy:\n      type: continue')
+        mission._execute_mission()
+        self.assertEqual(mission.executor.commands, ['FAIL'] * 3 + ['LAST'])
+        self.assertEqual(self.events(mission), ['start', 'completion'])
+
+    def test_retry_backoff(self):
+        sleeps = []
+        self.patch_sleep(sleeps.append)
+        mission = self.failing(backoff=7, inner_policy='  error_policy:\n    type: retry\n    count: 2\n    backoff: 11')
+        mission._execute_mission()
+        self.assertEqual(len(mission.executor.commands), 6)
+        # a backoff between the attempts of the step and of the block, none after the last
+        self.assertEqual(sleeps, [7, 7, 11, 7, 7])
+
+    def patch_sleep(self, sleep):
+        module = sys.modules[Mission.__module__]
+
+        class Clock(object):
+            def __getattr__(self, name):
+                return getattr(time, name)
+
+        clock = Clock()
+        clock.sleep = sleep
+        module.time = clock
+        self.addCleanup(setattr, module, 'time', time)
+
+    def test_lost_lock(self):
+        mission = self.create()
+        mission._execute_mission()
+        # the lease expires while the run is suspended
+        app.lock_manager.lost_instruments.add('CAMDS')
+        app.scheduler.fire(mission._resume_job_id())
+        self.assertEqual(mission.executor.commands, ['FIRST'])
+        self.assertEqual(self.events(mission), ['start', 'exception', 'completion'])
+        self.assertFalse(app.lock_manager.held)
+        self.assertFalse(app.instrument_scheduler.requests)
+
+    def test_preempt_running(self):
+        mission = self.create(sleep=0)
+        mission.executor.before_command = lambda command: command == 'FIRST' and self.urgent()
+        mission._execute_mission()
+
+        # checkpointed at the step boundary after the first command, the urgent run takes the driver
+        self.assertEqual(mission.executor.commands, ['FIRST'])
+        self.assertEqual(self.events(mission), ['start', 'preempt'])
+        self.assertEqual(len(self.urgent_started), 1)
+        self.assertFalse(app.lock_manager.held)
+        self.assertIsNone(mission.run_request)
+        self.assertTrue(app.instrument_scheduler.is_queued(mission.name))
+
+        # continues from the checkpoint once the urgent run is done
+        app.instrument_scheduler.release('urgent')
+        self.assertEqual(mission.executor.commands, ['FIRST', 'SECOND'])
+        self.assertEqual(self.events(mission), ['start', 'preempt', 'completion'])
+        self.assertFalse(app.instrument_scheduler.requests)
+
+    def test_preempt_suspended(self):
+        mission = self.create()
+        mission._execute_mission()
+        resume_job = mission._resume_job_id()
+        self.assertIn(resume_job, app.scheduler.jobs)
+        self.assertEqual(app.lock_manager.held, {'CAMDS'})
+
+        # a suspended run is checkpointed immediately, without waiting for its resume job
+        self.urgent()
+        self.assertEqual(len(self.urgent_started), 1)
+        self.assertNotIn(resume_job, app.scheduler.jobs)
+        self.assertEqual(self.events(mission), ['start', 'preempt'])
+        self.assertFalse(app.lock_manager.held)
+
+        # restarted before the end of the sleep, the run is suspended again
+        app.instrument_scheduler.release('urgent')
+        self.assertIn(resume_job, app.scheduler.jobs)
+        self.assertEqual(app.lock_manager.held, {'CAMDS'})
+        self.assertGreater(mission.current_run.resume_time, time.time())
+
+        app.scheduler.fire(resume_job)
+        self.assertEqual(mission.executor.commands, ['FIRST', 'SECOND'])
+        self.assertEqual(self.events(mission), ['start', 'preempt', 'completion'])
+
+    def test_preempt_while_locking(self):
+        mission = self.create(sleep=0, options='error_policy:\n  type: retry\n  count: 2\n  backoff: 0')
+        def before_acquire():
+            # the urgent run is submitted while this run is still locking its instruments
+            app.lock_manager.before_acquire = None
+            self.urgent()
+            raise LockException('held')
+
+        app.lock_manager.before_acquire = before_acquire
+        mission._execute_mission()
+        self.assertEqual(len(self.urgent_started), 1)
+        request = app.instrument_scheduler.requests[mission.name]
+        self.assertFalse(request.preempt_requested)
+
+        # the requeued run starts after the urgent run and is not preempted again
+        app.instrument_scheduler.release('urgent')
+        _, _, delayed = app.instrument_scheduler.delayed.pop()
+        app.instrument_scheduler._resubmit(delayed)
+        self.assertEqual(mission.executor.commands, ['FIRST', 'SECOND'])
+        self.assertEqual(self.events(mission), ['start', 'completion'])
@@ -0,0 +1,64 @@
+import json
+import unittest
+
+from ooi_executive.mission_snapshot import MissionSnapshot, EVENT_LIMIT
+
+__author__ = 'petercable'
+
+
+def summary(active=True, step=None):
+    return {'active': active, 'current_step': step}
+
+
+class MissionSnapshotUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = MissionSnapshot()
+        self.snapshot.update(1, summary(), 'script one')
+        self.snapshot.update(2, summary(active=False), 'script two')
+
+    def test_summaries(self):
+        etag, body = self.snapshot.summaries()
+        self.assertEqual(json.loads(body), {'1': summary(), '2': summary(active=False)})
+        self.assertEqual(self.snapshot.summaries(), (etag, body))
+        self.assertEqual(json.loads(self.snapshot.summaries('inactive')[1]), {'2': summary(active=False)})
+
+        self.snapshot.update(1, summary(step=[0, {'sleep': 1}]))
+        new_etag, body = self.snapshot.summaries()
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(json.loads(body)['1']['current_step'], [0, {'sleep': 1}])
+
+        self.snapshot.remove(2)
+        self.assertEqual(json.loads(self.snapshot.summaries()[1]).keys(), ['1'])
+
+    def test_full_requires_events(self):
+        self.assertIsNone(self.snapshot.full(1))
+        version = self.snapshot.version_of(1)
+        self.snapshot.update(1, summary(step=[0, {}]))
+        # changed while the events were read
+        self.assertFalse(self.snapshot.load_events(1, version, 5, []))
+        self.assertTrue(self.snapshot.load_events(1, self.snapshot.version_of(1), 5, [['t', 'start', '']]))
+
+        etag, body = self.snapshot.full(1)
+        full = json.loads(body)
+        self.assertEqual(full['script'], 'script one')
+        self.assertEqual(full['events'], [['t', 'start', '']])
+        self.assertEqual(self.snapshot.full(1), (etag, body))
+
+    def test_events(self):
+        self.snapshot.load_events(1, self.snapshot.version_of(1), 5, [])
+        self.snapshot.add_event(1, 5, 't1', 'step', json.dumps({'sleep': 1}))
+        self.snapshot.add_event(1, 5, 't2', 'exception', 'not json')
+        self.assertEqual(json.loads(self.snapshot.full(1)[1])['events'],
+                         [['t1', 'step', {'sleep': 1}], ['t2', 'exception', 'not json']])
+
+        # the next run replaces the events
+        for i in range(EVENT_LIMIT + 5):
+            self.snapshot.add_event(1, 6, 't%d' % i, 'step', '')
+        events = json.loads(self.snapshot.full(1)[1])['events']
+        self.assertEqual(len(events), EVENT_LIMIT)
+        self.assertEqual(events[0][0], 't0')
+
+    def test_start_event(self):
+        # the events of a new run are known without reading the database
+        self.snapshot.add_event(2, 7, 't0', 'start', '')
+        self.assertEqual(json.loads(self.snapshot.full(2)[1])['events'], [['t0', 'start', '']])
@@ -0,0 +1,85 @@
+from threading import Thread, Event as ThreadEvent
+import unittest
+
+from ooi_executive.read_cache import ReadCache
+
+__author__ = 'petercable'
+
+
+class Loader(object):
+    def __init__(self, value='value'):
+        self.value = value
+        self.calls = 0
+        self.release = ThreadEvent()
+        self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        return self.value
+
+
+class ReadCacheUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ReadCache()
+
+    def test_max_age(self):
+        loader = Loader()
+        self.assertEqual(self.cache.get('driver', 'state', loader, 10), 'value')
+        self.assertEqual(self.cache.get('driver', 'state', loader, 10), 'value')
+        self.assertEqual(loader.calls, 1)
+        self.cache.get('driver', 'state', loader, 0)
+        self.assertEqual(loader.calls, 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_invalidate(self):
+        loader = Loader()
+        self.cache.get('driver', 'state', loader, 10)
+        self.cache.get('other', 'state', loader, 10)
+        self.cache.invalidate('driver')
+        self.cache.get('driver', 'state', loader, 10)
+        self.cache.get('other', 'state', loader, 10)
+        self.assertEqual(loader.calls, 3)
+
+    def test_single_flight(self):
+        loader = Loader()
+        loader.release.clear()
+        results = []
+
+        def read():
+            results.append(self.cache.get('driver', 'state', loader, 10))
+
+        threads = [Thread(target=read) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while self.cache.stats()['coalesced'] < 4:
+            pass
+        loader.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual(results, ['value'] * 5)
+
+    def test_invalidated_in_flight(self):
+        loader = Loader()
+        loader.release.clear()
+        thread = Thread(target=self.cache.get, args=('driver', 'state', loader, 10))
+        thread.start()
+        while not self.cache.flights:
+            pass
+        self.cache.invalidate('driver')
+        loader.release.set()
+        thread.join()
+
+        # the read may have started before the driver changed, it is not cached
+        self.cache.get('driver', 'state', loader, 10)
+        self.assertEqual(loader.calls, 2)
+
+    def test_error(self):
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            self.cache.get('driver', 'state', fail, 10)
+        self.assertEqual(self.cache.get('driver', 'state', Loader(), 10), 'value')
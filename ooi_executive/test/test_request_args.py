@@ -0,0 +1,59 @@
+from datetime import datetime
+import unittest
+
+from werkzeug.exceptions import BadRequest
+
+from ooi_executive import app
+from ooi_executive.request_args import analysis_args, history_args, number_arg, parse_time
+
+__author__ = 'petercable'
+
+
+class RequestArgsUnitTest(unittest.TestCase):
+    def test_parse_time(self):
+        self.assertIsNone(parse_time(None))
+        self.assertEqual(parse_time('1451703845.5'), datetime.fromtimestamp(1451703845.5))
+        self.assertEqual(parse_time('2016-01-02'), datetime(2016, 1, 2))
+        self.assertEqual(parse_time('2016-01-02 03:04:05'), datetime(2016, 1, 2, 3, 4, 5))
+        self.assertEqual(parse_time('2016-01-02T03:04:05.5'), datetime(2016, 1, 2, 3, 4, 5, 500000))
+        with self.assertRaises(BadRequest):
+            parse_time('yesterday')
+
+    def test_number_arg(self):
+        with app.test_request_context('/?hours=1.5&limit=abc&count=3'):
+            self.assertEqual(number_arg('hours', float), 1.5)
+            self.assertEqual(number_arg('count'), 3)
+            self.assertEqual(number_arg('missing', default=7), 7)
+            with self.assertRaises(BadRequest):
+                number_arg('limit')
+            with self.assertRaises(BadRequest):
+                number_arg('hours')
+        for value in ('inf', '-inf', 'nan'):
+            with app.test_request_context('/?hours=' + value):
+                with self.assertRaises(BadRequest):
+                    number_arg('hours', float)
+
+    def test_history_args(self):
+        with app.test_request_context('/?after_id=5&since=2016-01-02'):
+            self.assertEqual(history_args(), {'limit': app.config['HISTORY_PAGE_SIZE'], 'after_id': 5,
+                                              'since': datetime(2016, 1, 2), 'until': None})
+        with app.test_request_context('/?limit=100000'):
+            self.assertEqual(history_args()['limit'], app.config['HISTORY_MAX_PAGE_SIZE'])
+        with app.test_request_context('/?limit=0'):
+            self.assertEqual(history_args()['limit'], 1)
+        for query in ('limit=abc', 'after_id=1.5', 'until=soon'):
+            with app.test_request_context('/?' + query):
+                with self.assertRaises(BadRequest):
+                    history_args()
+
+    def test_analysis_args(self):
+        with app.test_request_context('/'):
+            self.assertEqual(analysis_args(), {'hours': app.config['SCHEDULE_ANALYSIS_HOURS'], 'worst': False})
+        with app.test_request_context('/?hours=1.5&estimate=worst'):
+            self.assertEqual(analysis_args(), {'hours': 1.5, 'worst': True})
+        with app.test_request_context('/?hours=%d' % app.config['SCHEDULE_ANALYSIS_MAX_HOURS']):
+            self.assertEqual(analysis_args()['hours'], app.config['SCHEDULE_ANALYSIS_MAX_HOURS'])
+        for value in ('0', '-1', 'inf', 'nan', '1e300', str(app.config['SCHEDULE_ANALYSIS_MAX_HOURS'] + 1)):
+            with app.test_request_context('/?hours=' + value):
+                with self.assertRaises(BadRequest):
+                    analysis_args()
@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive.backing_store import ArchivedRun, Base, Event, EventType, MissionData, Run, Script
+from ooi_executive.retention import Retention, RetentionPolicy, RunArchive, archived_events, archived_missions
+
+__author__ = 'petercable'
+
+NOW = datetime(2016, 3, 1, 12)
+
+
+class RetentionUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.session = self.Session()
+        self.session.add_all([EventType(id=1, name='start'), EventType(id=2, name='step'),
+                              EventType(id=3, name='completion')])
+        self.mission = MissionData(name='test')
+        self.session.add(self.mission)
+        script = Script(name='test', version='1', script='', mission=self.mission)
+        self.session.add(script)
+        self.session.flush()
+        self.mission.script = script
+        self.session.commit()
+        self.archive = RunArchive(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_runs(self, start_times):
+        run_ids = []
+        for start_time in start_times:
+            run = Run(mission_id=self.mission.id, start_time=start_time)
+            self.session.add(run)
+            self.session.flush()
+            for i, (type_id, event) in enumerate(((1, ''), (2, json.dumps({'sleep': 1})), (3, ''))):
+                self.session.add(Event(run_id=run.id, timestamp=start_time + timedelta(seconds=i),
+                                       event_type_id=type_id, event=event))
+            run_ids.append(run.id)
+        self.session.commit()
+        return run_ids
+
+    def live_runs(self):
+        return [run_id for run_id, in self.session.query(Run.id).order_by(Run.id)]
+
+    def read(self, run_id):
+        entry = self.session.query(ArchivedRun).filter(ArchivedRun.run_id == run_id).one()
+        return self.archive.read(entry.file, entry.offset, run_id)
+
+    def retention(self, runs=None, days=None, batch_size=100):
+        return Retention(self.Session, self.archive, RetentionPolicy(runs, days), batch_size=batch_size)
+
+    def test_runs_limit(self):
+        run_ids = self.add_runs([NOW - timedelta(hours=i) for i in range(5, 0, -1)])
+        self.assertEqual(self.retention(runs=2, batch_size=2).run(now=NOW), 3)
+        self.session.expire_all()
+        self.assertEqual(self.live_runs(), run_ids[3:])
+        self.assertEqual(self.session.query(Event).count(), 6)
+        self.assertTrue(self.session.query(MissionData).one().archived)
+
+        # archived in two batches, each a member of the month's file
+        self.assertEqual(os.listdir(os.path.join(self.directory, str(self.mission.id))), ['2016-03.jsonl.gz'])
+        offsets = {entry.offset for entry in self.session.query(ArchivedRun)}
+        self.assertEqual(len(offsets), 2)
+        for run_id in run_ids[:3]:
+            run = self.read(run_id)
+            self.assertEqual(run['run_id'], run_id)
+            self.assertEqual([event[2] for event in run['events']], ['start', 'step', 'completion'])
+
+        self.assertEqual(self.retention(runs=2).run(now=NOW), 0)
+
+    def test_days_limit(self):
+        run_ids = self.add_runs([datetime(2016, 1, 31), datetime(2016, 2, 1), datetime(2016, 2, 15)])
+        # the most recent run is kept
+        self.assertEqual(self.retention(days=1).run(now=NOW), 2)
+        self.assertEqual(self.live_runs(), run_ids[2:])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, str(self.mission.id)))),
+                         ['2016-01.jsonl.gz', '2016-02.jsonl.gz'])
+
+    def test_both_limits(self):
+        run_ids = self.add_runs([NOW - timedelta(days=3), NOW - timedelta(days=2), NOW - timedelta(hours=1),
+                                 NOW - timedelta(minutes=1)])
+        # runs are kept while either limit keeps them
+        self.assertEqual(self.retention(runs=1, days=1).run(now=NOW), 2)
+        self.assertEqual(self.live_runs(), run_ids[2:])
+        self.assertEqual(self.retention().run(now=NOW), 0)
+
+    def test_mission_policy(self):
+        self.add_runs([NOW - timedelta(hours=i) for i in range(3, 0, -1)])
+        self.assertEqual(self.retention(runs=1).run({self.mission.id: RetentionPolicy(runs=2)}, now=NOW), 1)
+
+    def test_archived_events(self):
+        run_id = self.add_runs([NOW])[0]
+        self.retention(days=0).run(now=NOW + timedelta(days=1))
+        self.assertEqual(self.live_runs(), [run_id])
+
+        self.add_runs([NOW + timedelta(days=1)])
+        self.retention(days=0).run(now=NOW + timedelta(days=2))
+        run = self.read(run_id)
+        events, next_id = archived_events(run, limit=2)
+        self.assertEqual(events, [(NOW.isoformat(), 'start', ''),
+                                  ((NOW + timedelta(seconds=1)).isoformat(), 'step', {'sleep': 1})])
+        events, next_id = archived_events(run, after_id=next_id)
+        self.assertEqual([event[1] for event in events], ['completion'])
+        self.assertIsNone(next_id)
+        events, _ = archived_events(run, since=NOW + timedelta(seconds=1), event_types=['completion'])
+        self.assertEqual([event[1] for event in events], ['completion'])
+
+        summary = archived_missions(self.session)[self.mission.id]
+        self.assertEqual(summary['archived_runs'], 1)
+        self.assertFalse(summary['deleted'])
+        self.assertEqual(summary['first_run'], NOW.isoformat())
+
+    def test_legacy_runs(self):
+        run_ids = self.add_runs([datetime(2016, 1, 31)])
+        legacy = [Run(mission_id=self.mission.id), Run(mission_id=self.mission.id)]
+        self.session.add_all(legacy)
+        self.session.flush()
+        legacy = [run.id for run in legacy]
+        self.session.add(Event(run_id=legacy[0], timestamp=datetime(2016, 2, 1), event_type_id=1, event=''))
+        self.session.commit()
+        # rows created before start times were recorded
+        self.session.query(Run).filter(Run.id.in_(legacy))\
+            .update({Run.start_time: None}, synchronize_session=False)
+        self.session.commit()
+        recent = self.add_runs([NOW])
+
+        # runs without a start time are archived under their first event, or as unknown without events
+        self.assertEqual(self.retention(days=1).run(now=NOW), 3)
+        self.assertEqual(self.live_runs(), recent)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, str(self.mission.id)))),
+                         ['2016-01.jsonl.gz', '2016-02.jsonl.gz', 'unknown.jsonl.gz'])
+        self.assertEqual(self.read(legacy[0])['start_time'], datetime(2016, 2, 1).isoformat())
+        self.assertIsNone(self.read(legacy[1])['start_time'])
+        self.assertEqual(self.read(run_ids[0])['start_time'], datetime(2016, 1, 31).isoformat())
+
+        summary = archived_missions(self.session)[self.mission.id]
+        self.assertEqual(summary['archived_runs'], 3)
+        self.assertEqual(summary['first_run'], datetime(2016, 1, 31).isoformat())
+
+    def test_mission_failure(self):
+        other = MissionData(name='other')
+        self.session.add(other)
+        self.session.commit()
+        self.add_runs([NOW - timedelta(days=2)])
+        self.session.add_all([Run(mission_id=other.id, start_time=NOW - timedelta(days=2)),
+                              Run(mission_id=other.id, start_time=NOW)])
+        self.session.commit()
+
+        retention = self.retention(days=1)
+        archive = retention._archive
+
+        def failing(session, mission_id, runs, type_names):
+            if mission_id == self.mission.id:
+                raise IOError('disk full')
+            return archive(session, mission_id, runs, type_names)
+
+        retention._archive = failing
+        # the failing mission does not stop the others
+        self.assertEqual(retention.run(now=NOW), 1)
+        self.assertEqual(self.session.query(Run.mission_id).order_by(Run.id).all(),
+                         [(self.mission.id,), (other.id,)])
@@ -0,0 +1,152 @@
+from datetime import datetime
+import random
+import unittest
+
+import pytz
+
+from ooi_executive.compiler import compile_mission
+from ooi_executive.executors import Executor
+from ooi_executive.schedule_analyzer import (Interval, IntervalTree, ScheduledMission, analyze, estimate_duration,
+                                             mission_conflicts)
+from ooi_executive.script_cache import script_cache
+from ooi_executive.simulation import LatencyModel
+
+__author__ = 'petercable'
+
+START = pytz.utc.localize(datetime(2016, 1, 1))
+
+SAMPLE = '''
+name: %(name)s
+desc: sample
+version: 1-00
+drivers:
+- %(driver)s
+schedule:
+  minute: '%(minute)s'
+blocks:
+- label: mission
+  sequence:
+  - execute: %(driver)s
+    command: ACQUIRE_SAMPLE
+    timeout: 10000
+    error_policy:
+      type: retry
+      count: 2
+      backoff: 5
+  - sleep: %(sleep)s
+'''
+
+PARALLEL = '''
+name: parallel
+desc: parallel
+version: 1-00
+drivers:
+- A
+- B
+- C
+blocks:
+- label: mission
+  sequence:
+  - parallel: [a, b, c]
+    max_concurrency: 2
+  - block_name: loop
+    loop: 3
+- label: a
+  sequence:
+  - sleep: 10
+- label: b
+  sequence:
+  - sleep: 20
+- label: c
+  sequence:
+  - sleep: 30
+- label: loop
+  sequence:
+  - get_state: A
+'''
+
+
+def scheduled(script):
+    mission = script_cache.load(script)
+    return ScheduledMission(mission['name'], mission, compile_mission(mission, Executor(mission['name'], 30000)))
+
+
+def sample(name, driver='CAMDS', minute='*/10', sleep=100):
+    return scheduled(SAMPLE % {'name': name, 'driver': driver, 'minute': minute, 'sleep': sleep})
+
+
+class IntervalTreeUnitTest(unittest.TestCase):
+    def test_overlapping(self):
+        rand = random.Random(1)
+        intervals = []
+        for i in range(500):
+            start = rand.uniform(0, 1000)
+            intervals.append(Interval(start, start + rand.choice([0, 0.5, 5, 50]), i))
+        tree = IntervalTree(intervals)
+        self.assertEqual(len(tree), sum(1 for interval in intervals if interval.end > interval.start))
+        for _ in range(200):
+            start = rand.uniform(-10, 1010)
+            end = start + rand.choice([0.1, 1, 20])
+            expected = {interval.mission for interval in intervals
+                        if interval.start < end and interval.end > start and interval.end > interval.start}
+            self.assertEqual({interval.mission for interval in tree.overlapping(start, end)}, expected)
+
+    def test_half_open(self):
+        tree = IntervalTree([Interval(0, 10, 'a'), Interval(10, 20, 'b')])
+        self.assertEqual([interval.mission for interval in tree.overlapping(10, 11)], ['b'])
+        self.assertEqual(IntervalTree([]).overlapping(0, 10), [])
+
+
+class EstimateUnitTest(unittest.TestCase):
+    def test_command(self):
+        estimate = estimate_duration(sample('sample').program, default=2)
+        # lock, command, sleep and unlock
+        self.assertEqual(estimate.expected, 106)
+        # two attempts timing out with a backoff between them
+        self.assertEqual(estimate.worst, 2 + 20 + 5 + 100 + 2)
+
+    def test_history(self):
+        model = LatencyModel()
+        model.add('execute_resource', 'CAMDS', 30)
+        model.add('lock', 'CAMDS', 0.5)
+        self.assertEqual(estimate_duration(sample('sample').program, model, default=2).expected, 132.5)
+
+    def test_parallel(self):
+        estimate = estimate_duration(scheduled(PARALLEL).program, default=1)
+        # two branches at a time need at least 30 seconds, the loop runs three times
+        self.assertEqual(estimate.expected, 2 + 30 + 3)
+
+
+class AnalyzeUnitTest(unittest.TestCase):
+    def test_conflicts(self):
+        missions = [sample('first'), sample('second', minute='1-59/10'), sample('other', driver='PREST')]
+        results = analyze(missions, START, 3600, default=2, pool_sizes={'runs': 1}, min_window=300)
+
+        camds = results['instruments']['CAMDS']
+        self.assertEqual(camds['runs'], 12)
+        self.assertEqual(camds['peak'], 2)
+        self.assertEqual(camds['conflicts'], [{'missions': ['first', 'second'], 'count': 6, 'seconds': 276.0,
+                                               'first': '2016-01-01T00:01:00+00:00'}])
+        self.assertEqual(results['conflicts'], 6)
+        self.assertAlmostEqual(camds['held_fraction'], 6 * 166 / 3600.0)
+        self.assertEqual(camds['free_windows'][0], {'start': '2016-01-01T00:02:46+00:00',
+                                                    'end': '2016-01-01T00:10:00+00:00', 'seconds': 434.0})
+        self.assertEqual(results['instruments']['PREST']['conflicts'], [])
+        self.assertEqual(results['pools']['runs']['peak'], 3)
+        self.assertTrue(results['pools']['runs']['saturated'])
+
+        self.assertEqual(mission_conflicts(results, 'second')['conflicts'][0]['mission'], 'first')
+        self.assertEqual(mission_conflicts(results, 'other'), {'saturated_pool': 'runs'})
+
+    def test_skipped(self):
+        results = analyze([sample('slow', minute='*', sleep=100)], START, 600, default=1)
+        mission = results['missions']['slow']
+        self.assertEqual(mission['runs'], 5)
+        self.assertEqual(mission['skipped'], 5)
+        self.assertEqual(results['instruments']['CAMDS']['conflicts'], [])
+
+    def test_unscheduled(self):
+        script = SAMPLE.replace("minute: '%(minute)s'", 'source: oms\n  event: alert') % {
+            'name': 'alert', 'driver': 'CAMDS', 'minute': '*/10', 'sleep': 1}
+        results = analyze([scheduled(script)], START, 600)
+        self.assertEqual(results['unscheduled'], ['alert'])
@@ -5,7 +5,7 @@ from jsonschema import validate, ValidationError
 from ooi_executive.mission_schema import \
     RetryPolicy, Cron, DateTime, Event, \
     Mission, Execute, GetParameter, SetParameter, \
-    GetState, Discover, Reset, SimplePolicy, Block, SetInitParams, Configure
+    GetState, Discover, Reset, SimplePolicy, Block, SetInitParams, Configure, Parallel, SetParameters
 
 __author__ = 'petercable'
 
@@ -67,6 +67,13 @@ class SchemaUnitTest(unittest.TestCase):
         schema = Event.get_schema()
         validate(d, schema)
 
+    def test_event_pattern_schedule(self):
+        d = {'source': '*',
+             'event': 'Shallow Profiler Event Number 6[0-9]',
+             'pattern': True}
+        schema = Event.get_schema()
+        validate(d, schema)
+
     def test_execute(self):
         d = {'execute': 'refdes',
              'command': 'DRIVER_EVENT_START_AUTOSAMPLE',
@@ -93,6 +100,16 @@ class SchemaUnitTest(unittest.TestCase):
         schema = SetParameter.get_schema()
         validate(d, schema)
 
+    def test_set_params(self):
+        d = {'set': 'refdes', 'parameters': {'p1': 5, 'p2': 'value'}}
+        schema = SetParameters.get_schema()
+        validate(d, schema)
+
+        for bad in [{'set': 'refdes', 'parameters': {}},
+                    {'set': 'refdes', 'parameters': {'p1': [1]}}]:
+            with self.assertRaises(ValidationError):
+                validate(bad, schema)
+
     def test_get_state(self):
         d = {'get_state': 'refdes',
              'error_policy': {'type': 'abort'},
@@ -136,11 +153,49 @@ class SchemaUnitTest(unittest.TestCase):
                  {'sleep': 2.5},
                  {'set': 'refdes', 'parameter': 'p1', 'value': 5},
                  {'block_name': 'capture'},
-             ]
+                 {'block_name': 'capture', 'error_policy': {'type': 'continue'}},
+                 {'sequence': [{'block_name': 'capture'}], 'error_policy': {'type': 'retry', 'count': 2, 'backoff': 5}},
+             ],
+             'error_policy': {'type': 'abort'},
              }
         schema = Block.get_schema()
         validate(d, schema)
 
+    def test_parallel(self):
+        d = {'parallel': ['capture',
+                          {'block_name': 'status', 'error_policy': {'type': 'continue'}}],
+             'max_concurrency': 2,
+             'join': 'fail_fast'}
+        schema = Parallel.get_schema()
+        validate(d, schema)
+
+        for bad in [{'parallel': []},
+                    {'parallel': ['capture'], 'join': 'any'},
+                    {'parallel': ['capture'], 'max_concurrency': 0}]:
+            with self.assertRaises(ValidationError):
+                validate(bad, schema)
+
+    def test_fanout(self):
+        d = {'name': 'test', 'desc': 'test', 'version': '1', 'drivers': ['a', 'b'],
+             'fanout': {'max_concurrency': 1, 'error_policy': {'type': 'continue'}},
+             'blocks': [{'label': 'mission', 'sequence': [{'get_state': '{driver}'}]}]}
+        schema = Mission.get_schema()
+        validate(d, schema)
+
+        d['fanout'] = {'join': 'any'}
+        with self.assertRaises(ValidationError):
+            validate(d, schema)
+
+    def test_priority(self):
+        d = {'name': 'test', 'desc': 'test', 'version': '1', 'drivers': ['a'], 'priority': 10,
+             'blocks': [{'label': 'mission', 'sequence': [{'get_state': 'a'}]}]}
+        schema = Mission.get_schema()
+        validate(d, schema)
+
+        d['priority'] = -1
+        with self.assertRaises(ValidationError):
+            validate(d, schema)
+
     # mission
     def test_mission_schema(self):
         d = {
@@ -0,0 +1,46 @@
+import unittest
+
+from jsonschema import ValidationError
+from yaml import YAMLError
+
+from ooi_executive.script_cache import ScriptCache
+
+__author__ = 'petercable'
+
+
+SCRIPT = '''
+name: test
+desc: test mission
+version: 1-00
+drivers:
+- refdes
+blocks:
+- label: mission
+  sequence:
+  - get_state: refdes
+'''
+
+
+class ScriptCacheUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ScriptCache(max_size=2)
+
+    def test_load(self):
+        mission = self.cache.load(SCRIPT)
+        self.assertEqual(mission['name'], 'test')
+        self.assertIs(self.cache.load(unicode(SCRIPT)), mission)
+        self.assertEqual(self.cache.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_eviction(self):
+        first = self.cache.load(SCRIPT)
+        self.cache.load(SCRIPT.replace('1-00', '1-01'))
+        self.cache.load(SCRIPT.replace('1-00', '1-02'))
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.assertIsNot(self.cache.load(SCRIPT), first)
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.cache.load(SCRIPT.replace('name: test', ''))
+        with self.assertRaises(YAMLError):
+            self.cache.load('name: [')
+        self.assertEqual(self.cache.stats()['size'], 0)
@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ooi_executive.backing_store import Base, Event, EventType
+from ooi_executive.simulation import LatencyModel, SimulatedExecutor, Simulation
+from ooi_executive.tracing import Trace
+
+__author__ = 'petercable'
+
+START = pytz.utc.localize(datetime(2016, 1, 1))
+
+STATUS = '''
+name: %(name)s
+desc: status
+version: 1-00
+drivers:
+- %(driver)s
+schedule:
+  minute: '*'
+blocks:
+- label: mission
+  sequence:
+  - execute: %(driver)s
+    command: DRIVER_EVENT_ACQUIRE_STATUS
+'''
+
+SLEEPY = '''
+name: sleepy
+desc: sleeps between two samples
+version: 1-00
+drivers:
+- CAMDS
+schedule:
+  minute: 0
+blocks:
+- label: mission
+  sequence:
+  - execute: CAMDS
+    command: ACQUIRE_SAMPLE
+  - sleep: 600
+  - execute: CAMDS
+    command: ACQUIRE_SAMPLE
+'''
+
+
+class LatencyModelUnitTest(unittest.TestCase):
+    def test_sample(self):
+        model = LatencyModel(default=5, max_samples=10, seed=1)
+        for i in range(100):
+            model.add('get_state', 'PREST', i)
+        self.assertEqual(len(model.samples[('get_state', 'PREST')][1]), 10)
+        self.assertLess(model.sample('get_state', 'PREST'), 100)
+        # unobserved drivers use the samples of the command
+        self.assertLess(model.sample('get_state', 'FLORD'), 100)
+        self.assertEqual(model.sample('set_resource', 'PREST'), 5)
+
+    def test_fit(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            engine = create_engine('sqlite:///%s' % os.path.join(tmpdir, 'test.db'))
+            Base.metadata.create_all(engine)
+            session = sessionmaker(bind=engine)()
+            types = {}
+            for name in ('step', 'result', 'trace'):
+                types[name] = EventType(name=name)
+                session.add(types[name])
+            session.flush()
+
+            # a run recorded before traces
+            start = datetime(2016, 1, 1)
+            session.add(Event(run_id=1, timestamp=start, event_type_id=types['step'].id,
+                              event=json.dumps({'get_state': 'PREST'})))
+            session.add(Event(run_id=1, timestamp=start + timedelta(seconds=2), event_type_id=types['result'].id,
+                              event='{}'))
+
+            trace = Trace('run', 'status')
+            with trace.span('step', 'mission[0] execute_resource FLORD'):
+                pass
+            trace.close()
+            session.add(Event(run_id=2, timestamp=start, event_type_id=types['trace'].id,
+                              event=json.dumps(trace.drain())))
+            session.commit()
+
+            model = LatencyModel()
+            model.fit(session)
+            session.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(model.samples[('get_state', 'PREST')][1], [2])
+        self.assertEqual(model.samples[('execute_resource', 'FLORD')][0], 1)
+
+
+class SimulationUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.model = LatencyModel(default=1)
+        self.model.add('execute_resource', 'PREST', 20)
+        self.simulation = Simulation(START, self.model)
+
+    def test_shared_driver(self):
+        self.simulation.add_mission(STATUS % {'name': 'first', 'driver': 'PREST'})
+        self.simulation.add_mission(STATUS % {'name': 'second', 'driver': 'PREST'})
+        self.simulation.add_mission(STATUS % {'name': 'other', 'driver': 'FLORD'})
+        results = self.simulation.run(600)
+
+        # runs fire on both ends of the horizon, the last ones are still in progress
+        self.assertEqual(results['missions']['other']['completed'], 10)
+        self.assertEqual(results['missions']['first']['completed'], 10)
+        self.assertEqual(results['missions']['second']['completed'], 10)
+        self.assertEqual(results['runs']['in_progress'], 3)
+        prest = results['instruments']['PREST']
+        self.assertEqual(prest['conflicts'], 11)
+        self.assertEqual(prest['commands'], 20)
+        self.assertAlmostEqual(prest['busy_fraction'], 400 / 600.0)
+        # lock, command and unlock of the run holding the driver
+        self.assertEqual(results['runs']['queue_wait_seconds']['max'], 22)
+
+    def test_suspend(self):
+        self.model.add('execute_resource', 'CAMDS', 2)
+        self.simulation.add_mission(SLEEPY)
+        results = self.simulation.run(3600)
+        self.assertEqual(results['missions']['sleepy']['mean_duration'], 606)
+        # the sleep releases the run thread and resumes on the scheduler pool
+        self.assertEqual(results['pools']['scheduler_default']['max_busy'], 1)
+        self.assertAlmostEqual(results['pools']['runs']['mean_busy'], 3 / 3600.0)
+        self.assertAlmostEqual(results['instruments']['CAMDS']['held_fraction'], 606 / 3600.0)
+
+    def test_skipped(self):
+        self.model.add('execute_resource', 'SLOW', 90)
+        self.simulation.add_mission(STATUS % {'name': 'slow', 'driver': 'SLOW'})
+        results = self.simulation.run(600)
+        self.assertEqual(results['missions']['slow']['skipped'], 5)
+
+    def test_cached_read(self):
+        reads = {}
+        executor = SimulatedExecutor('test', self.model, lambda: 0, reads)
+        read = executor.prepare('get_state', 'PREST', (), 1000, max_age=10)
+        self.assertEqual(read().duration, 1)
+        self.assertEqual(read().duration, 0)
+        self.assertEqual(read().value, 'DRIVER_STATE_COMMAND')
+        executor.prepare('execute_resource', 'PREST', ('command', {}), 1000)()
+        self.assertEqual(read().duration, 1)
@@ -0,0 +1,88 @@
+from threading import Thread
+import json
+import unittest
+
+from ooi_executive import tracing
+from ooi_executive.compiler import Block
+from ooi_executive.run_state import RunState
+from ooi_executive.tracing import Trace
+
+__author__ = 'petercable'
+
+
+class TracingUnitTest(unittest.TestCase):
+    def test_nesting(self):
+        trace = Trace('run', 'mission')
+        with trace.span('step', 'main[0]'):
+            with tracing.child('http', 'PREST'):
+                pass
+
+            results = []
+            thread = Thread(target=tracing.bind(lambda: results.append(tracing.current())))
+            thread.start()
+            thread.join()
+        trace.close()
+
+        spans = {span['name']: span for span in tracing.decode(trace.drain())}
+        self.assertEqual(spans['main[0]']['parent'], spans['mission']['id'])
+        self.assertEqual(spans['PREST']['parent'], spans['main[0]']['id'])
+        self.assertEqual(results[0].name, 'main[0]')
+        self.assertIsNone(tracing.current())
+        self.assertIsNone(trace.drain())
+
+    def test_child_without_span(self):
+        with tracing.child('http', 'PREST') as span:
+            self.assertIsNone(span)
+
+    def test_error(self):
+        trace = Trace()
+        with self.assertRaises(ValueError):
+            with trace.span('step', 'main[0]'):
+                raise ValueError
+        spans = tracing.decode(trace.drain())
+        self.assertEqual(spans[0]['attrs'], {'error': 'ValueError'})
+
+    def test_encode(self):
+        trace = Trace('run', 'mission')
+        for _ in range(3):
+            trace.start('step', 'main[0]').finish()
+        data = json.loads(json.dumps(trace.drain()))
+        self.assertEqual(data['names'], ['step', 'main[0]'])
+        self.assertEqual(len(data['spans']), 3)
+        self.assertTrue(all(len(row) == 6 for row in data['spans']))
+
+        trace.close()
+        spans = tracing.decode(trace.drain())
+        self.assertEqual(spans[0]['kind'], 'run')
+        self.assertIsNone(spans[0]['parent'])
+
+    def test_summarize(self):
+        spans = [
+            {'id': 1, 'parent': None, 'kind': 'run', 'name': 'mission', 'start': 0, 'duration': 10},
+            {'id': 2, 'parent': 1, 'kind': 'step', 'name': 'main[0]', 'start': 0, 'duration': 4},
+            {'id': 3, 'parent': 2, 'kind': 'http', 'name': 'PREST', 'start': 0, 'duration': 3},
+            {'id': 4, 'parent': 1, 'kind': 'step', 'name': 'main[0]', 'start': 4, 'duration': 2},
+            {'id': 5, 'parent': 4, 'kind': 'http', 'name': 'PREST', 'start': 4, 'duration': 1},
+        ]
+        summary = tracing.summarize(spans)
+        self.assertEqual(summary['step']['main[0]'], {'count': 2, 'total': 6, 'max': 4, 'mean': 3, 'http': 4})
+        self.assertEqual(summary['http']['PREST']['total'], 4)
+
+    def test_run_state_spans(self):
+        inner = Block('inner', [None])
+        main = Block('main', [None])
+        state = RunState(1, None, trace=Trace('run', 'mission'))
+        state.push(main)
+        state.push(inner, loop=2)
+        state.next_iteration()
+        state.next_iteration()
+        state.next_iteration()
+        self.assertTrue(state.complete)
+
+        spans = tracing.decode(state.trace.drain())
+        kinds = [(span['kind'], span['name']) for span in spans]
+        self.assertEqual(kinds, [('iteration', 'inner'), ('iteration', 'inner'), ('block', 'inner'), ('block', 'main')])
+        by_id = {span['id']: span for span in spans}
+        self.assertEqual(by_id[spans[2]['parent']]['name'], 'main')
+        self.assertEqual(spans[0]['parent'], spans[2]['id'])
+        self.assertEqual(spans[3]['parent'], state.trace.root.id)
@@ -0,0 +1,52 @@
+import unittest
+
+from ooi_executive.triggers import TriggerRegistry
+
+__author__ = 'petercable'
+
+
+class TriggerRegistryUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = TriggerRegistry()
+        self.fired = []
+
+    def callback(self, name):
+        return lambda source, event: self.fired.append(name)
+
+    def test_exact(self):
+        self.registry.register(1, 'oms', 'heartbeat failure', self.callback(1))
+        self.registry.register(2, 'oms', 'other', self.callback(2))
+        self.assertEqual(self.registry.dispatch('oms', 'heartbeat failure'), 1)
+        self.assertEqual(self.fired, [1])
+        self.assertEqual(self.registry.dispatch('SC01A', 'heartbeat failure'), 0)
+
+    def test_wildcard_source(self):
+        self.registry.register(1, '*', 'heartbeat failure', self.callback(1))
+        self.registry.dispatch('SC01A', 'heartbeat failure')
+        self.registry.dispatch('oms', 'heartbeat failure')
+        self.assertEqual(self.fired, [1, 1])
+
+    def test_pattern(self):
+        self.registry.register(1, 'SC01A', r'Shallow Profiler Event Number 6\d$', self.callback(1), pattern=True)
+        self.registry.dispatch('SC01A', 'Shallow Profiler Event Number 65')
+        self.registry.dispatch('SC01A', 'Shallow Profiler Event Number 75')
+        self.registry.dispatch('SC01A', None)
+        self.assertEqual(self.fired, [1])
+
+    def test_unregister(self):
+        self.registry.register(1, 'oms', 'heartbeat failure', self.callback(1))
+        self.registry.register(1, 'oms', 'other', self.callback(1))
+        self.assertEqual(len(self.registry), 1)
+        self.registry.dispatch('oms', 'heartbeat failure')
+        self.registry.unregister(1)
+        self.registry.unregister(1)
+        self.registry.dispatch('oms', 'other')
+        self.assertEqual(self.fired, [])
+
+    def test_callback_exception(self):
+        def fail(source, event):
+            raise ValueError
+        self.registry.register(1, 'oms', 'event', fail)
+        self.registry.register(2, 'oms', 'event', self.callback(2))
+        self.registry.dispatch('oms', 'event')
+        self.assertEqual(self.fired, [2])
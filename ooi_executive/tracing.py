@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+from itertools import count
+from threading import Lock, local
+import time
+
+__author__ = 'petercable'
+
+# time.monotonic is not available before python 3.3
+clock = getattr(time, 'monotonic', time.time)
+
+_local = local()
+
+
+class Span(object):
+    """
+    A timed section of a run
+    :param parent: enclosing Span, None for the root span of a run
+    :param start: clock() value when the span started
+    """
+    __slots__ = ('trace', 'id', 'parent', 'kind', 'name', 'start', 'end', 'attrs')
+
+    def __init__(self, trace, span_id, parent, kind, name, start, attrs):
+        self.trace = trace
+        self.id = span_id
+        self.parent = parent
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = None
+        self.attrs = attrs
+
+    def finish(self, **attrs):
+        self.attrs.update(attrs)
+        self.trace.finish(self)
+
+    def __repr__(self):
+        return 'Span(%r, %r)' % (self.kind, self.name)
+
+
+class Trace(object):
+    """
+    The spans of one mission run.
+
+    Span times are taken from a monotonic clock and recorded as offsets in
+    seconds from origin, the wall clock time the run was submitted. Finished
+    spans are handed out once by drain() to be persisted.
+    :param kind: kind of the root span
+    :param name: name of the root span
+    :param origin: wall clock time of the start of the root span, defaults to now
+    """
+    def __init__(self, kind='run', name='', origin=None):
+        wall = time.time()
+        now = clock()
+        self.origin = origin if origin is not None else wall
+        # clock() value at origin
+        self.base = now - (wall - self.origin)
+        self.ids = count(1)
+        self.lock = Lock()
+        self.open = {}
+        self.finished = []
+        self.root = self.start(kind, name, start=self.base)
+
+    def start(self, kind, name, parent=None, start=None, **attrs):
+        span = Span(self, next(self.ids), parent, kind, name, clock() if start is None else start, attrs)
+        with self.lock:
+            self.open[span.id] = span
+        return span
+
+    def finish(self, span):
+        with self.lock:
+            if self.open.pop(span.id, None) is not None:
+                span.end = clock()
+                self.finished.append(span)
+
+    def close(self):
+        """
+        Finish every open span, the root span last
+        """
+        with self.lock:
+            spans = sorted(self.open.values(), key=lambda s: s.id, reverse=True)
+        for span in spans:
+            span.finish()
+
+    @contextmanager
+    def span(self, kind, name, parent=None, **attrs):
+        """
+        Time the enclosed code, spans started on this thread by child() are nested inside
+        """
+        span = self.start(kind, name, parent or self.root, **attrs)
+        try:
+            with activate(span):
+                yield span
+        except Exception as e:
+            span.attrs['error'] = e.__class__.__name__
+            raise
+        finally:
+            span.finish()
+
+    def drain(self):
+        """
+        :return: the spans finished since the last call, encoded for storage, or None
+        """
+        with self.lock:
+            spans, self.finished = self.finished, []
+        if spans:
+            return self.encode(spans)
+
+    def snapshot(self):
+        """
+        :return: the spans finished since the last drain and the open spans, as dictionaries
+        """
+        now = clock()
+        with self.lock:
+            spans = self.finished + self.open.values()
+        return [self._span_dict(span, now) for span in sorted(spans, key=lambda s: s.id)]
+
+    def _span_dict(self, span, now):
+        end = span.end if span.end is not None else now
+        d = {
+            'id': span.id,
+            'parent': span.parent.id if span.parent is not None else None,
+            'kind': span.kind,
+            'name': span.name,
+            'start': round(span.start - self.base, 6),
+            'duration': round(end - span.start, 6),
+        }
+        if span.attrs:
+            d['attrs'] = span.attrs
+        if span.end is None:
+            d['open'] = True
+        return d
+
+    def encode(self, spans):
+        """
+        Spans as rows of [id, parent, kind, name, start, duration(, attrs)],
+        with the kind and name strings replaced by their index in names
+        """
+        names = []
+        index = {}
+
+        def intern(value):
+            if value not in index:
+                index[value] = len(names)
+                names.append(value)
+            return index[value]
+
+        rows = []
+        for span in spans:
+            row = [span.id, span.parent.id if span.parent is not None else None,
+                   intern(span.kind), intern(span.name),
+                   round(span.start - self.base, 6), round(span.end - span.start, 6)]
+            if span.attrs:
+                row.append(span.attrs)
+            rows.append(row)
+        return {'origin': self.origin, 'names': names, 'spans': rows}
+
+
+def decode(data):
+    """
+    Spans encoded by Trace.encode as dictionaries
+    """
+    names = data['names']
+    spans = []
+    for row in data['spans']:
+        span = {
+            'id': row[0],
+            'parent': row[1],
+            'kind': names[row[2]],
+            'name': names[row[3]],
+            'start': row[4],
+            'duration': row[5],
+        }
+        if len(row) > 6:
+            span['attrs'] = row[6]
+        spans.append(span)
+    return spans
+
+
+def summarize(spans):
+    """
+    Aggregate span durations
+    :param spans: span dictionaries
+    :return: dictionary of kind to name to count, total, max and mean duration,
+             the step totals also include the time spent in instrument agent requests
+    """
+    by_id = {span['id']: span for span in spans}
+    summary = {}
+    for span in spans:
+        entry = summary.setdefault(span['kind'], {}).setdefault(span['name'], {'count': 0, 'total': 0, 'max': 0})
+        entry['count'] += 1
+        entry['total'] += span['duration']
+        entry['max'] = max(entry['max'], span['duration'])
+
+        parent = by_id.get(span['parent'])
+        if span['kind'] == 'http' and parent is not None and parent['kind'] == 'step':
+            step = summary.setdefault('step', {}).setdefault(parent['name'], {'count': 0, 'total': 0, 'max': 0})
+            step['http'] = step.get('http', 0) + span['duration']
+
+    for names in summary.itervalues():
+        for entry in names.itervalues():
+            entry['mean'] = entry['total'] / entry['count'] if entry['count'] else 0
+    return summary
+
+
+def current():
+    """
+    :return: the span active on this thread, or None
+    """
+    return getattr(_local, 'span', None)
+
+
+@contextmanager
+def activate(span):
+    previous = current()
+    _local.span = span
+    try:
+        yield span
+    finally:
+        _local.span = previous
+
+
+@contextmanager
+def child(kind, name, **attrs):
+    """
+    Time the enclosed code as a child of the span active on this thread, if any
+    """
+    parent = current()
+    if parent is None:
+        yield None
+        return
+    with parent.trace.span(kind, name, parent, **attrs) as span:
+        yield span
+
+
+def bind(func):
+    """
+    Wrap func to run inside the span active on this thread when it is called on another thread
+    """
+    span = current()
+    if span is None:
+        return func
+
+    def bound(*args, **kwargs):
+        with activate(span):
+            return func(*args, **kwargs)
+    return bound
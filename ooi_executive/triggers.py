@@ -0,0 +1,79 @@
+from threading import Lock
+import logging
+import re
+
+__author__ = 'petercable'
+
+log = logging.getLogger(__name__)
+
+
+class TriggerRegistry(object):
+    """
+    Index of the OMS alerts which trigger missions.
+
+    Exact triggers are keyed by (source, event) and patterns (regular
+    expressions matched against the alert messageText) are grouped by source,
+    so dispatching an alert only looks at the triggers registered for its
+    source and for the wildcard source. Readers use an immutable snapshot which
+    is replaced whenever a trigger is registered or removed.
+    """
+    WILDCARD = '*'
+
+    def __init__(self):
+        self.lock = Lock()
+        self.triggers = {}
+        self.exact = {}
+        self.patterns = {}
+
+    def register(self, key, source, event, callback, pattern=False):
+        """
+        Register a trigger, replacing any trigger previously registered with this key
+        :param key: owner of the trigger (mission id)
+        :param source: OMS platform id or WILDCARD
+        :param event: alert messageText or a regular expression if pattern is set
+        :param callback: called with (source, event) when a matching alert arrives
+        """
+        matcher = re.compile(event) if pattern else None
+        with self.lock:
+            self.triggers[key] = (source, event, matcher, callback)
+            self._rebuild()
+        log.debug('Registered trigger %r: %r %r', key, source, event)
+
+    def unregister(self, key):
+        with self.lock:
+            if self.triggers.pop(key, None) is not None:
+                self._rebuild()
+                log.debug('Removed trigger %r', key)
+
+    def _rebuild(self):
+        exact = {}
+        patterns = {}
+        for source, event, matcher, callback in self.triggers.itervalues():
+            if matcher is None:
+                exact.setdefault((source, event), []).append(callback)
+            else:
+                patterns.setdefault(source, []).append((matcher, callback))
+        self.exact = exact
+        self.patterns = patterns
+
+    def match(self, source, event):
+        exact = self.exact
+        patterns = self.patterns
+        callbacks = exact.get((source, event), []) + exact.get((self.WILDCARD, event), [])
+        for key in (source, self.WILDCARD):
+            for matcher, callback in patterns.get(key, []):
+                if event is not None and matcher.search(event):
+                    callbacks.append(callback)
+        return callbacks
+
+    def dispatch(self, source, event):
+        callbacks = self.match(source, event)
+        for callback in callbacks:
+            try:
+                callback(source, event)
+            except Exception as e:
+                log.exception('Exception dispatching event %r %r: %r', source, event, e)
+        return len(callbacks)
+
+    def __len__(self):
+        return len(self.triggers)